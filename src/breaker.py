@@ -0,0 +1,200 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Fail fast on kubernetes API requests while the apiserver is unreachable."""
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Mapping, Optional
+
+import httpx
+from lightkube import Client
+from lightkube.core.exceptions import ApiError
+from lightkube.resources.core_v1 import Namespace
+
+log = logging.getLogger(__name__)
+
+# consecutive connection failures opening the circuit
+FAILURE_THRESHOLD = 3
+# bounds in seconds of the backoff before probing an open circuit again
+MIN_BACKOFF = 10.0
+MAX_BACKOFF = 300.0
+PROBE_NAMESPACE = "kube-system"
+
+
+class ApiUnavailable(httpx.ConnectError):
+    """A request wasn't sent, the circuit is open or the dispatch ran out of time."""
+
+
+class CircuitBreaker:
+    """Circuit breaker over the apiserver connections of the charm.
+
+    After FAILURE_THRESHOLD consecutive connection failures the circuit opens
+    and requests fail fast with ApiUnavailable until a jittered retry time.
+    Then a single probe request either closes it or keeps it open with twice
+    the backoff. Its state is a small mapping of plain values, so it can be
+    kept in the charm's StoredState across dispatches.
+
+    A deadline additionally bounds the time requests may take within a
+    dispatch, counted from its first request so earlier waits of the hook
+    don't use it up: each request's timeout is capped to the remaining time,
+    and no request is sent past it. Time spent in deliberate waits, like
+    following a rollout, is left out of it. A request timing out only because
+    its timeout was capped doesn't count as a connection failure.
+    """
+
+    def __init__(self, state: Optional[Mapping] = None, deadline: float = 0.0):
+        state = state or {}
+        self.failures: int = state.get("failures", 0)
+        self.backoff: float = state.get("backoff", 0.0)
+        self.retry_at: float = state.get("retry_at", 0.0)
+        self.budget = deadline
+        self.deadline: Optional[float] = None
+        self._pauses = 0
+        self._paused_since: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """True while the apiserver is held as unreachable."""
+        return self.failures >= FAILURE_THRESHOLD
+
+    def state(self) -> Dict:
+        """Plain representation of the circuit."""
+        return {"failures": self.failures, "backoff": self.backoff, "retry_at": self.retry_at}
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, None without a deadline."""
+        if not self.budget:
+            return None
+        if self.deadline is None:
+            return self.budget
+        return self.deadline - self._now()
+
+    def _now(self) -> float:
+        """Time on the deadline's clock, which stands still while paused."""
+        return time.monotonic() if self._paused_since is None else self._paused_since
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """Leave the time spent within out of the deadline, for deliberate waits."""
+        with self._lock:
+            self._pauses += 1
+            if self._pauses == 1:
+                self._paused_since = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pauses -= 1
+                if not self._pauses:
+                    if self.deadline is not None:
+                        self.deadline += time.monotonic() - self._paused_since
+                    self._paused_since = None
+
+    def allow(self):
+        """Let a request through, or raise ApiUnavailable.
+
+        Once the retry time is reached, the one request let through probes the
+        apiserver. The retry time moves on meanwhile, so concurrent requests
+        still fail fast.
+        """
+        with self._lock:
+            if self.budget and self.deadline is None:
+                self.deadline = self._now() + self.budget
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise ApiUnavailable("Deadline for kube-apiserver requests exceeded")
+        with self._lock:
+            if not self.is_open:
+                return
+            now = time.time()
+            if now < self.retry_at:
+                raise ApiUnavailable(
+                    f"kube-apiserver unreachable, retry in {self.retry_at - now:.0f}s"
+                )
+            self.retry_at = now + self.backoff
+
+    def success(self):
+        """Close the circuit after a request reached the apiserver."""
+        with self._lock:
+            if self.is_open:
+                log.info("kube-apiserver reachable again, closing the circuit")
+            self.failures, self.backoff, self.retry_at = 0, 0.0, 0.0
+
+    def failure(self):
+        """Count a connection failure, opening the circuit after repeated failures."""
+        with self._lock:
+            self.failures += 1
+            if not self.is_open:
+                return
+            self.backoff = min(max(self.backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+            delay = self.backoff * random.uniform(0.5, 1.0)
+            self.retry_at = time.time() + delay
+            log.warning(
+                "kube-apiserver unreachable after %d attempts, failing fast for %.0fs",
+                self.failures,
+                delay,
+            )
+
+    def wrap(self, transport: httpx.BaseTransport) -> httpx.BaseTransport:
+        """Route the requests handed over to a transport through the circuit."""
+        return _Transport(transport, self)
+
+    def probe(self, client: Client) -> bool:
+        """Probe an open circuit with a single cheap request once its retry time is reached.
+
+        Args:
+            client: lightkube client whose transport is wrapped by this circuit.
+
+        Returns:
+            True if the circuit is closed.
+        """
+        if not self.is_open:
+            return True
+        if time.time() < self.retry_at:
+            return False
+        try:
+            client.get(Namespace, PROBE_NAMESPACE)
+        except ApiError:
+            # any api response means the apiserver is reachable
+            self.success()
+        except httpx.HTTPError as e:
+            log.warning("kube-apiserver probe failed: %s", e)
+        return not self.is_open
+
+
+class _Transport(httpx.BaseTransport):
+    """Transport checking the circuit before each request, recording its outcome."""
+
+    def __init__(self, transport: httpx.BaseTransport, breaker: CircuitBreaker):
+        self.transport = transport
+        self.breaker = breaker
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.breaker.allow()
+        remaining = self.breaker.remaining()
+        capped = False
+        if remaining is not None and (timeout := request.extensions.get("timeout")):
+            capped = any(value is None or value > remaining for value in timeout.values())
+            request.extensions["timeout"] = {
+                key: remaining if value is None else min(value, remaining)
+                for key, value in timeout.items()
+            }
+        try:
+            response = self.transport.handle_request(request)
+        except httpx.TimeoutException:
+            # the dispatch ran out of time, which says nothing of the apiserver
+            if not capped:
+                self.breaker.failure()
+            raise
+        except httpx.NetworkError:
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return response
+
+    def close(self):
+        self.transport.close()
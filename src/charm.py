@@ -3,29 +3,63 @@
 # See LICENSE file for licensing details.
 """Deploy and manage the Controller-Manager for K8s on OpenStack."""
 
+import hashlib
+import json
 import logging
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 
 import httpx
 import ops
-from lightkube import Client
+from lightkube import Client, codecs
 from lightkube.core.exceptions import ApiError
 from lightkube.resources.core_v1 import Node
 from ops.interface_kube_control import KubeControlRequirer
 from ops.interface_openstack_integration import OpenstackIntegrationRequirer
 from ops.interface_tls_certificates import CertificatesRequires
 from ops.manifests import Collector, ManifestClientError
+from ops.manifests.literals import APP_LABEL, MANIFEST_LABEL
 
+from breaker import CircuitBreaker
 from config import CharmConfig
-from provider_manifests import ProviderManifests
+from metrics import (
+    API_LATENCY_BUCKETS,
+    NODE_INIT_BUCKETS,
+    ApiLatency,
+    Histogram,
+    HookProfile,
+    MemoryProfile,
+    node_init_latency,
+    node_init_time,
+)
+from provider_manifests import RESOURCE_NAME, ProviderManifests, instrumented_transport
+from reconciler import BackgroundReconciler
+from rollout import BlueGreenUpgrade, ImagePrePull, wait_for_daemonset
 
 log = logging.getLogger(__name__)
 
 # Maximum number of node names to display in status messages
 MAX_NODES_IN_STATUS = 3
+# Remote relation fields read by the reconcile, None reads the whole databag
+RECONCILE_RELATION_FIELDS = {
+    "certificates": {"ca"},
+    "external-cloud-provider": set(),
+    "kube-control": {
+        "api-endpoints",
+        "ca-certificate-secret-id",
+        "cluster-tag",
+        "creds",
+        "registry-location",
+    },
+    "openstack": None,
+}
+# Fields juju sets on every relation, never read by the reconcile
+JUJU_RELATION_FIELDS = {"egress-subnets", "ingress-address", "private-address"}
+PROXY_ENV = ("JUJU_CHARM_HTTP_PROXY", "JUJU_CHARM_HTTPS_PROXY", "JUJU_CHARM_NO_PROXY")
 
 
 class ProviderCharm(ops.CharmBase):
@@ -36,6 +70,11 @@ class ProviderCharm(ops.CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
 
+        self.profile = HookProfile()
+        self.api_latency = ApiLatency()
+        # unit status buffered until the end of the dispatch
+        self._status: Optional[ops.StatusBase] = None
+
         # Ensure kubeconfig environment
         self._kubeconfig_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -45,13 +84,49 @@ class ProviderCharm(ops.CharmBase):
         self.integrator = OpenstackIntegrationRequirer(self)
         # Config Validator and datastore
         self.charm_config = CharmConfig(self)
+        config = self.charm_config.model
+
+        self.memory = MemoryProfile.from_env(
+            self._memory_profile_path, config.memory_profile if config else 0
+        )
+        if self.memory:
+            self.memory.start()
+            self.profile.memory = self.memory
 
         self.stored.set_default(
             config_hash=None,  # hashed value of the config once valid
             deployed=False,  # True if the config has been applied after new hash
+            node_init_histogram={},  # histogram state of node initialization latencies
+            node_init_watermark=0.0,  # latest initialization time recorded, epoch seconds
+            node_init_seen=[],  # uids of the nodes recorded as initialized at the watermark
+            inputs_digest=None,  # digest of the reconcile inputs once deployed
+            reconciles_executed=0,  # number of reconciles run through the pipeline
+            reconciles_skipped=0,  # number of reconciles skipped with unchanged inputs
+            api_latency={},  # histogram states of the API request latencies by hook
+            api_breaker={},  # state of the circuit breaker over the apiserver connections
+            release=None,  # manager release last deployed
+            pruned={},  # resources pruned on the last manager release change
+            flow_control=False,  # True if the flow control objects were last deployed
+            flow_control_api=None,  # flowcontrol version the apiserver serves, once discovered
+            green=False,  # True while a blue/green upgrade's green DaemonSet is deployed
+            secret=None,  # name of the cloud-config Secret last deployed
+            stale_secrets=False,  # True until superseded cloud-config Secrets are deleted
+        )
+        self.breaker = CircuitBreaker(
+            self.stored.api_breaker, deadline=config.api_deadline if config else 0
         )
         self.collector = Collector(
-            ProviderManifests(self, self.charm_config, self.kube_control, self.integrator),
+            ProviderManifests(
+                self,
+                self.charm_config,
+                self.kube_control,
+                self.integrator,
+                instruments=(self.breaker, self.api_latency),
+                flow_control_api=self.stored.flow_control_api,
+            ),
+        )
+        self.reconciler = BackgroundReconciler(
+            self._kubeconfig_path.parent / "reconciler", self._kubeconfig_path
         )
 
         self.framework.observe(self.on.kube_control_relation_created, self._kube_control)
@@ -75,17 +150,75 @@ class ProviderCharm(ops.CharmBase):
         self.framework.observe(self.on.list_resources_action, self._list_resources)
         self.framework.observe(self.on.scrub_resources_action, self._scrub_resources)
         self.framework.observe(self.on.sync_resources_action, self._sync_resources)
+        self.framework.observe(self.on.node_init_latency_action, self._node_init_latency)
+        self.framework.observe(self.on.api_latency_action, self._api_latency)
+        self.framework.observe(self.on.memory_profile_action, self._memory_profile)
         self.framework.observe(self.on.update_status, self._update_status)
 
         self.framework.observe(self.on.install, self._install_or_upgrade)
-        self.framework.observe(self.on.upgrade_charm, self._install_or_upgrade)
+        self.framework.observe(self.on.upgrade_charm, self._upgrade_charm)
         self.framework.observe(self.on.config_changed, self._merge_config)
         self.framework.observe(self.on.stop, self._cleanup)
+        self.framework.observe(self.on.collect_unit_status, self._commit_status)
+        self.framework.observe(self.framework.on.pre_commit, self._record_api_latency)
+        self.framework.observe(self.framework.on.pre_commit, self._record_breaker)
+        self.framework.observe(self.framework.on.commit, self._record_memory)
+        self.framework.observe(self.framework.on.commit, self._log_profile)
+
+    def _set_status(self, status: ops.StatusBase, now: bool = False):
+        """Buffer the unit status, only the last one is written when the dispatch ends.
+
+        Args:
+            status: new status of the unit
+            now:    write it immediately, ahead of a step expected to take a while
+        """
+        if now:
+            self.unit.status = status
+            self._status = None
+        else:
+            self._status = status
+
+    def _commit_status(self, event: ops.CollectStatusEvent):
+        if self._status is not None:
+            event.add_status(self._status)
+            self._status = None
+
+    def _record_api_latency(self, _):
+        if not self.api_latency.series:
+            return
+        hooks = dict(self.stored.api_latency)
+        hooks[self.profile.hook] = self.api_latency.merge(hooks.get(self.profile.hook, {}))
+        self.stored.api_latency = hooks
+
+    def _record_breaker(self, _):
+        state = self.breaker.state()
+        if state != dict(self.stored.api_breaker):
+            self.stored.api_breaker = state
+
+    def _record_memory(self, _):
+        if not self.memory:
+            return
+        dispatch = self.memory.record(self.profile.hook)
+        if dispatch:
+            log.info(
+                "Memory profile: peak-rss=%.1fMiB traced-peak=%.1fMiB",
+                dispatch["peak-rss"] / 2**20,
+                dispatch["traced-peak"] / 2**20,
+            )
+
+    def _log_profile(self, _):
+        log.info("Hook profile: %s", self.profile.summary())
+        if self.api_latency.series:
+            log.info("API latency: %s", self.api_latency.summary())
 
     @property
     def _ca_cert_path(self) -> Path:
         return Path(f"/srv/{self.unit.name}/ca.crt")
 
+    @property
+    def _memory_profile_path(self) -> Path:
+        return Path(f"/srv/{self.unit.name}/memory-profile.json")
+
     @property
     def _kubeconfig_path(self) -> Path:
         path = f"/srv/{self.unit.name}/kubeconfig"
@@ -114,85 +247,261 @@ class ProviderCharm(ops.CharmBase):
             msg = "Failed to apply missing resources. API Server unavailable."
             event.set_results({"result": msg})
 
-    def _check_node_provider_ids(self) -> List[str]:
+    def _client(self) -> Client:
+        """Lightkube client whose requests go through the circuit breaker and are timed."""
+        return Client(transport=instrumented_transport((self.breaker, self.api_latency)))
+
+    def _apiserver_available(self) -> bool:
+        """False while the circuit breaker holds the kube-apiserver as unreachable.
+
+        Once the breaker's retry time is reached, a single cheap request probes
+        the apiserver rather than every request of the hook timing out.
+        """
+        if self.breaker.probe(self._client()):
+            return True
+        log.info("Failing fast, kube-apiserver unreachable")
+        self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
+        return False
+
+    def _list_nodes(self) -> List[Node]:
+        """List the cluster nodes, empty if the request is refused."""
+        try:
+            return list(self._client().list(Node))
+        except ApiError as e:
+            log.warning("Failed to query nodes for providerIDs: %s", e)
+            return []
+
+    def _check_node_provider_ids(self, nodes: List[Node]) -> List[str]:
         """Check nodes for missing or invalid providerIDs.
 
         Returns:
             List of node names that are missing or have invalid providerIDs.
         """
-        try:
-            client = Client()
-            nodes_without_provider_id = []
+        nodes_without_provider_id = []
+        for node in nodes:
+            provider_id = node.spec.providerID if node.spec.providerID else ""
+            # Expected format: "openstack://region/InstanceID" or "openstack:///InstanceID"
+            if not provider_id.startswith("openstack://"):
+                nodes_without_provider_id.append(node.metadata.name)
+        return nodes_without_provider_id
+
+    def _record_node_init(self, nodes: List[Node]) -> Histogram:
+        """Add the initialization latency of newly initialized nodes to the histogram.
+
+        Nodes initialized before the latest recorded initialization were
+        already recorded, so only the few initialized at that same second are
+        remembered by uid, however large the cluster.
+        """
+        histogram = Histogram(NODE_INIT_BUCKETS, self.stored.node_init_histogram)
+        watermark = self.stored.node_init_watermark
+        seen = set(self.stored.node_init_seen)
+        initialized = ((node_init_time(node), node) for node in nodes)
+        # in order of initialization, so the watermark only moves forward
+        ordered = sorted(
+            ((at.timestamp(), node) for at, node in initialized if at is not None),
+            key=lambda pair: pair[0],
+        )
+        recorded = 0
+        for at, node in ordered:
+            if at < watermark or node.metadata.uid in seen:
+                continue
+            latency = node_init_latency(node)
+            log.info("Node %s initialized %.0fs after creation", node.metadata.name, latency)
+            histogram.observe(latency)
+            recorded += 1
+            if at > watermark:
+                watermark, seen = at, set()
+            seen.add(node.metadata.uid)
+
+        if recorded:
+            self.stored.node_init_histogram = histogram.state()
+            self.stored.node_init_watermark = watermark
+            self.stored.node_init_seen = sorted(seen)
+        return histogram
+
+    def _node_init_latency(self, event):
+        if self.stored.deployed:
+            try:
+                self._record_node_init(self._list_nodes())
+            except (httpx.ConnectError, httpx.TimeoutException):
+                event.log("Kubernetes API unreachable, reporting the recorded measurements")
+        histogram = Histogram(NODE_INIT_BUCKETS, self.stored.node_init_histogram)
+        count = histogram.count
+        event.set_results(
+            {
+                "count": count,
+                "mean": f"{histogram.total / count if count else 0:.1f}",
+                "p50": f"{histogram.quantile(0.5):.1f}",
+                "p95": f"{histogram.quantile(0.95):.1f}",
+                "max": f"{histogram.maximum:.1f}",
+                "buckets": histogram.buckets(),
+            }
+        )
 
-            for node in client.list(Node):
-                provider_id = node.spec.providerID if node.spec.providerID else ""
-                # Expected format: "openstack://region/InstanceID" or "openstack:///InstanceID"
-                if not provider_id.startswith("openstack://"):
-                    nodes_without_provider_id.append(node.metadata.name)
+    def _api_latency(self, event):
+        hook = event.params.get("hook", "")
+        results = {}
+        for name, series in self.stored.api_latency.items():
+            if hook and name != hook:
+                continue
+            results[name] = {}
+            for key, state in series.items():
+                histogram = Histogram(API_LATENCY_BUCKETS, state)
+                results[name][key] = (
+                    f"count={histogram.count} "
+                    f"mean={histogram.total / histogram.count:.3f}s "
+                    f"p50={histogram.quantile(0.5):.3f}s "
+                    f"p95={histogram.quantile(0.95):.3f}s "
+                    f"max={histogram.maximum:.3f}s"
+                )
+        event.set_results({"hooks": results} if results else {"hooks": "none recorded"})
+
+    def _memory_profile(self, event):
+        dispatches = MemoryProfile(self._memory_profile_path, 0).load()
+        hook = event.params.get("hook", "")
+        results = {}
+        for idx, dispatch in enumerate(reversed(dispatches)):
+            if hook and dispatch["hook"] != hook:
+                continue
+            stages = " ".join(
+                f"{name}={size / 2**20:.1f}MiB" for name, size in dispatch["stages"].items()
+            )
+            results[f"{idx}-{dispatch['hook']}"] = {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(dispatch["time"])),
+                "peak-rss": f"{dispatch['peak-rss'] / 2**20:.1f}MiB",
+                "traced-peak": f"{dispatch['traced-peak'] / 2**20:.1f}MiB",
+                "stages": stages or "none",
+                "top": "\n".join(dispatch["top"]),
+            }
+        event.set_results({"dispatches": results} if results else {"dispatches": "none recorded"})
 
-            return nodes_without_provider_id
-        except ApiError as e:
-            log.warning("Failed to query nodes for providerIDs: %s", e)
-            return []
+    @property
+    def _background_reconcile(self) -> bool:
+        config = self.charm_config.model
+        return bool(config and config.background_reconcile)
+
+    @staticmethod
+    def _uninitialized_message(nodes: List[str]) -> str:
+        node_list = ", ".join(nodes[:MAX_NODES_IN_STATUS])
+        suffix = (
+            f" (+{len(nodes) - MAX_NODES_IN_STATUS} more)"
+            if len(nodes) > MAX_NODES_IN_STATUS
+            else ""
+        )
+        return f"Cloud provider not initialized on nodes: {node_list}{suffix}"
+
+    def _update_status_background(self):
+        """Report the progress of the background reconciler, restarting it if needed."""
+        if self.reconciler.ensure_worker():
+            log.warning("Background reconciler wasn't running, restarted it")
+        status = self.reconciler.status()
+        if status.get("hash") != self.stored.config_hash:
+            self._set_status(ops.MaintenanceStatus("Background reconcile pending"))
+        elif status.get("state") == "applying":
+            self._set_status(
+                ops.MaintenanceStatus(
+                    f"Reconciling in background: {status['applied']}/{status['total']} applied"
+                )
+            )
+        elif status.get("state") == "failed":
+            self._set_status(ops.WaitingStatus(f"Background reconcile failed: {status['error']}"))
+        elif not status.get("rollout_complete"):
+            self._set_status(
+                ops.WaitingStatus(
+                    f"Rolling out Cloud Controller Manager: {status.get('rollout') or 'unknown'}"
+                )
+            )
+        elif status.get("uninitialized"):
+            self._set_status(
+                ops.WaitingStatus(self._uninitialized_message(status["uninitialized"]))
+            )
+        else:
+            self._collect_secrets()
+            self._set_status(ops.ActiveStatus("Ready"))
+            self.unit.set_workload_version(self.collector.short_version)
+            if self.unit.is_leader():
+                self.app.status = ops.ActiveStatus(self.collector.long_version)
 
     def _update_status(self, _):
         if not self.stored.deployed:
             return
 
-        unready = self.collector.unready
+        if self._background_reconcile:
+            self._update_status_background()
+            return
+
+        if not self._apiserver_available():
+            return
+
+        # Resource readiness and the node scan are independent probes, run them together
+        with self.profile.stage("probes"), ThreadPoolExecutor(max_workers=2) as pool:
+            unready_probe = pool.submit(lambda: self.collector.unready)
+            # Check if nodes have providerIDs set (bug #2100952)
+            node_probe = pool.submit(self._list_nodes)
+
+        try:
+            unready = unready_probe.result()
+        except ManifestClientError as e:
+            log.warning("Kubernetes API unreachable while checking resources: %s", e)
+            self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
+            return
         if unready:
-            self.unit.status = ops.WaitingStatus(", ".join(unready))
+            self._set_status(ops.WaitingStatus(", ".join(unready)))
             return
+        self._settle_rollout()
 
-        # Check if nodes have providerIDs set (bug #2100952)
         try:
-            nodes_without_provider_id = self._check_node_provider_ids()
+            nodes = node_probe.result()
         except (httpx.ConnectError, httpx.TimeoutException) as e:
             log.warning("Kubernetes API unreachable while checking provider IDs: %s", e)
-            self.unit.status = ops.WaitingStatus("Waiting for kube-apiserver")
+            self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
             return
+        with self.profile.stage("node-scan"):
+            histogram = self._record_node_init(nodes)
+            nodes_without_provider_id = self._check_node_provider_ids(nodes)
         if nodes_without_provider_id:
-            node_list = ", ".join(nodes_without_provider_id[:MAX_NODES_IN_STATUS])
-            suffix = (
-                f" (+{len(nodes_without_provider_id) - MAX_NODES_IN_STATUS} more)"
-                if len(nodes_without_provider_id) > MAX_NODES_IN_STATUS
-                else ""
-            )
-            self.unit.status = ops.WaitingStatus(
-                f"Cloud provider not initialized on nodes: {node_list}{suffix}"
+            self._set_status(
+                ops.WaitingStatus(self._uninitialized_message(nodes_without_provider_id))
             )
             return
 
-        self.unit.status = ops.ActiveStatus("Ready")
+        config = self.charm_config.model
+        threshold = config.node_init_latency_threshold if config else 0
+        p95 = histogram.quantile(0.95)
+        if threshold and p95 > threshold:
+            self._set_status(ops.ActiveStatus(f"Ready, slow node initialization (p95 {p95:.0f}s)"))
+        else:
+            self._set_status(ops.ActiveStatus("Ready"))
         self.unit.set_workload_version(self.collector.short_version)
-        self.app.status = ops.ActiveStatus(self.collector.long_version)
+        if self.unit.is_leader():
+            self.app.status = ops.ActiveStatus(self.collector.long_version)
 
     def _kube_control(self, event):
         self.kube_control.set_auth_request(self.unit.name, "system:masters")
         return self._merge_config(event)
 
     def _check_integrator(self, event):
-        self.unit.status = ops.MaintenanceStatus("Evaluating Openstack relation.")
+        self._set_status(ops.MaintenanceStatus("Evaluating Openstack relation."))
         evaluation = self.integrator.evaluate_relation(event)
         if evaluation:
             if "Waiting" in evaluation:
-                self.unit.status = ops.WaitingStatus(evaluation)
+                self._set_status(ops.WaitingStatus(evaluation))
             else:
-                self.unit.status = ops.BlockedStatus(evaluation)
+                self._set_status(ops.BlockedStatus(evaluation))
             return False
         return True
 
     def _check_kube_control(self, event):
-        self.unit.status = ops.MaintenanceStatus("Evaluating kubernetes authentication.")
+        self._set_status(ops.MaintenanceStatus("Evaluating kubernetes authentication."))
         evaluation = self.kube_control.evaluate_relation(event)
         if evaluation:
             if "Waiting" in evaluation:
-                self.unit.status = ops.WaitingStatus(evaluation)
+                self._set_status(ops.WaitingStatus(evaluation))
             else:
-                self.unit.status = ops.BlockedStatus(evaluation)
+                self._set_status(ops.BlockedStatus(evaluation))
             return False
         if not self.kube_control.get_auth_credentials(self.unit.name):
-            self.unit.status = ops.WaitingStatus("Waiting for kube-control: unit credentials")
+            self._set_status(ops.WaitingStatus("Waiting for kube-control: unit credentials"))
             return False
         self.kube_control.create_kubeconfig(
             self._ca_cert_path, self._kubeconfig_path, "root", self.unit.name
@@ -204,26 +513,76 @@ class ProviderCharm(ops.CharmBase):
             log.info("CA Certificate is available from kube-control.")
             return True
 
-        self.unit.status = ops.MaintenanceStatus("Evaluating certificates.")
+        self._set_status(ops.MaintenanceStatus("Evaluating certificates."))
         evaluation = self.certificates.evaluate_relation(event)
         if evaluation:
             if "Waiting" in evaluation:
-                self.unit.status = ops.WaitingStatus(evaluation)
+                self._set_status(ops.WaitingStatus(evaluation))
             else:
-                self.unit.status = ops.BlockedStatus(evaluation)
+                self._set_status(ops.BlockedStatus(evaluation))
             return False
         self._ca_cert_path.write_text(self.certificates.ca)
         return True
 
     def _check_config(self):
-        self.unit.status = ops.MaintenanceStatus("Evaluating charm config.")
+        self._set_status(ops.MaintenanceStatus("Evaluating charm config."))
         evaluation = self.charm_config.evaluate()
         if evaluation:
-            self.unit.status = ops.BlockedStatus(evaluation)
+            self._set_status(ops.BlockedStatus(evaluation))
             return False
         return True
 
+    def _inputs_digest(self) -> str:
+        """Digest of the charm config and relation fields the reconcile reads."""
+        relations = {}
+        for endpoint, fields in RECONCILE_RELATION_FIELDS.items():
+            for relation in self.model.relations[endpoint]:
+                remotes = sorted(relation.units, key=lambda u: u.name)
+                remotes += [relation.app] if relation.app else []
+                relations[f"{endpoint}:{relation.id}"] = {
+                    remote.name: {
+                        key: value
+                        for key, value in relation.data[remote].items()
+                        if (
+                            key in fields
+                            if fields is not None
+                            else key not in JUJU_RELATION_FIELDS
+                        )
+                    }
+                    for remote in remotes
+                }
+        inputs = {
+            "config": dict(self.config),
+            "proxy": {env: os.environ.get(env) for env in PROXY_ENV},
+            "relations": relations,
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
     def _merge_config(self, event):
+        with self.profile.stage("merge-config"):
+            self._reconcile(event)
+
+    def _reconcile(self, event):
+        inputs_digest = self._inputs_digest()
+        if (
+            self.stored.deployed
+            and self.stored.inputs_digest == inputs_digest
+            and not isinstance(event, ops.RelationBrokenEvent)
+        ):
+            self.stored.reconciles_skipped += 1
+            self.profile.record("reconciles-skipped", self.stored.reconciles_skipped)
+            log.info(
+                "Skipping reconcile, inputs unchanged (executed=%d, skipped=%d)",
+                self.stored.reconciles_executed,
+                self.stored.reconciles_skipped,
+            )
+            return
+
+        self.stored.reconciles_executed += 1
+        self.profile.record("reconciles-executed", self.stored.reconciles_executed)
+        if not self._check_config():
+            return
+
         if not self._check_integrator(event):
             return
 
@@ -233,51 +592,349 @@ class ProviderCharm(ops.CharmBase):
         if not self._check_kube_control(event):
             return
 
-        if not self._check_config():
-            return
-
-        self.unit.status = ops.MaintenanceStatus("Evaluating Manifests")
+        self._discover_flow_control(event)
+        self._set_status(ops.MaintenanceStatus("Evaluating Manifests"))
         new_hash = 0
         for controller in self.collector.manifests.values():
             evaluation = controller.evaluate()
             if evaluation:
-                self.unit.status = ops.BlockedStatus(evaluation)
+                self._set_status(ops.BlockedStatus(evaluation))
                 return
             new_hash += controller.hash()
 
         self.stored.deployed = False
+        applied = self.stored.config_hash != new_hash
         if self._install_or_upgrade(event, config_hash=new_hash):
             self.stored.config_hash = new_hash
             self.stored.deployed = True
+            self.stored.inputs_digest = inputs_digest
+            if applied and self._track_rollout():
+                self._update_status(event)
+
+    def _discover_flow_control(self, event):
+        """Discover the flowcontrol version the apiserver serves, ahead of rendering.
+
+        It's kept across dispatches, and only discovered again after a charm
+        upgrade or a kube-control change, which may bring another cluster.
+        """
+        controller = self.collector.manifests[RESOURCE_NAME]
+        refresh = isinstance(event, ops.UpgradeCharmEvent) or (
+            isinstance(event, ops.RelationEvent) and event.relation.name == "kube-control"
+        )
+        if not controller.flow_control or (self.stored.flow_control_api and not refresh):
+            return
+        if served := controller.discover_flow_control_api():
+            self.stored.flow_control_api = served
+
+    def _track_rollout(self) -> bool:
+        """Follow the CCM DaemonSet rollout for up to rollout-timeout seconds.
+
+        Returns:
+            True once every CCM pod is updated and ready within the time budget.
+        """
+        config = self.charm_config.model
+        budget = config.rollout_timeout if config else 0
+        if not budget or self._background_reconcile:
+            return False
+
+        def _progress(progress):
+            self._set_status(
+                ops.MaintenanceStatus(f"Rolling out Cloud Controller Manager: {progress}"),
+                now=True,
+            )
+
+        started = time.monotonic()
+        try:
+            with self.profile.stage("rollout"), self.breaker.paused():
+                progress = wait_for_daemonset(
+                    self.collector.manifests[RESOURCE_NAME], RESOURCE_NAME, budget, _progress
+                )
+        except ManifestClientError as e:
+            log.warning(f"Encountered error tracking the rollout: {e}")
+            self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
+            return False
+
+        if not progress.complete:
+            log.warning("Rollout incomplete after %ss: %s", budget, progress)
+            self._set_status(ops.WaitingStatus(f"Rollout incomplete after {budget}s: {progress}"))
+            return False
+
+        time_to_ready = time.monotonic() - started
+        self.profile.record("rollout-time-to-ready", time_to_ready)
+        log.info("Cloud Controller Manager rolled out in %.1fs", time_to_ready)
+        self._rollout_complete()
+        return True
+
+    def _prepull_images(self, event) -> bool:
+        """Pull a changed CCM image onto the selected nodes before rolling it out."""
+        config = self.charm_config.model
+        if not (config and config.image_prepull):
+            return True
+
+        prepull = ImagePrePull(
+            self.collector.manifests[RESOURCE_NAME], config.image_prepull_helper
+        )
+
+        def _progress(progress):
+            self._set_status(
+                ops.MaintenanceStatus(
+                    f"Pre-pulling images: {progress.ready}/{progress.desired} nodes"
+                ),
+                now=True,
+            )
+
+        try:
+            images = prepull.pending_images()
+            if not images:
+                return True
+            with self.breaker.paused():
+                progress = prepull.run(images, config.image_prepull_timeout, _progress)
+            if progress.complete:
+                prepull.cleanup()
+        except ManifestClientError as e:
+            self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
+            log.warning(f"Encountered pre-pull error: {e}")
+            event.defer()
+            return False
+
+        if not progress.complete:
+            self._set_status(
+                ops.WaitingStatus(
+                    f"Waiting for image pre-pull: {progress.ready}/{progress.desired} nodes"
+                )
+            )
+            event.defer()
+            return False
+        return True
+
+    def _stage_upgrade(self, event) -> bool:
+        """Start the new release next to the installed one before a blue/green upgrade."""
+        config = self.charm_config.model
+        if not (config and config.upgrade_strategy == "blue-green"):
+            return True
+        controller = self.collector.manifests[RESOURCE_NAME]
+        previous, current = self.stored.release, controller.current_release
+        if not previous or previous == current:
+            return True
+
+        upgrade = BlueGreenUpgrade(controller)
+
+        def _progress(progress):
+            self._set_status(
+                ops.MaintenanceStatus(
+                    f"Starting {current} next to {previous}: {progress.ready}/{progress.desired}"
+                ),
+                now=True,
+            )
+
+        # the green pods run with the new release's RBAC, service account and secret
+        supporting = [
+            obj
+            for obj in controller.resources
+            if obj.kind != "DaemonSet" or obj.name != RESOURCE_NAME
+        ]
+        try:
+            with self.profile.stage("upgrade"):
+                controller.apply_resources(*supporting)
+                self.stored.green = True
+                with self.breaker.paused():
+                    progress = upgrade.run(config.rollout_timeout, _progress)
+                leader = upgrade.leader() if progress.complete else None
+        except ManifestClientError as e:
+            self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
+            log.warning(f"Encountered upgrade error: {e}")
+            event.defer()
+            return False
+
+        if not progress.complete:
+            self._set_status(
+                ops.WaitingStatus(
+                    f"Waiting for {current} to start: {progress.ready}/{progress.desired} ready"
+                )
+            )
+            event.defer()
+            return False
+        log.info(
+            "%d pods of %s standing by, leader lease held by %s",
+            progress.ready,
+            current,
+            leader or "nobody",
+        )
+        return True
+
+    def _settle_rollout(self):
+        """Clean up after a rollout once the CCM DaemonSet reports it complete.
+
+        Its resources being ready isn't enough, as DaemonSets have no
+        conditions telling a stalled rollout apart.
+        """
+        if not (self.stored.green or self.stored.stale_secrets):
+            return
+        try:
+            progress = wait_for_daemonset(
+                self.collector.manifests[RESOURCE_NAME], RESOURCE_NAME, 0
+            )
+        except ManifestClientError as e:
+            log.warning(f"Encountered error reading the rollout progress: {e}")
+            return
+        if progress.complete:
+            self._rollout_complete()
+        else:
+            log.info("Cloud Controller Manager rollout in progress: %s", progress)
+
+    def _rollout_complete(self):
+        """Clean up after the CCM DaemonSet is seen updated and ready."""
+        self._finish_upgrade()
+        self._collect_secrets()
+
+    def _collect_secrets(self):
+        """Delete the cloud-config Secrets superseded by the deployed one."""
+        if not self.stored.stale_secrets:
+            return
+        try:
+            deleted = self.collector.manifests[RESOURCE_NAME].prune_secrets()
+        except ManifestClientError as e:
+            log.warning(f"Encountered error deleting superseded secrets: {e}")
+            return
+        if deleted:
+            log.info("Deleted superseded secrets: %s", ", ".join(deleted))
+        self.stored.stale_secrets = False
+
+    def _finish_upgrade(self):
+        """Remove the green DaemonSet once the upgraded CCM DaemonSet is ready."""
+        if not self.stored.green:
+            return
+        try:
+            BlueGreenUpgrade(self.collector.manifests[RESOURCE_NAME]).cleanup()
+        except ManifestClientError as e:
+            log.warning(f"Encountered error removing the upgrade workload: {e}")
+            return
+        self.stored.green = False
+
+    def _record_pruned(self, previous: str, controller: ProviderManifests, pruned: List[str]):
+        current = controller.current_release
+        self.stored.release = current
+        self.stored.flow_control = controller.flow_control
+        if self.stored.secret != controller.secret_name:
+            self.stored.secret = controller.secret_name
+            self.stored.stale_secrets = True
+        if pruned or (previous and previous != current):
+            log.info("Pruned %d resources orphaned since %s: %s", len(pruned), previous, pruned)
+            self.stored.pruned = {"from": previous, "to": current, "resources": pruned}
+            self.profile.record("pruned", len(pruned))
+
+    def _orphaned(self, controller: ProviderManifests) -> Tuple[Optional[str], bool]:
+        """The previous release if it changed, and whether flow control was dropped."""
+        previous = self.stored.release
+        previous = previous if previous != controller.current_release else None
+        return previous, self.stored.flow_control and not controller.flow_control
+
+    def _prune(self, event, controller: ProviderManifests) -> bool:
+        """Delete the resources orphaned by a manager-release or api-priority-shares change."""
+        previous, flow_control = self._orphaned(controller)
+        pruned = []
+        if previous or flow_control:
+            try:
+                with self.profile.stage("prune"):
+                    pruned = controller.prune(previous, flow_control)
+            except ManifestClientError as e:
+                self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
+                log.warning(f"Encountered pruning error: {e}")
+                event.defer()
+                return False
+        self._record_pruned(self.stored.release, controller, pruned)
+        return True
+
+    def _submit_background(self, config_hash) -> bool:
+        """Record the rendered manifests for the background reconciler to apply."""
+        self.unit.set_workload_version("")
+        controller = self.collector.manifests[RESOURCE_NAME]
+        previous, flow_control = self._orphaned(controller)
+        with self.profile.stage("submit"):
+            manifests = codecs.dump_all_yaml([obj.resource for obj in controller.resources])
+            field_manager = f"{self.app.name}-{controller.name}"
+            orphans = (
+                controller.orphaned_resources(previous, flow_control)
+                if previous or flow_control
+                else []
+            )
+            prune = [
+                {
+                    "apiVersion": obj.resource.apiVersion,
+                    "kind": obj.kind,
+                    "namespace": obj.namespace,
+                    "name": obj.name,
+                }
+                for obj in orphans
+            ]
+            labels = {APP_LABEL: self.app.name, MANIFEST_LABEL: controller.name}
+            self.reconciler.submit(config_hash, field_manager, manifests, prune, labels)
+        self._record_pruned(self.stored.release, controller, [str(obj) for obj in orphans])
+        self._set_status(ops.MaintenanceStatus("Background reconcile pending"))
+        return True
+
+    def _upgrade_charm(self, event):
+        # a refreshed charm may render other manifests from unchanged inputs
+        self.stored.inputs_digest = None
+        self.stored.config_hash = None
+        self._merge_config(event)
 
     def _install_or_upgrade(self, event, config_hash=None):
-        if self.stored.config_hash == config_hash:
+        background = self._background_reconcile
+        if not background:
+            self.reconciler.stop()
+        submitted = self.reconciler.desired_hash() if background else config_hash
+        if config_hash is None or (
+            self.stored.config_hash == config_hash and submitted == config_hash
+        ):
             log.info("Skipping until the config is evaluated.")
             return True
 
-        self.unit.status = ops.MaintenanceStatus("Deploying Cloud Controller Manager")
+        if background:
+            return self._submit_background(config_hash)
+
+        if not self._apiserver_available():
+            event.defer()
+            return False
+
+        if not self._prepull_images(event):
+            return False
+
+        if not self._stage_upgrade(event):
+            return False
+
+        self._set_status(ops.MaintenanceStatus("Deploying Cloud Controller Manager"), now=True)
         self.unit.set_workload_version("")
         for controller in self.collector.manifests.values():
             try:
-                controller.apply_manifests()
+                with self.profile.stage("apply"):
+                    controller.apply_manifests()
             except ManifestClientError as e:
-                self.unit.status = ops.WaitingStatus("Waiting for kube-apiserver")
+                self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
                 log.warning(f"Encountered installation error: {e}")
                 event.defer()
                 return False
-        return True
+        return self._prune(event, self.collector.manifests[RESOURCE_NAME])
 
     def _cleanup(self, event):
+        self.reconciler.stop()
         if self.stored.config_hash:
-            self.unit.status = ops.MaintenanceStatus("Cleaning up Cloud Controller Manager")
+            if not self._apiserver_available():
+                event.defer()
+                return
+            self._set_status(
+                ops.MaintenanceStatus("Cleaning up Cloud Controller Manager"), now=True
+            )
             for controller in self.collector.manifests.values():
                 try:
                     controller.delete_manifests(ignore_unauthorized=True)
+                    if self.stored.green:
+                        BlueGreenUpgrade(controller).cleanup()
                 except ManifestClientError:
-                    self.unit.status = ops.WaitingStatus("Waiting for kube-apiserver")
+                    self._set_status(ops.WaitingStatus("Waiting for kube-apiserver"))
                     event.defer()
                     return
-        self.unit.status = ops.MaintenanceStatus("Shutting down")
+        self._set_status(ops.MaintenanceStatus("Shutting down"))
         if self._kubeconfig_path.parent.is_dir() and self._kubeconfig_path.parent.exists():
             shutil.rmtree(self._kubeconfig_path.parent)
         elif self._kubeconfig_path.parent.exists():
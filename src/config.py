@@ -2,11 +2,158 @@
 # See LICENSE file for licensing details.
 """Config Management for the cloud-controller-manager charm."""
 
+import configparser
 import logging
-from typing import Optional
+import re
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Literal, Mapping, Optional, Tuple
+
+from pydantic import BaseModel, Field, ValidationError, root_validator, validator
 
 log = logging.getLogger(__name__)
 
+MANIFESTS_PATH = Path("upstream/controller_manager/manifests")
+# manifests shared by releases which only differ by their images
+TEMPLATES_PATH = Path("upstream/controller_manager/templates")
+# file in each release directory naming its template and images
+RELEASE_PARAMS = "release.yaml"
+VERSION_PATH = Path("upstream/controller_manager/version")
+# <host>[:<port>][/<path>...] where each path component follows the OCI distribution spec
+REGISTRY_RE = re.compile(
+    r"^[A-Za-z0-9](?:[A-Za-z0-9.-]*[A-Za-z0-9])?(?::\d+)?"
+    r"(?:/[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*)*$"
+)
+# options which tune the charm's own behaviour and never alter the rendered manifests
+CHARM_OPTIONS = frozenset(
+    {
+        "api-deadline",
+        "background-reconcile",
+        "image-prepull",
+        "image-prepull-helper",
+        "image-prepull-timeout",
+        "memory-profile",
+        "node-init-latency-threshold",
+        "rollout-timeout",
+        "upgrade-strategy",
+    }
+)
+
+# controllers of the cloud-provider framework by the first release supporting each name
+# k8s.io/cloud-provider 1.28 introduced the "-controller" names next to the original ones
+CCM_CONTROLLERS: Dict[str, Tuple[int, ...]] = {
+    "cloud-node": (1, 0, 0),
+    "cloud-node-lifecycle": (1, 0, 0),
+    "route": (1, 0, 0),
+    "service": (1, 0, 0),
+    "cloud-node-controller": (1, 28, 0),
+    "cloud-node-lifecycle-controller": (1, 28, 0),
+    "node-route-controller": (1, 28, 0),
+    "service-lb-controller": (1, 28, 0),
+}
+
+
+def _version(release: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in re.findall(r"\d+", release))
+
+
+@lru_cache(maxsize=None)
+def default_release(path: Path = VERSION_PATH) -> str:
+    """Release deployed when manager-release is unset."""
+    return path.read_text(encoding="utf-8").strip() if path.exists() else ""
+
+
+@lru_cache(maxsize=None)
+def release_controllers(release: str) -> FrozenSet[str]:
+    """Controllers which can be selected with --controllers in a release."""
+    version = _version(release)
+    return frozenset(name for name, since in CCM_CONTROLLERS.items() if version >= since)
+
+
+@lru_cache(maxsize=None)
+def shipped_releases(path: Path = MANIFESTS_PATH) -> FrozenSet[str]:
+    """Index of the releases shipped with the charm, built once per process."""
+    if not path.is_dir():
+        return frozenset()
+    return frozenset(release.name for release in path.iterdir() if release.is_dir())
+
+
+class CharmConfigModel(BaseModel):
+    """Typed and validated view of the charm configuration."""
+
+    image_registry: Optional[str] = Field(None, alias="image-registry")
+    web_proxy_enable: bool = Field(False, alias="web-proxy-enable")
+    manager_release: Optional[str] = Field(None, alias="manager-release")
+    image_prepull: bool = Field(False, alias="image-prepull")
+    image_prepull_helper: Optional[str] = Field(None, alias="image-prepull-helper")
+    image_prepull_timeout: int = Field(60, alias="image-prepull-timeout", ge=0)
+    rollout_timeout: int = Field(60, alias="rollout-timeout", ge=0)
+    node_init_latency_threshold: int = Field(120, alias="node-init-latency-threshold", ge=0)
+    controllers: Optional[str] = Field(None, alias="controllers")
+    cloud_conf_overlay: Optional[str] = Field(None, alias="cloud-conf-overlay")
+    background_reconcile: bool = Field(False, alias="background-reconcile")
+    api_deadline: int = Field(120, alias="api-deadline", ge=0)
+    memory_profile: int = Field(0, alias="memory-profile", ge=0)
+    health_probe_period: int = Field(10, alias="health-probe-period", ge=0)
+    health_probe_failure_threshold: int = Field(3, alias="health-probe-failure-threshold", ge=1)
+    api_priority_shares: int = Field(0, alias="api-priority-shares", ge=0)
+    immutable_secret: bool = Field(False, alias="immutable-secret")
+    upgrade_strategy: Literal["in-place", "blue-green"] = Field(
+        "in-place", alias="upgrade-strategy"
+    )
+
+    class Config:
+        """Pydantic model configuration."""
+
+        frozen = True
+
+    @root_validator(skip_on_failure=True)
+    def _compatible_options(cls, values):
+        if values["background_reconcile"] and values["image_prepull"]:
+            raise ValueError("image-prepull isn't supported with background-reconcile")
+        if values["background_reconcile"] and values["upgrade_strategy"] == "blue-green":
+            raise ValueError("blue-green upgrades aren't supported with background-reconcile")
+        return values
+
+    @validator("*", pre=True)
+    def _unset_empty(cls, value):
+        return None if value == "" else value
+
+    @validator("image_registry")
+    def _valid_registry(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and not REGISTRY_RE.match(value):
+            raise ValueError(f"'{value}' is not a valid registry")
+        return value
+
+    @validator("manager_release")
+    def _shipped_release(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None and value not in shipped_releases():
+            raise ValueError(f"'{value}' is not a supported release")
+        return value
+
+    @validator("controllers")
+    def _known_controllers(cls, value: Optional[str], values) -> Optional[str]:
+        if value is None:
+            return value
+        release = values.get("manager_release") or default_release()
+        available = release_controllers(release)
+        selected = [name.strip() for name in value.split(",") if name.strip()]
+        for name in selected:
+            if name != "*" and name.lstrip("-") not in available:
+                raise ValueError(f"'{name}' is not a controller of {release}")
+        return ",".join(selected) or None
+
+    @validator("cloud_conf_overlay")
+    def _valid_ini(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            try:
+                # gcfg allows repeating an option, as the line-level merge does
+                configparser.ConfigParser(interpolation=None, strict=False).read_string(value)
+            except configparser.Error as e:
+                raise ValueError(str(e).splitlines()[0])
+        return value
+
 
 class CharmConfig:
     """Representation of the charm configuration."""
@@ -14,17 +161,51 @@ class CharmConfig:
     def __init__(self, charm):
         """Creates a CharmConfig object from the configuration data."""
         self.config = charm.config
+        self._snapshot: Optional[Tuple] = None
+        self._model: Optional[CharmConfigModel] = None
+        self._error: Optional[str] = None
+        self._data: Mapping = MappingProxyType({})
+
+    def _parse(self):
+        """Parse the charm config only when it differs from the last parsed config."""
+        snapshot = tuple(sorted(self.config.items()))
+        if snapshot == self._snapshot:
+            return
+        self._snapshot = snapshot
+        raw = {
+            key: value
+            for key, value in snapshot
+            if value != "" and value is not None and key not in CHARM_OPTIONS
+        }
+        try:
+            self._model = CharmConfigModel(**dict(snapshot))
+            self._error = None
+            data = {
+                key: value
+                for key, value in self._model.dict(by_alias=True, exclude_none=True).items()
+                if key not in CHARM_OPTIONS
+            }
+        except ValidationError as e:
+            err = e.errors()[0]
+            self._model = None
+            option = ".".join(str(loc) for loc in err["loc"] if loc != "__root__") or "config"
+            self._error = f"Invalid {option}: {err['msg']}"
+            data = raw
+        self._data = MappingProxyType({**raw, **data})
 
     @property
-    def available_data(self):
-        """Parse valid charm config into a dict, drop keys if unset."""
-        data = dict(**self.config)
-        for key, value in dict(**self.config).items():
-            if value == "" or value is None:
-                del data[key]
+    def model(self) -> Optional[CharmConfigModel]:
+        """The validated config model, None if the config is invalid."""
+        self._parse()
+        return self._model
 
-        return data
+    @property
+    def available_data(self) -> Mapping:
+        """Parse valid charm config used by the manifests into a mapping, drop keys if unset."""
+        self._parse()
+        return self._data
 
     def evaluate(self) -> Optional[str]:
         """Determine if configuration is valid."""
-        return None
+        self._parse()
+        return self._error
@@ -0,0 +1,408 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Measurements collected by the charm while handling a dispatch."""
+
+import bisect
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+import httpx
+from lightkube.resources.core_v1 import Node
+
+log = logging.getLogger(__name__)
+
+Number = Union[int, float]
+UNINITIALIZED_TAINT = "node.cloudprovider.kubernetes.io/uninitialized"
+# upper bounds in seconds of the node initialization latency buckets
+NODE_INIT_BUCKETS = (5, 10, 30, 60, 120, 300, 600, 1800)
+# upper bounds in seconds of the kubernetes API request latency buckets
+API_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# maximum number of (method, kind, status) series kept per hook, the rest count as "other"
+MAX_API_SERIES = 32
+# number of allocation sites kept per profiled dispatch
+TOP_ALLOCATIONS = 10
+# environment variable enabling the memory profile, as the number of dispatches to keep
+MEMORY_PROFILE_ENV = "CHARM_MEMORY_PROFILE"
+
+
+class Histogram:
+    """Histogram with fixed bucket bounds, updated one observation at a time.
+
+    Its state is a small mapping of plain values, so it can be kept in the
+    charm's StoredState and updated across dispatches.
+    """
+
+    def __init__(self, bounds: Sequence[Number], state: Optional[Mapping] = None):
+        self.bounds = list(bounds)
+        state = state or {}
+        # one count per bound, plus the overflow bucket
+        self.counts: List[int] = list(state.get("counts") or [0] * (len(self.bounds) + 1))
+        self.total: float = state.get("sum", 0.0)
+        self.maximum: float = state.get("max", 0.0)
+
+    @property
+    def count(self) -> int:
+        """Number of observations."""
+        return sum(self.counts)
+
+    def observe(self, value: Number):
+        """Add an observation to its bucket."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(float(bound), self.maximum)
+        return self.maximum
+
+    def state(self) -> Dict:
+        """Plain representation of the histogram."""
+        return {"counts": list(self.counts), "sum": self.total, "max": self.maximum}
+
+    def buckets(self) -> Dict[str, int]:
+        """Counts by bucket label."""
+        labels = [f"le-{bound}" for bound in self.bounds] + ["inf"]
+        return dict(zip(labels, self.counts))
+
+
+def node_initialized(node: Node) -> bool:
+    """True if the CCM set an openstack providerID and removed the uninitialized taint."""
+    provider_id = node.spec.providerID if node.spec and node.spec.providerID else ""
+    # Expected format: "openstack://region/InstanceID" or "openstack:///InstanceID"
+    if not provider_id.startswith("openstack://"):
+        return False
+    taints = (node.spec.taints or []) if node.spec else []
+    return not any(taint.key == UNINITIALIZED_TAINT for taint in taints)
+
+
+def node_init_time(node: Node) -> Optional[datetime]:
+    """Time the CCM initialized a node, None while it isn't initialized.
+
+    The CCM sets the providerID and removes the uninitialized taint in the same
+    update, so the time of the managed fields entry owning spec.providerID marks
+    the initialization.
+    """
+    meta = node.metadata
+    if not (meta and meta.creationTimestamp and node_initialized(node)):
+        return None
+    for entry in meta.managedFields or []:
+        if entry.time and "f:providerID" in (entry.fieldsV1 or {}).get("f:spec", {}):
+            return entry.time
+    return None
+
+
+def node_init_latency(node: Node) -> Optional[float]:
+    """Seconds from a node's creation until the CCM initialized it."""
+    if (initialized := node_init_time(node)) is None:
+        return None
+    return max((initialized - node.metadata.creationTimestamp).total_seconds(), 0.0)
+
+
+class HookProfile:
+    """Timings and measurements of a single dispatch of the charm."""
+
+    def __init__(self, hook: str = ""):
+        self.hook = hook or Path(os.environ.get("JUJU_DISPATCH_PATH", "unknown")).name
+        self.started = time.monotonic()
+        self.timings: Dict[str, float] = defaultdict(float)
+        self.values: Dict[str, Number] = {}
+        self.memory: Optional["MemoryProfile"] = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Accumulate the wall time spent within a named stage, and its memory if profiled."""
+        started = time.monotonic()
+        try:
+            if self.memory:
+                with self.memory.stage(name):
+                    yield
+            else:
+                yield
+        finally:
+            self.timings[name] += time.monotonic() - started
+
+    def record(self, name: str, value: Number):
+        """Record a named measurement."""
+        self.values[name] = value
+
+    def summary(self) -> str:
+        """Single line summary of the dispatch."""
+        parts = [f"hook={self.hook}", f"total={time.monotonic() - self.started:.2f}s"]
+        parts += [f"{name}={elapsed:.2f}s" for name, elapsed in self.timings.items()]
+        parts += [
+            f"{name}={value:.2f}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in self.values.items()
+        ]
+        return " ".join(parts)
+
+
+class _Frame:
+    """Traced memory when a profiled stage started, and the highest since."""
+
+    def __init__(self, base: int):
+        self.base = base
+        self.peak = base
+
+
+class MemoryProfile:
+    """Memory use of the charm's dispatches, traced with tracemalloc.
+
+    Each dispatch records its peak RSS, the peak traced memory of each
+    profiled stage and the top allocation sites still held when it ends.
+    The records of the last dispatches are kept in a json file.
+    """
+
+    def __init__(self, path: Path, keep: int):
+        self.path = path
+        self.keep = keep
+        self.stages: Dict[str, int] = {}
+        self._frames: List[_Frame] = []
+
+    @classmethod
+    def from_env(cls, path: Path, keep: int = 0) -> Optional["MemoryProfile"]:
+        """A memory profile keeping the configured number of dispatches, None if disabled.
+
+        The environment variable takes precedence over the configured number.
+        """
+        env = os.environ.get(MEMORY_PROFILE_ENV, "")
+        keep = int(env) if env.isdigit() else keep
+        return cls(path, keep) if keep > 0 else None
+
+    def start(self):
+        """Start tracing the allocations of the dispatch."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._frames = [_Frame(tracemalloc.get_traced_memory()[0])]
+        tracemalloc.reset_peak()
+
+    def _observe_peak(self) -> int:
+        """Fold the peak since the last observation into every running stage."""
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for frame in self._frames:
+            frame.peak = max(frame.peak, peak)
+        return current
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Record the peak memory allocated within a named stage."""
+        if not tracemalloc.is_tracing():
+            yield
+            return
+        self._frames.append(_Frame(self._observe_peak()))
+        try:
+            yield
+        finally:
+            self._observe_peak()
+            frame = self._frames.pop()
+            self.stages[name] = max(self.stages.get(name, 0), frame.peak - frame.base)
+
+    @staticmethod
+    def _top_allocations(snapshot: tracemalloc.Snapshot) -> List[str]:
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ]
+        )
+        cwd = f"{os.getcwd()}/"
+        top = []
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            filename = frame.filename.replace(cwd, "", 1)
+            top.append(f"{filename}:{frame.lineno} size={stat.size} count={stat.count}")
+        return top
+
+    def record(self, hook: str) -> Dict:
+        """Stop tracing and record the dispatch, keeping only the last dispatches.
+
+        The record isn't kept if the dispatch removed the profile's directory,
+        as the stop hook does.
+
+        Returns:
+            the dispatch's record.
+        """
+        if not tracemalloc.is_tracing():
+            return {}
+        self._observe_peak()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        dispatch = {
+            "hook": hook,
+            "time": time.time(),
+            # kilobytes on linux
+            "peak-rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "traced-peak": self._frames[0].peak - self._frames[0].base,
+            "stages": dict(self.stages),
+            "top": self._top_allocations(snapshot),
+        }
+        if not self.path.parent.is_dir():
+            return dispatch
+        keep = self.keep
+        dispatches = (self.load() + [dispatch])[-keep:]
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(dispatches))
+        tmp.replace(self.path)
+        return dispatch
+
+    def load(self) -> List[Dict]:
+        """Records of the last profiled dispatches, oldest first."""
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return []
+
+
+def _api_kind(path: str) -> str:
+    """Resource kind addressed by a kubernetes API path, in its plural form.
+
+    /api/v1/nodes and /apis/apps/v1/namespaces/kube-system/daemonsets/name
+    respectively address nodes and daemonsets.
+    """
+    parts = [part for part in path.split("/") if part]
+    parts = parts[2:] if parts[:1] == ["api"] else parts[3:]
+    if len(parts) > 2 and parts[0] == "namespaces":
+        parts = parts[2:]
+    return parts[0] if parts else "discovery"
+
+
+class ApiLatency:
+    """Latency histograms of the kubernetes API requests made during a dispatch.
+
+    Requests are grouped into series by method, resource kind and status
+    code, up to MAX_API_SERIES series.
+    """
+
+    def __init__(self):
+        self.series: Dict[str, Histogram] = {}
+        # requests may be timed from the threads of concurrent probes
+        self._lock = threading.Lock()
+
+    def wrap(self, transport: httpx.BaseTransport) -> httpx.BaseTransport:
+        """Time every request handed over to a transport."""
+        return _TimedTransport(transport, self)
+
+    def observe(self, method: str, kind: str, status: Union[int, str], seconds: float):
+        """Add a request to the histogram of its series."""
+        name = f"{method}-{kind}-{status}".lower()
+        with self._lock:
+            if name not in self.series and len(self.series) >= MAX_API_SERIES:
+                name = "other"
+            if name not in self.series:
+                self.series[name] = Histogram(API_LATENCY_BUCKETS)
+            self.series[name].observe(seconds)
+
+    def merge(self, states: Mapping[str, Mapping]) -> Dict[str, Dict]:
+        """Add this dispatch's histograms to previously stored histogram states."""
+        merged = {name: dict(state) for name, state in states.items()}
+        for name, histogram in self.series.items():
+            if name not in merged and len(merged) >= MAX_API_SERIES:
+                name = "other"
+            stored = Histogram(API_LATENCY_BUCKETS, merged.get(name))
+            stored.counts = [a + b for a, b in zip(stored.counts, histogram.counts)]
+            stored.total += histogram.total
+            stored.maximum = max(stored.maximum, histogram.maximum)
+            merged[name] = stored.state()
+        return merged
+
+    def summary(self) -> str:
+        """Single line summary of the requests, slowest series first."""
+        ranked: List[Tuple[str, Histogram]] = sorted(
+            self.series.items(), key=lambda item: item[1].total, reverse=True
+        )
+        return " ".join(
+            f"{name}=n{h.count}/p95:{h.quantile(0.95):.3f}s/max:{h.maximum:.3f}s"
+            for name, h in ranked
+        )
+
+
+class _RequestTimer:
+    """Times a single request, recorded into an ApiLatency once it completes."""
+
+    def __init__(self, latency: ApiLatency, request: httpx.Request):
+        self.latency = latency
+        self.method = request.method
+        self.kind = _api_kind(request.url.path)
+        self.started = time.monotonic()
+        self.recorded = False
+
+    def done(self, status: Union[int, str]):
+        """Record the request under a status code or failure, only once."""
+        if not self.recorded:
+            self.recorded = True
+            elapsed = time.monotonic() - self.started
+            self.latency.observe(self.method, self.kind, status, elapsed)
+
+
+def _failure(error: Exception) -> str:
+    """Series status of a request failing without a complete response."""
+    return "timeout" if isinstance(error, httpx.TimeoutException) else "error"
+
+
+class _TimedTransport(httpx.BaseTransport):
+    """Transport recording the latency of each request into an ApiLatency.
+
+    A request is timed until its response body is read, and one failing on
+    the way, like timeouts, connection errors or an open circuit, is
+    recorded under the status "timeout" or "error".
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, latency: ApiLatency):
+        self.transport = transport
+        self.latency = latency
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        timer = _RequestTimer(self.latency, request)
+        try:
+            response = self.transport.handle_request(request)
+        except Exception as e:
+            timer.done(_failure(e))
+            raise
+        if response.is_closed:
+            # the body was already read into the response
+            timer.done(response.status_code)
+        else:
+            response.stream = _TimedStream(response.stream, timer, response.status_code)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class _TimedStream(httpx.SyncByteStream):
+    """Response body completing the timer of its request once read and closed."""
+
+    def __init__(self, stream: httpx.SyncByteStream, timer: _RequestTimer, status: int):
+        self.stream = stream
+        self.timer = timer
+        self.status = status
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            yield from self.stream
+        except Exception as e:
+            self.timer.done(_failure(e))
+            raise
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.timer.done(self.status)
@@ -2,22 +2,259 @@
 # See LICENSE file for licensing details.
 """Implementation of cloud-controller specific details of the kubernetes manifests."""
 
+import base64
+import configparser
 import hashlib
 import json
 import logging
-from typing import Dict, Optional
+import re
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from functools import cached_property, lru_cache
+from pathlib import Path
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Protocol,
+    Sequence,
+    Set,
+    Tuple,
+)
 
 import charms.proxylib
+import httpx
+import yaml
+from httpx import HTTPError
+from lightkube import Client, KubeConfig
 from lightkube.codecs import AnyResource, from_dict
+from lightkube.config.client_adapter import verify_cluster
+from lightkube.core.exceptions import ApiError, ConfigError
+from lightkube.generic_resource import (
+    create_global_resource,
+    load_in_cluster_generic_resources,
+)
+from lightkube.models.core_v1 import HTTPGetAction, Probe
+from lightkube.resources.apiregistration_v1 import APIService
+from lightkube.resources.core_v1 import Secret
 from ops.interface_kube_control import KubeControlRequirer
 from ops.interface_openstack_integration import OpenstackIntegrationRequirer
-from ops.manifests import Addition, ConfigRegistry, ManifestLabel, Manifests, Patch
+from ops.manifests import (
+    Addition,
+    ConfigRegistry,
+    HashableResource,
+    ManifestClientError,
+    ManifestLabel,
+    Manifests,
+    Patch,
+)
+from ops.manifests.literals import APP_LABEL, MANIFEST_LABEL
+from ops.manifests.manifest import FILE_TYPES
+
+from config import RELEASE_PARAMS, TEMPLATES_PATH
 
 log = logging.getLogger(__file__)
 NAMESPACE = "kube-system"
 RESOURCE_NAME = "openstack-cloud-controller-manager"
 SECRET_NAME = "cloud-controller-config"
+# hex digits of the data digest suffixing the name of an immutable secret
+SECRET_DIGEST_LENGTH = 10
+# superseded cloud-config secrets kept, newest first, for pods of the previous rollout
+SUPERSEDED_SECRETS_KEPT = 1
+EPOCH = datetime.fromtimestamp(0, timezone.utc)
+SECRET_NAME_RE = re.compile(rf"^{SECRET_NAME}(-[0-9a-f]{{{SECRET_DIGEST_LENGTH}}})?$")
 K8S_DEFAULT_NO_PROXY = ["127.0.0.1", "localhost", "::1", "svc", "svc.cluster", "svc.cluster.local"]
+# service account the cloud-controller-manager DaemonSet runs as
+SERVICE_ACCOUNT = "cloud-controller-manager"
+# service accounts the cloud-provider controllers call the apiserver as
+# when started with --use-service-account-credentials=true
+CONTROLLER_SERVICE_ACCOUNTS = (
+    "cloud-node-controller",
+    "cloud-node-lifecycle-controller",
+    "route-controller",
+    "service-controller",
+)
+FLOW_CONTROL_GROUP = "flowcontrol.apiserver.k8s.io"
+# flowcontrol versions by the first release serving them, newest first
+FLOW_CONTROL_VERSIONS = (((1, 29), "v1"), ((1, 26), "v1beta3"), ((1, 23), "v1beta2"))
+# ahead of the built-in kube-controller-manager (800) and service-accounts (9000) schemas
+FLOW_SCHEMA_PRECEDENCE = 750
+# serving ports of the cloud-controller-manager, when not set by its arguments
+CCM_SECURE_PORT = 10258
+CCM_INSECURE_PORT = 10253
+
+
+class TransportInstrument(Protocol):
+    """Observes or gates the requests of a lightkube client through its transport."""
+
+    def wrap(self, transport: httpx.BaseTransport) -> httpx.BaseTransport:
+        """Transport handing the requests over to the wrapped transport."""
+        ...  # pragma: no cover
+
+
+class KubeTransport(httpx.BaseTransport):
+    """Transport to the apiserver of the kubeconfig, opened on the first request.
+
+    It verifies the apiserver and presents the client certificate of the
+    kubeconfig, as the transport lightkube creates by itself would.
+    """
+
+    def __init__(self):
+        self._transport: Optional[httpx.HTTPTransport] = None
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            if self._transport is None:
+                config = KubeConfig.from_env().get()
+                verify = verify_cluster(config.cluster, config.user, config.abs_file)
+                self._transport = httpx.HTTPTransport(verify=verify)
+        return self._transport.handle_request(request)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+def instrumented_transport(instruments: Sequence[TransportInstrument]) -> httpx.BaseTransport:
+    """Transport to the apiserver wrapped by each instrument, the last one outermost."""
+    transport: httpx.BaseTransport = KubeTransport()
+    for instrument in instruments:
+        transport = instrument.wrap(transport)
+    return transport
+
+
+def set_images(obj: AnyResource, images: Mapping[str, str]) -> AnyResource:
+    """Set the images of a workload's containers by container name."""
+    template = getattr(getattr(obj, "spec", None), "template", None)
+    if template and template.spec:
+        for container in (template.spec.initContainers or []) + template.spec.containers:
+            container.image = images.get(container.name, container.image)
+    return obj
+
+
+@lru_cache(maxsize=None)
+def release_params(path: Path) -> Dict:
+    """Template and images of a release, read once per process."""
+    return yaml.safe_load(path.read_text())
+
+
+# section headers and option names of a cloud.conf line, which gcfg may repeat
+INI_SECTION_RE = re.compile(r"^\s*\[(?P<name>[^\]]+)\]")
+INI_OPTION_RE = re.compile(r"^\s*(?P<key>[^\s;#\[=:][^=:]*?)\s*[=:]")
+
+
+def _cloud_conf_parser(**kwargs) -> configparser.ConfigParser:
+    return configparser.ConfigParser(interpolation=None, strict=False, **kwargs)
+
+
+def _ini_key(line: str) -> Optional[str]:
+    """Option name of a line, lowercased since gcfg matches names regardless of case."""
+    match = INI_OPTION_RE.match(line)
+    return match["key"].lower() if match else None
+
+
+def _ini_section(name: str) -> Tuple[str, Optional[str]]:
+    """Section of a header as gcfg matches it, its name regardless of case.
+
+    The quoted subsection of a header like [LoadBalancerClass "internal"]
+    is matched as written.
+    """
+    section, quoted, subsection = name.partition('"')
+    return section.strip().lower(), subsection.rpartition('"')[0] if quoted else None
+
+
+def _ini_sections(text: str) -> List[Tuple[Optional[str], List[str]]]:
+    """Lines of an INI document grouped by section, the first group precedes any header."""
+    sections: List[Tuple[Optional[str], List[str]]] = [(None, [])]
+    for line in text.splitlines():
+        if match := INI_SECTION_RE.match(line):
+            sections.append((match["name"].strip(), [line]))
+        else:
+            sections[-1][1].append(line)
+    return sections
+
+
+@lru_cache(maxsize=4)
+def merge_cloud_conf(cloud_conf_b64: str, overlay: str) -> str:
+    """Merge an INI overlay into a base64 encoded cloud.conf, section by section.
+
+    The merge works on lines, since gcfg options like internal-network-name
+    may be repeated. Every value of an overlay option replaces every value of
+    that option in the same cloud.conf section, at its first occurrence.
+    Section and option names match regardless of case, as gcfg reads them.
+    Other options, comments and sections of cloud.conf are kept as they are,
+    new options are added to the end of their section, and missing sections
+    to the end of the document. Cached by its inputs, so the merge only runs
+    again when either changes.
+
+    Raises:
+        configparser.Error: if either document isn't valid INI.
+    """
+    cloud_conf = base64.b64decode(cloud_conf_b64).decode()
+    _cloud_conf_parser().read_string(cloud_conf)
+    # read a [DEFAULT] overlay section like any other, rather than into every section
+    _cloud_conf_parser(default_section="").read_string(overlay)
+
+    sections = _ini_sections(cloud_conf)
+    for name, lines in _ini_sections(overlay)[1:]:
+        options = [line.strip() for line in lines[1:] if _ini_key(line)]
+        keys = {_ini_key(line) for line in options}
+        section = _ini_section(name)
+        target = next(
+            (body for other, body in sections if other and _ini_section(other) == section), None
+        )
+        if target is None:
+            previous = sections[-1][1]
+            if previous and previous[-1].strip():
+                previous.append("")
+            sections.append((name, [f"[{name}]", *options]))
+            continue
+        kept: List[str] = []
+        at = None
+        for line in target:
+            if _ini_key(line) in keys:
+                at = len(kept) if at is None else at
+            else:
+                kept.append(line)
+        if at is None:
+            # after the section's last line, ahead of the blank lines separating the next
+            at = len(kept)
+            while at > 1 and not kept[at - 1].strip():
+                at -= 1
+        kept[at:at] = options
+        target[:] = kept
+
+    merged = "\n".join(line for _, body in sections for line in body)
+    return base64.b64encode(f"{merged}\n".encode()).decode()
+
+
+CONFIG_TO_SECRET = {"cloud-conf": "cloud.conf", "endpoint-ca-cert": "endpoint-ca.cert"}
+
+
+def secret_data(config: Mapping) -> Dict[str, str]:
+    """Base64 encoded data of the cloud-config Secret, with cloud-conf-overlay merged."""
+    data = {}
+    for k, new_k in CONFIG_TO_SECRET.items():
+        if value := config.get(k):
+            data[new_k] = value
+
+    overlay = config.get("cloud-conf-overlay")
+    if overlay and (cloud_conf := data.get("cloud.conf")):
+        data["cloud.conf"] = merge_cloud_conf(cloud_conf, overlay)
+    return data
+
+
+def secret_name(config: Mapping) -> str:
+    """Name of the cloud-config Secret, suffixed by a digest of its data when immutable."""
+    if not config.get("immutable-secret"):
+        return SECRET_NAME
+    digest = hashlib.sha256(json.dumps(secret_data(config), sort_keys=True).encode())
+    return f"{SECRET_NAME}-{digest.hexdigest()[:SECRET_DIGEST_LENGTH]}"
 
 
 class CreateSecret(Addition):
@@ -26,32 +263,210 @@ class CreateSecret(Addition):
     a secret named cloud-config in the kube-system namespace
     cloud.conf -- base64 encoded contents of cloud.conf
     endpoint-ca.cert -- base64 encoded ca cert for the auth-url
-    """
 
-    CONFIG_TO_SECRET = {"cloud-conf": "cloud.conf", "endpoint-ca-cert": "endpoint-ca.cert"}
+    With immutable-secret, the secret is immutable and its name is suffixed
+    by a digest of its data, so every change creates a new secret.
+    """
 
     def __call__(self) -> Optional[AnyResource]:
         """Craft the secrets object for the deployment."""
-        secret_config = {}
-        for k, new_k in self.CONFIG_TO_SECRET.items():
-            if value := self.manifests.config.get(k):
-                secret_config[new_k] = value
+        config = self.manifests.config
+        if config.get("cloud-conf-overlay") and config.get("cloud-conf"):
+            log.info("Merging cloud-conf-overlay into cloud.conf")
 
         log.info("Encode secret data for cloud-controller.")
-        return from_dict(
-            dict(
-                apiVersion="v1",
-                kind="Secret",
-                type="Opaque",
-                metadata=dict(name=SECRET_NAME, namespace=NAMESPACE),
-                data=secret_config,
-            )
+        secret = dict(
+            apiVersion="v1",
+            kind="Secret",
+            type="Opaque",
+            metadata=dict(name=secret_name(config), namespace=NAMESPACE),
+            data=secret_data(config),
         )
+        if config.get("immutable-secret"):
+            secret["immutable"] = True
+        return from_dict(secret)
+
+
+@lru_cache(maxsize=None)
+def register_flow_control(version: str) -> str:
+    """Register the flowcontrol kinds of versions not bundled with lightkube."""
+    for kind, plural in (
+        ("FlowSchema", "flowschemas"),
+        ("PriorityLevelConfiguration", "prioritylevelconfigurations"),
+    ):
+        if version != "v1":
+            create_global_resource(FLOW_CONTROL_GROUP, version, kind, plural)
+    return version
+
+
+@lru_cache(maxsize=None)
+def flow_control_version(release: str) -> str:
+    """The flowcontrol API version to expect with the kubernetes release of a CCM release.
+
+    cloud-provider-openstack releases track the kubernetes minor version they
+    are built against, so the CCM release stands in for the cluster version
+    when the versions served by the apiserver aren't known.
+    """
+    minor = tuple(int(part) for part in release.lstrip("v").split(".")[:2])
+    version = next((v for since, v in FLOW_CONTROL_VERSIONS if minor >= since), "v1beta2")
+    return register_flow_control(version)
+
+
+def served_flow_control_version(client: Client) -> Optional[str]:
+    """The newest flowcontrol API version served by the apiserver, None if none is.
+
+    Each served group version is registered as an APIService, so discovery
+    reads those rather than the raw discovery endpoints.
+
+    Raises:
+        ApiError: if the APIServices can't be read.
+        HTTPError: if the apiserver can't be reached.
+    """
+    for _, version in FLOW_CONTROL_VERSIONS:
+        try:
+            client.get(APIService, f"{version}.{FLOW_CONTROL_GROUP}")
+        except ApiError as ex:
+            if ex.status.code == 404:
+                continue
+            raise
+        return register_flow_control(version)
+    return None
+
+
+def bound_service_accounts(resources: Iterable[AnyResource]) -> Set[Tuple[str, str]]:
+    """Namespace and name of each ServiceAccount bound by RoleBindings and ClusterRoleBindings."""
+    return {
+        (subject.namespace, subject.name)
+        for rsc in resources
+        if rsc.kind in ("RoleBinding", "ClusterRoleBinding")
+        for subject in rsc.subjects or []
+        if subject.kind == "ServiceAccount"
+    }
+
+
+def flow_control_resources(
+    version: str,
+    shares: int,
+    service_accounts: Iterable[Tuple[str, str]] = ((NAMESPACE, SERVICE_ACCOUNT),),
+) -> List[AnyResource]:
+    """PriorityLevelConfiguration and FlowSchema dedicated to the CCM service accounts.
+
+    Args:
+        version:          flowcontrol API version of the objects.
+        shares:           concurrency shares of the priority level.
+        service_accounts: namespace and name of the service accounts matched by the schema.
+    """
+    api_version = f"{FLOW_CONTROL_GROUP}/{version}"
+    limited: Dict = {
+        "limitResponse": {
+            "type": "Queue",
+            "queuing": {"queues": 16, "handSize": 4, "queueLengthLimit": 50},
+        }
+    }
+    if version == "v1beta2":
+        limited["assuredConcurrencyShares"] = shares
+    else:
+        # don't lend the seats reserved for the controller to other priority levels
+        limited.update(nominalConcurrencyShares=shares, lendablePercent=0)
+    priority_level = dict(
+        apiVersion=api_version,
+        kind="PriorityLevelConfiguration",
+        metadata=dict(name=RESOURCE_NAME),
+        spec=dict(type="Limited", limited=limited),
+    )
+    flow_schema = dict(
+        apiVersion=api_version,
+        kind="FlowSchema",
+        metadata=dict(name=RESOURCE_NAME),
+        spec=dict(
+            priorityLevelConfiguration=dict(name=RESOURCE_NAME),
+            matchingPrecedence=FLOW_SCHEMA_PRECEDENCE,
+            distinguisherMethod=dict(type="ByUser"),
+            rules=[
+                dict(
+                    subjects=[
+                        dict(
+                            kind="ServiceAccount",
+                            serviceAccount=dict(name=name, namespace=namespace),
+                        )
+                        for namespace, name in sorted(service_accounts)
+                    ],
+                    resourceRules=[
+                        dict(
+                            verbs=["*"],
+                            apiGroups=["*"],
+                            resources=["*"],
+                            clusterScope=True,
+                            namespaces=["*"],
+                        )
+                    ],
+                    nonResourceRules=[dict(verbs=["*"], nonResourceURLs=["*"])],
+                )
+            ],
+        ),
+    )
+    return [from_dict(priority_level), from_dict(flow_schema)]
+
+
+class CreateFlowControl(Addition):
+    """Create the API Priority and Fairness objects of the CCM service accounts.
+
+    Their requests get a priority level of their own with api-priority-shares
+    concurrency shares, so node initialization and load balancer updates
+    aren't queued behind other workloads when the apiserver is overloaded.
+    """
+
+    def __call__(self) -> Optional[List[AnyResource]]:
+        """Craft the FlowSchema and PriorityLevelConfiguration, if enabled."""
+        shares = self.manifests.config.get("api-priority-shares")
+        if not shares:
+            return None
+        version = self.manifests.flow_control_api
+        log.info("Adding %s flow control", version)
+        return flow_control_resources(version, shares, self.manifests.service_accounts())
+
+
+def healthz_endpoint(args: Sequence[str]) -> HTTPGetAction:
+    """The /healthz endpoint served by a cloud-controller-manager started with args.
+
+    Releases serve it over https on their secure port, unless started with
+    --secure-port=0 where only the insecure http port remains.
+    """
+    flags = dict(arg[2:].split("=", 1) for arg in args if arg.startswith("--") and "=" in arg)
+    host = flags.get("bind-address")
+    host = None if host in (None, "0.0.0.0", "::") else host
+    secure_port = int(flags.get("secure-port", CCM_SECURE_PORT))
+    if secure_port:
+        return HTTPGetAction(port=secure_port, host=host, path="/healthz", scheme="HTTPS")
+    port = int(flags.get("port", CCM_INSECURE_PORT))
+    return HTTPGetAction(port=port, host=host, path="/healthz", scheme="HTTP")
 
 
 class UpdateDaemonSet(Patch):
     """Update the CCM DaemonSets."""
 
+    def _add_probes(self, obj: AnyResource, container):
+        period = self.manifests.config.get("health-probe-period", 0)
+        if not period:
+            return
+        threshold = self.manifests.config.get("health-probe-failure-threshold", 3)
+        endpoint = healthz_endpoint(container.args or container.command or [])
+        container.readinessProbe = Probe(
+            httpGet=endpoint,
+            periodSeconds=period,
+            timeoutSeconds=min(period, 5),
+            failureThreshold=threshold,
+        )
+        # give the controller a full probe window to start before restarting it
+        container.livenessProbe = Probe(
+            httpGet=endpoint,
+            initialDelaySeconds=period * threshold,
+            periodSeconds=period,
+            timeoutSeconds=min(period, 5),
+            failureThreshold=threshold,
+        )
+        log.info("Adding %s health probes for %s/%s", endpoint.scheme, obj.kind, obj.metadata.name)
+
     def __call__(self, obj: AnyResource):
         """Patch the openstack CCM daemonset."""
         if obj.kind != "DaemonSet" or obj.metadata.name != RESOURCE_NAME:
@@ -68,7 +483,7 @@ class UpdateDaemonSet(Patch):
 
         for volume in obj.spec.template.spec.volumes:
             if volume.secret:
-                volume.secret.secretName = SECRET_NAME
+                volume.secret.secretName = secret_name(self.manifests.config)
                 log.info("Setting secret for %s/%s", obj.kind, obj.metadata.name)
 
         msg = f"Patching node-selector for {obj.kind}/{obj.metadata.name}"
@@ -89,6 +504,13 @@ class UpdateDaemonSet(Patch):
                         )
                         break
 
+                if controllers := self.manifests.config.get("controllers"):
+                    args = [a for a in container.args or [] if not a.startswith("--controllers=")]
+                    container.args = args + [f"--controllers={controllers}"]
+                    log.info("Patching controllers for %s/%s", obj.kind, obj.metadata.name)
+
+                self._add_probes(obj, container)
+
                 enabled = self.manifests.config.get("web-proxy-enable")
                 proxy_env = charms.proxylib.environ(
                     enabled=enabled, add_no_proxies=K8S_DEFAULT_NO_PROXY
@@ -105,6 +527,8 @@ class ProviderManifests(Manifests):
         charm_config,
         kube_control: KubeControlRequirer,
         integrator: OpenstackIntegrationRequirer,
+        instruments: Sequence[TransportInstrument] = (),
+        flow_control_api: Optional[str] = None,
     ):
         super().__init__(
             RESOURCE_NAME,
@@ -112,6 +536,7 @@ class ProviderManifests(Manifests):
             "upstream/controller_manager",
             [
                 CreateSecret(self),
+                CreateFlowControl(self),
                 ManifestLabel(self),
                 ConfigRegistry(self),
                 UpdateDaemonSet(self),
@@ -120,6 +545,34 @@ class ProviderManifests(Manifests):
         self.integrator = integrator
         self.charm_config = charm_config
         self.kube_control = kube_control
+        self.instruments = instruments
+        # flowcontrol version last discovered as served by the apiserver
+        self.served_flow_control_api = flow_control_api
+        # service accounts by release, read once from its manifests
+        self._service_accounts: Dict[str, List[Tuple[str, str]]] = {}
+
+    def _resource_from_yaml(self, filepath: Path) -> List[AnyResource]:
+        """Read a manifest file, or render the release template named by its params."""
+        load = super()._resource_from_yaml
+        if filepath.name != RELEASE_PARAMS:
+            return load(filepath)
+        params = release_params(filepath)
+        template = self.base_path / TEMPLATES_PATH.name / params["template"]
+        ymls = sorted(path for ext in FILE_TYPES for path in template.glob(f"*.{ext}"))
+        return [set_images(rsc, params["images"]) for yml in ymls for rsc in load(yml)]
+
+    @cached_property
+    def client(self) -> Client:
+        """Lazy evaluation of the lightkube client, its requests going through the instruments."""
+        transport = instrumented_transport(self.instruments) if self.instruments else None
+        client = Client(field_manager=f"{self.model.app.name}-{self.name}", transport=transport)
+        msg = "Failed to load in cluster CRDs"
+        try:
+            load_in_cluster_generic_resources(client)
+        except (ApiError, HTTPError) as ex:
+            log.exception(msg)
+            raise ManifestClientError(msg, ex) from ex
+        return client
 
     @property
     def config(self) -> Dict:
@@ -146,9 +599,178 @@ class ProviderManifests(Manifests):
         hash.update(json_str.encode())
         return int(hash.hexdigest(), 16)
 
+    def installed_resources(self) -> FrozenSet[HashableResource]:
+        """All currently installed resources expected by this manifest.
+
+        Each kind is listed once per namespace, selecting only the resources
+        labelled by this manifest, and matched locally against the expected
+        resources, so the number of API calls doesn't scale with the number of
+        resources in the release.
+        """
+        expected: Dict[tuple, Set[str]] = defaultdict(set)
+        for obj in self.resources:
+            expected[(type(obj.resource), obj.namespace)].add(obj.name)
+
+        labels = {APP_LABEL: self.model.app.name, MANIFEST_LABEL: self.name}
+        result: Dict[HashableResource, None] = {}
+        for (kind, namespace), names in expected.items():
+            try:
+                for rsc in self.client.list(kind, namespace=namespace, labels=labels):
+                    if rsc.metadata.name in names:
+                        result[HashableResource(rsc)] = None
+            except ManifestClientError:
+                log.exception(
+                    f"Cannot connect to the api endpoint, marking {kind.__name__} as missing"
+                )
+            except (ApiError, HTTPError):
+                log.exception(f"Failed to list installed {kind.__name__} resources")
+        return frozenset(result.keys())
+
+    def orphaned_resources(
+        self, previous: Optional[str], flow_control: bool = False
+    ) -> List[HashableResource]:
+        """Resources of a previous release which the current release no longer ships.
+
+        Computed from the local manifests of both releases, without listing the cluster.
+
+        Args:
+            previous:     release deployed before, if any.
+            flow_control: whether the flow control objects were deployed before.
+        """
+        shipped = []
+        if previous:
+            shipped = [HashableResource(rsc) for rsc in self.release_resources(previous)]
+        if flow_control:
+            shipped += map(HashableResource, flow_control_resources(self.flow_control_api, 1))
+        current = set(self.resources)
+        return [obj for obj in dict.fromkeys(shipped) if obj not in current]
+
+    def release_resources(self, release: str) -> List[AnyResource]:
+        """Resources shipped by a release, as read from its manifests before any manipulation."""
+        release_path = self.manifest_path / release
+        ymls = sorted(path for ext in FILE_TYPES for path in release_path.glob(f"*.{ext}"))
+        return [rsc for yml in ymls for rsc in self._resource_from_yaml(yml)]
+
+    def service_accounts(self) -> List[Tuple[str, str]]:
+        """Namespace and name of the ServiceAccounts the CCM of the current release acts as.
+
+        Those bound by the release's RoleBindings and ClusterRoleBindings, and
+        when the DaemonSet runs with --use-service-account-credentials=true,
+        those of the controllers, which then call the apiserver on their own.
+        """
+        release = self.current_release
+        if release not in self._service_accounts:
+            resources = self.release_resources(release)
+            accounts = {(NAMESPACE, SERVICE_ACCOUNT), *bound_service_accounts(resources)}
+            args = [
+                arg
+                for rsc in resources
+                if rsc.kind == "DaemonSet" and rsc.metadata.name == RESOURCE_NAME
+                for container in rsc.spec.template.spec.containers
+                for arg in container.args or []
+            ]
+            if "--use-service-account-credentials=true" in args:
+                accounts.update((NAMESPACE, name) for name in CONTROLLER_SERVICE_ACCOUNTS)
+            self._service_accounts[release] = sorted(accounts)
+        return self._service_accounts[release]
+
+    @property
+    def secret_name(self) -> str:
+        """Name of the cloud-config Secret rendered with the current config."""
+        return secret_name(self.config)
+
+    @property
+    def flow_control_api(self) -> str:
+        """The flowcontrol API version of the flow control objects.
+
+        The version discovered as served by the apiserver, else the version the
+        release implies. Rendering never queries the apiserver for it.
+        """
+        if self.served_flow_control_api:
+            return register_flow_control(self.served_flow_control_api)
+        return flow_control_version(self.current_release)
+
+    def discover_flow_control_api(self) -> Optional[str]:
+        """Discover the newest flowcontrol API version served by the apiserver.
+
+        Returns:
+            the served version, None if the apiserver can't tell.
+        """
+        try:
+            served = served_flow_control_version(self.client)
+        except (ManifestClientError, ApiError, HTTPError, ConfigError) as ex:
+            log.warning("Cannot discover the served flowcontrol versions: %s", ex)
+            return None
+        if served:
+            self.served_flow_control_api = served
+        return served
+
+    @property
+    def flow_control(self) -> bool:
+        """True if the flow control objects are part of the manifests."""
+        return bool(self.config.get("api-priority-shares"))
+
+    def prune(self, previous: Optional[str], flow_control: bool = False) -> List[str]:
+        """Delete the resources orphaned since a previous deployment, if labelled by this charm.
+
+        Returns:
+            names of the pruned resources.
+
+        Raises:
+            ManifestClientError: if a resource can't be deleted.
+        """
+        orphans = self.orphaned_resources(previous, flow_control)
+        if orphans:
+            log.info("Pruning %d resources orphaned since %s", len(orphans), previous)
+            self.delete_resources(*orphans, ignore_not_found=True)
+        return [str(obj) for obj in orphans]
+
+    def prune_secrets(self, keep: int = SUPERSEDED_SECRETS_KEPT) -> List[str]:
+        """Delete the cloud-config Secrets superseded by the current one.
+
+        The newest superseded secrets are kept, so pods still starting from
+        the previous rollout and a rollback to the previous config find them.
+
+        Args:
+            keep: number of superseded secrets kept, newest first.
+
+        Returns:
+            names of the deleted secrets.
+
+        Raises:
+            ManifestClientError: if the secrets can't be listed or deleted.
+        """
+        current = self.secret_name
+        labels = {APP_LABEL: self.model.app.name, MANIFEST_LABEL: self.name}
+        try:
+            secrets = self.client.list(Secret, namespace=NAMESPACE, labels=labels)
+            superseded = sorted(
+                (
+                    obj
+                    for obj in secrets
+                    if SECRET_NAME_RE.match(obj.metadata.name) and obj.metadata.name != current
+                ),
+                key=lambda obj: (obj.metadata.creationTimestamp or EPOCH, obj.metadata.name),
+                reverse=True,
+            )
+        except (ApiError, HTTPError) as ex:
+            msg = "Failed to list the cloud-config secrets"
+            log.exception(msg)
+            raise ManifestClientError(msg, ex) from ex
+        superseded = [HashableResource(obj) for obj in superseded[keep:]]
+        if superseded:
+            log.info("Deleting %d superseded cloud-config secrets", len(superseded))
+            self.delete_resources(*superseded, ignore_not_found=True)
+        return [obj.name for obj in superseded]
+
     def evaluate(self) -> Optional[str]:
         """Determine if manifest_config can be applied to manifests."""
         for prop in ["cloud-conf", "cluster-name"]:
             if not self.config.get(prop):
                 return f"Provider manifests waiting for definition of {prop}"
+        if overlay := self.config.get("cloud-conf-overlay"):
+            try:
+                merge_cloud_conf(self.config["cloud-conf"], overlay)
+            except (configparser.Error, ValueError) as e:
+                return f"Cannot apply cloud-conf-overlay: {str(e).splitlines()[0]}"
         return None
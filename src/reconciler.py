@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Reconcile the desired manifests from a worker process detached from the juju hooks.
+
+Hooks only record the desired state with ``BackgroundReconciler.submit`` and
+read back the worker's progress with ``BackgroundReconciler.status``. The
+worker applies the rendered resources, then keeps probing the rollout and the
+nodes, writing each result to a status file. Hooks restart the worker whenever
+it isn't running.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import yaml
+from httpx import HTTPError
+from lightkube import Client, codecs
+from lightkube.core.exceptions import ApiError, ConfigError, LoadResourceError
+from lightkube.resources.apps_v1 import DaemonSet
+from lightkube.resources.core_v1 import Node
+
+from metrics import node_initialized
+from provider_manifests import FLOW_CONTROL_GROUP, register_flow_control
+from rollout import DaemonSetProgress
+
+log = logging.getLogger(__name__)
+
+DESIRED_META = "desired.json"
+DESIRED_MANIFESTS = "desired.yaml"
+STATUS = "status.json"
+LOCK = "worker.lock"
+PID = "worker.pid"
+WORKER_LOG = "worker.log"
+PROBE_INTERVAL = 60.0
+MAX_BACKOFF = 300.0
+
+
+def _write_atomic(path: Path, content: str):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(content)
+    tmp.replace(path)
+
+
+def _read_json(path: Path) -> Dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+class BackgroundReconciler:
+    """Hook side of the background reconciler."""
+
+    def __init__(self, state_dir: Path, kubeconfig: Path):
+        self.state_dir = state_dir
+        self.kubeconfig = kubeconfig
+
+    def submit(
+        self,
+        config_hash: int,
+        field_manager: str,
+        manifests: str,
+        prune: Sequence[Dict] = (),
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        """Record the desired state and make sure a worker reconciles it.
+
+        Args:
+            config_hash:   hash of the config the manifests were rendered from
+            field_manager: field manager applying the manifests
+            manifests:     yaml of the resources to apply
+            prune:         apiVersion, kind, namespace and name of resources to delete
+            labels:        labels a resource must carry to be pruned
+        """
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        previous = _read_json(self.state_dir / DESIRED_META)
+        if previous.get("prune") and self.status().get("pruned") != previous.get("hash"):
+            # the worker didn't prune the previous orphans yet, carry them over
+            prune = previous["prune"] + [p for p in prune if p not in previous["prune"]]
+        _write_atomic(self.state_dir / DESIRED_MANIFESTS, manifests)
+        meta = {
+            "hash": config_hash,
+            "field_manager": field_manager,
+            "submitted": time.time(),
+            "prune": list(prune),
+            "labels": labels or {},
+        }
+        _write_atomic(self.state_dir / DESIRED_META, json.dumps(meta))
+        log.info("Submitted desired state %s to the background reconciler", config_hash)
+        self.ensure_worker()
+
+    def desired_hash(self) -> Optional[int]:
+        """Config hash of the recorded desired state."""
+        return _read_json(self.state_dir / DESIRED_META).get("hash")
+
+    def status(self) -> Dict:
+        """Latest status reported by the worker."""
+        return _read_json(self.state_dir / STATUS)
+
+    def running(self) -> bool:
+        """True while a worker holds the worker lock."""
+        lock = self.state_dir / LOCK
+        if not lock.exists():
+            return False
+        with lock.open("a") as fp:
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(fp, fcntl.LOCK_UN)
+        return False
+
+    def ensure_worker(self) -> bool:
+        """Start a detached worker if there's desired state and none is running.
+
+        Returns:
+            True if a new worker was started.
+        """
+        if not (self.state_dir / DESIRED_META).exists() or self.running():
+            return False
+        env = dict(os.environ, KUBECONFIG=str(self.kubeconfig))
+        with open(os.devnull, "rb") as devnull:
+            subprocess.Popen(
+                [sys.executable, __file__, str(self.state_dir)],
+                stdin=devnull,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                env=env,
+                start_new_session=True,
+            )
+        log.info("Started the background reconciler")
+        return True
+
+    def stop(self):
+        """Drop the desired state and terminate the worker."""
+        (self.state_dir / DESIRED_META).unlink(missing_ok=True)
+        try:
+            pid = int((self.state_dir / PID).read_text())
+        except (OSError, ValueError):
+            return
+        if self.running():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+class Worker:
+    """Worker process applying the desired state and probing the cluster."""
+
+    def __init__(self, state_dir: Path):
+        self.state_dir = state_dir
+        self.status: Dict = _read_json(state_dir / STATUS)
+
+    def _report(self, **values):
+        self.status.update(values, updated=time.time())
+        _write_atomic(self.state_dir / STATUS, json.dumps(self.status))
+
+    def _desired(self) -> Optional[Dict]:
+        return _read_json(self.state_dir / DESIRED_META) or None
+
+    def _resources(self) -> List:
+        manifests = (self.state_dir / DESIRED_MANIFESTS).read_text()
+        # flowcontrol versions not bundled with lightkube load once registered, as in the charm
+        for doc in yaml.safe_load_all(manifests):
+            group, _, version = (doc or {}).get("apiVersion", "").rpartition("/")
+            if group == FLOW_CONTROL_GROUP:
+                register_flow_control(version)
+        return codecs.load_all_yaml(manifests)
+
+    def apply(self, desired: Dict) -> bool:
+        """Apply the desired resources, False if the desired state changed meanwhile."""
+        client = Client(field_manager=desired["field_manager"])
+        resources = self._resources()
+        self._report(hash=desired["hash"], state="applying", applied=0, total=len(resources))
+        for idx, rsc in enumerate(resources, start=1):
+            if (self._desired() or {}).get("hash") != desired["hash"]:
+                log.info("Desired state changed, restarting the reconcile")
+                return False
+            log.info("Applying %s/%s", rsc.kind, rsc.metadata.name)
+            client.apply(rsc, force=True)
+            self._report(applied=idx)
+        if desired.get("prune"):
+            self.prune(client, desired, resources)
+        self._report(state="applied", error="")
+        return True
+
+    def prune(self, client: Client, desired: Dict, resources: List):
+        """Delete the orphaned resources still labelled by the charm."""
+        keep = {(r.kind, r.metadata.namespace, r.metadata.name) for r in resources}
+        pruned = []
+        for orphan in desired["prune"]:
+            namespace = orphan.get("namespace")
+            if (orphan["kind"], namespace, orphan["name"]) in keep:
+                continue
+            kind = codecs.resource_registry.load(orphan["apiVersion"], orphan["kind"])
+            fields = {"metadata.name": orphan["name"]}
+            for obj in client.list(
+                kind, namespace=namespace, labels=desired["labels"], fields=fields
+            ):
+                log.info("Pruning %s/%s", orphan["kind"], obj.metadata.name)
+                client.delete(kind, obj.metadata.name, namespace=namespace)
+                pruned.append("/".join(filter(None, (orphan["kind"], namespace, orphan["name"]))))
+        self._report(pruned=desired["hash"], pruned_resources=pruned)
+
+    def probe(self, resources: Iterable):
+        """Report the rollout of the DaemonSets and the nodes awaiting initialization."""
+        client = Client()
+        rollouts = {}
+        for rsc in resources:
+            if rsc.kind == "DaemonSet":
+                ds = client.get(DaemonSet, rsc.metadata.name, namespace=rsc.metadata.namespace)
+                rollouts[rsc.metadata.name] = DaemonSetProgress.from_daemonset(ds)
+        uninitialized = [n.metadata.name for n in client.list(Node) if not node_initialized(n)]
+        self._report(
+            rollout=", ".join(str(p) for p in rollouts.values()),
+            rollout_complete=all(p.complete for p in rollouts.values()),
+            uninitialized=uninitialized,
+            probed=time.time(),
+        )
+
+    def _wait(self, seconds: float, desired: Dict):
+        """Sleep for seconds, waking up early if the desired state changes."""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and self._desired() == desired:
+            time.sleep(1.0)
+
+    def run(self) -> int:
+        """Reconcile until the desired state is dropped."""
+        backoff = 0.0
+        while desired := self._desired():
+            try:
+                applied = self.status.get("state") == "applied"
+                if self.status.get("hash") != desired["hash"] or not applied:
+                    if not self.apply(desired):
+                        continue
+                self.probe(self._resources())
+                backoff = 0.0
+                self._wait(PROBE_INTERVAL, desired)
+            except (ApiError, ConfigError, HTTPError, LoadResourceError, OSError) as e:
+                log.exception("Background reconcile failed")
+                self._report(state="failed", error=str(e).splitlines()[0] if str(e) else "")
+                backoff = min(max(backoff * 2, 5.0), MAX_BACKOFF)
+                self._wait(backoff, desired)
+        log.info("No desired state, stopping")
+        return 0
+
+
+def main(state_dir: Path) -> int:
+    """Entrypoint of the detached worker process."""
+    handler = RotatingFileHandler(state_dir / WORKER_LOG, maxBytes=1 << 20, backupCount=1)
+    logging.basicConfig(
+        level=logging.INFO,
+        handlers=[handler],
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    with (state_dir / LOCK).open("a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log.info("Another worker is running")
+            return 0
+        (state_dir / PID).write_text(str(os.getpid()))
+        return Worker(state_dir).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main(Path(sys.argv[1])))
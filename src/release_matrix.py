@@ -0,0 +1,242 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Render every shipped release against config fixtures, in parallel worker processes.
+
+Each render runs the charm's manipulations over a release and checks that
+every patch left its mark on the rendered resources, so an upstream release
+dropping something a patch relies on (the CLUSTER_NAME env var, the secret
+volume, ...) is flagged rather than silently deployed unpatched.
+"""
+
+import argparse
+import base64
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import product
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
+
+from ops.manifests import literals
+
+from config import MANIFESTS_PATH, shipped_releases
+from provider_manifests import (
+    FLOW_CONTROL_GROUP,
+    RESOURCE_NAME,
+    ProviderManifests,
+    bound_service_accounts,
+)
+
+APP_NAME = "openstack-cloud-controller"
+CLUSTER_NAME = "render-matrix"
+REGISTRY = "rocks.canonical.com/cdk"
+CLOUD_CONF = "[Global]\nauth-url = https://keystone.example.com:5000/v3\nregion = RegionOne\n"
+
+# charm config rendered against every release, on top of the integrator's cloud.conf
+FIXTURES: Dict[str, Dict] = {
+    "default": {},
+    "registry": {"image-registry": "registry.example.com:5000/mirror"},
+    "controllers": {"controllers": "*,-route"},
+    "overlay": {"cloud-conf-overlay": "[LoadBalancer]\nlb-provider = ovn\n"},
+    "priority": {"api-priority-shares": 30},
+    "immutable": {"immutable-secret": True},
+}
+
+
+@dataclass(frozen=True)
+class RenderResult:
+    """Outcome of rendering one release with one config fixture."""
+
+    release: str
+    fixture: str
+    seconds: float
+    resources: int
+    problems: Tuple[str, ...]
+
+    @property
+    def ok(self) -> bool:
+        """True if every patch applied to the rendered resources."""
+        return not self.problems
+
+
+def _manifests(root: Path, release: str, config: Mapping) -> ProviderManifests:
+    """ProviderManifests fed by fixed relation data instead of a deployed charm."""
+    charm = SimpleNamespace(model=SimpleNamespace(app=SimpleNamespace(name=APP_NAME)))
+    kube_control = SimpleNamespace(
+        get_registry_location=lambda: REGISTRY, get_cluster_tag=lambda: CLUSTER_NAME
+    )
+    integrator = SimpleNamespace(cloud_conf_b64=base64.b64encode(CLOUD_CONF.encode()))
+    integrator.endpoint_tls_ca = None
+    charm_config = SimpleNamespace(available_data={**config, "manager-release": release})
+    manifests = ProviderManifests(charm, charm_config, kube_control, integrator)
+    manifests.base_path = root / MANIFESTS_PATH.parent
+    return manifests
+
+
+def _check_secret(manifests: ProviderManifests, resources: List) -> List[str]:
+    name = manifests.secret_name
+    secrets = [r for r in resources if r.kind == "Secret" and r.metadata.name == name]
+    if not secrets:
+        return [f"CreateSecret: no {name} Secret rendered"]
+    if bool(secrets[0].immutable) != bool(manifests.config.get("immutable-secret")):
+        return [f"CreateSecret: {name} Secret immutability doesn't follow immutable-secret"]
+    cloud_conf = base64.b64decode(secrets[0].data.get("cloud.conf", "")).decode()
+    overlay = manifests.config.get("cloud-conf-overlay")
+    if overlay and overlay.splitlines()[-1] not in cloud_conf:
+        return ["CreateSecret: cloud-conf-overlay wasn't merged into cloud.conf"]
+    return []
+
+
+def _check_daemonset(manifests: ProviderManifests, resources: List) -> List[str]:
+    daemonsets = [
+        r for r in resources if r.kind == "DaemonSet" and r.metadata.name == RESOURCE_NAME
+    ]
+    if not daemonsets:
+        return [f"UpdateDaemonSet: no {RESOURCE_NAME} DaemonSet in the release"]
+    config, pod = manifests.config, daemonsets[0].spec.template
+
+    problems = []
+    if "juju.is/manifest-hash" not in (pod.metadata.annotations or {}):
+        problems.append("UpdateDaemonSet: manifest-hash annotation missing")
+    secret = manifests.secret_name
+    if not any(v.secret and v.secret.secretName == secret for v in pod.spec.volumes or []):
+        problems.append(f"UpdateDaemonSet: no secret volume mounting {secret}")
+
+    registry = config["image-registry"]
+    for container in (pod.spec.initContainers or []) + pod.spec.containers:
+        if not container.image.startswith(f"{registry}/"):
+            problems.append(f"ConfigRegistry: {container.name} image {container.image}")
+
+    containers = [c for c in pod.spec.containers if c.name == RESOURCE_NAME]
+    if not containers:
+        return problems + [f"UpdateDaemonSet: no {RESOURCE_NAME} container"]
+    env = {e.name: e.value for e in containers[0].env or []}
+    if env.get("CLUSTER_NAME") != config["cluster-name"]:
+        problems.append("UpdateDaemonSet: CLUSTER_NAME env var not set")
+    controllers = config.get("controllers")
+    if controllers and f"--controllers={controllers}" not in (containers[0].args or []):
+        problems.append("UpdateDaemonSet: --controllers argument not set")
+    return problems
+
+
+def flow_schema_service_accounts(schema) -> Set[Tuple[str, str]]:
+    """Namespace and name of the ServiceAccounts a FlowSchema's rules match."""
+    # flowcontrol versions not bundled with lightkube load as generic resources
+    spec = schema.spec if isinstance(schema.spec, dict) else schema.spec.to_dict()
+    return {
+        (subject["serviceAccount"]["namespace"], subject["serviceAccount"]["name"])
+        for rule in spec["rules"]
+        for subject in rule["subjects"]
+        if subject["kind"] == "ServiceAccount"
+    }
+
+
+def _check_flow_control(manifests: ProviderManifests, resources: List) -> List[str]:
+    kinds = {r.kind for r in resources if r.apiVersion.startswith(FLOW_CONTROL_GROUP)}
+    if not manifests.flow_control:
+        return []
+    if kinds != {"FlowSchema", "PriorityLevelConfiguration"}:
+        return ["CreateFlowControl: flow control objects not rendered"]
+    (schema,) = [r for r in resources if r.kind == "FlowSchema"]
+    bound = bound_service_accounts(resources)
+    matched = flow_schema_service_accounts(schema)
+    return [
+        f"CreateFlowControl: FlowSchema doesn't match ServiceAccount {namespace}/{name}"
+        for namespace, name in sorted(bound - matched)
+    ]
+
+
+def _check_labels(manifests: ProviderManifests, resources: List) -> List[str]:
+    return [
+        f"ManifestLabel: {r.kind}/{r.metadata.name} not labelled"
+        for r in resources
+        if (r.metadata.labels or {}).get(literals.MANIFEST_LABEL) != manifests.name
+    ]
+
+
+def render(root: Path, release: str, fixture: str, config: Mapping) -> RenderResult:
+    """Render a release with a config fixture, and check each patch was applied."""
+    started = time.perf_counter()
+    resources: List = []
+    try:
+        manifests = _manifests(root, release, config)
+        resources = [obj.resource for obj in manifests.resources]
+        problems = [
+            problem
+            for check in (_check_secret, _check_daemonset, _check_flow_control, _check_labels)
+            for problem in check(manifests, resources)
+        ]
+    except Exception as e:
+        problems = [f"render failed: {type(e).__name__}: {e}"]
+    elapsed = time.perf_counter() - started
+    return RenderResult(release, fixture, elapsed, len(resources), tuple(problems))
+
+
+def _render_args(args: Tuple[Path, str, str, Mapping]) -> RenderResult:
+    return render(*args)
+
+
+def render_matrix(
+    root: Path = Path("."),
+    releases: Optional[Iterable[str]] = None,
+    fixtures: Mapping[str, Mapping] = FIXTURES,
+    workers: Optional[int] = None,
+) -> List[RenderResult]:
+    """Render every release with every config fixture across worker processes.
+
+    Args:
+        root:     charm directory holding the upstream manifests.
+        releases: releases to render, every shipped release by default.
+        fixtures: named charm config rendered against each release.
+        workers:  number of worker processes, one per cpu by default.
+
+    Returns:
+        one result per release and fixture, ordered by release then fixture.
+    """
+    if releases is None:
+        releases = shipped_releases(root / MANIFESTS_PATH)
+    jobs = [
+        (root, release, name, dict(fixtures[name]))
+        for release, name in product(sorted(releases), fixtures)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_args, jobs, chunksize=max(len(jobs) // 32, 1)))
+
+
+def report(results: Sequence[RenderResult]) -> str:
+    """Table of the render times by release, followed by any problems found."""
+    by_release: Dict[str, List[RenderResult]] = {}
+    for result in results:
+        by_release.setdefault(result.release, []).append(result)
+    lines = [f"{'release':<10} {'renders':>7} {'mean':>8} {'max':>8}  problems"]
+    for release, renders in by_release.items():
+        times = [r.seconds for r in renders]
+        failed = sum(not r.ok for r in renders)
+        lines.append(
+            f"{release:<10} {len(renders):>7} {sum(times) / len(times):>7.3f}s "
+            f"{max(times):>7.3f}s  {failed}"
+        )
+    for result in results:
+        lines += [f"{result.release} [{result.fixture}] {p}" for p in result.problems]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Render the release matrix from the command line, non-zero if any render has problems."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("releases", nargs="*", help="releases to render, all by default")
+    parser.add_argument("--root", type=Path, default=Path("."), help="charm directory")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    results = render_matrix(args.root, args.releases or None, workers=args.workers)
+    print(report(results))
+    print(f"{len(results)} renders in {time.perf_counter() - started:.2f}s")
+    return 0 if all(r.ok for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
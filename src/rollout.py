@@ -0,0 +1,313 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Track and prepare DaemonSet rollouts of the cloud-controller-manager."""
+
+import copy
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from httpx import HTTPError
+from lightkube.core.exceptions import ApiError
+from lightkube.models.apps_v1 import DaemonSetSpec, DaemonSetUpdateStrategy
+from lightkube.models.core_v1 import (
+    Container,
+    EmptyDirVolumeSource,
+    PodSpec,
+    PodTemplateSpec,
+    ResourceRequirements,
+    Volume,
+    VolumeMount,
+)
+from lightkube.models.meta_v1 import LabelSelector, ObjectMeta
+from lightkube.resources.apps_v1 import DaemonSet
+from lightkube.resources.coordination_v1 import Lease
+from ops.manifests import HashableResource, ManifestClientError, ManifestLabel
+
+from provider_manifests import (
+    CCM_SECURE_PORT,
+    NAMESPACE,
+    RESOURCE_NAME,
+    ProviderManifests,
+    healthz_endpoint,
+)
+
+log = logging.getLogger(__name__)
+
+PREPULL_NAME = f"{RESOURCE_NAME}-prepull"
+GREEN_NAME = f"{RESOURCE_NAME}-green"
+# the pods share the host network with the CCM pods on the same nodes
+GREEN_SECURE_PORT = CCM_SECURE_PORT + 10
+# leader election lease of the cloud-controller-manager, by its default --leader-elect-resource-name
+LEASE_NAME = "cloud-controller-manager"
+# statically linked image lending its binary to the pre-pull containers, mirrored by
+# upstream/update.py with the release images and pulled from image-registry like them
+PREPULL_HELPER_IMAGE = "docker.io/library/busybox:1.36"
+# emptyDir where the helper's binary is copied, run as "true" from every pulled image
+PREPULL_BIN = "/prepull-bin"
+POLL_INTERVAL = 2.0
+
+
+@dataclass(frozen=True)
+class DaemonSetProgress:
+    """Rollout progress of a DaemonSet as reported by its status."""
+
+    generation: int = 0
+    observed_generation: int = 0
+    desired: int = 0
+    updated: int = 0
+    ready: int = 0
+
+    @classmethod
+    def from_daemonset(cls, ds: DaemonSet) -> "DaemonSetProgress":
+        """Read the progress from a DaemonSet's metadata and status."""
+        status = ds.status
+        return cls(
+            generation=ds.metadata.generation or 0,
+            observed_generation=(status and status.observedGeneration) or 0,
+            desired=(status and status.desiredNumberScheduled) or 0,
+            updated=(status and status.updatedNumberScheduled) or 0,
+            ready=(status and status.numberReady) or 0,
+        )
+
+    @property
+    def complete(self) -> bool:
+        """True once the controller observed the latest spec and every pod is updated and ready."""
+        return (
+            self.observed_generation >= self.generation
+            and self.updated >= self.desired
+            and self.ready >= self.desired
+        )
+
+    def __str__(self) -> str:
+        """Short human readable progress."""
+        return f"{self.updated}/{self.desired} updated, {self.ready}/{self.desired} ready"
+
+
+ProgressCallback = Callable[[DaemonSetProgress], None]
+
+
+def wait_for_daemonset(
+    manifests: ProviderManifests,
+    name: str,
+    budget: float,
+    on_progress: Optional[ProgressCallback] = None,
+    interval: float = POLL_INTERVAL,
+) -> DaemonSetProgress:
+    """Poll a DaemonSet until its rollout completes or the time budget is spent.
+
+    Raises:
+        ManifestClientError: if the DaemonSet couldn't be read from the cluster.
+    """
+    deadline = time.monotonic() + budget
+    last = None
+    while True:
+        try:
+            ds = manifests.client.get(DaemonSet, name, namespace=NAMESPACE)
+        except (ApiError, HTTPError) as ex:
+            msg = f"Failed reading rollout progress of DaemonSet/{NAMESPACE}/{name}"
+            log.exception(msg)
+            raise ManifestClientError(msg, ex) from ex
+        progress = DaemonSetProgress.from_daemonset(ds)
+        if progress != last and on_progress:
+            on_progress(progress)
+        last = progress
+        if progress.complete or time.monotonic() + interval > deadline:
+            return progress
+        time.sleep(interval)
+
+
+def rendered_daemonset(manifests: ProviderManifests) -> Optional[DaemonSet]:
+    """The rendered CCM DaemonSet about to be applied."""
+    for obj in manifests.resources:
+        if obj.kind == "DaemonSet" and obj.name == RESOURCE_NAME:
+            return obj.resource
+    return None
+
+
+class ImagePrePull:
+    """Pull the images of a pending CCM rollout onto the selected nodes ahead of time.
+
+    A short-lived DaemonSet, scheduled like the CCM DaemonSet, runs each new image
+    as an init container. Once it is ready on every node, the images are cached and
+    the real rollout only needs to restart the containers.
+
+    The init containers don't rely on the CLI of the pulled images: a static
+    busybox binary from the helper image is copied into a shared volume first,
+    and each pulled image runs it as "true".
+    """
+
+    def __init__(self, manifests: ProviderManifests, helper: Optional[str] = None):
+        self.manifests = manifests
+        self.helper = helper
+
+    def helper_image(self) -> str:
+        """The configured helper image, by default busybox from the image registry."""
+        if self.helper:
+            return self.helper
+        registry = self.manifests.config.get("image-registry")
+        if not registry:
+            return PREPULL_HELPER_IMAGE
+        # replace the source registry as ConfigRegistry does for the release images
+        _, image = PREPULL_HELPER_IMAGE.split("/", 1)
+        return f"{registry}/{image}"
+
+    def _target(self) -> Optional[DaemonSet]:
+        return rendered_daemonset(self.manifests)
+
+    def pending_images(self) -> List[str]:
+        """Images of the rendered CCM DaemonSet which aren't yet in the installed one.
+
+        An uninstalled DaemonSet has nothing pending, since there's no running CCM to
+        keep up while the images are pulled.
+        """
+        target = self._target()
+        if not target:
+            return []
+        try:
+            installed = self.manifests.client.get(DaemonSet, RESOURCE_NAME, namespace=NAMESPACE)
+        except ApiError as ex:
+            if ex.status.code == 404:
+                return []
+            raise ManifestClientError(f"Failed reading DaemonSet/{RESOURCE_NAME}", ex) from ex
+        except HTTPError as ex:
+            raise ManifestClientError(f"Failed reading DaemonSet/{RESOURCE_NAME}", ex) from ex
+        current = {c.image for c in installed.spec.template.spec.containers}
+        wanted = {c.image for c in target.spec.template.spec.containers}
+        return sorted(wanted - current)
+
+    def daemonset(self, images: List[str]) -> DaemonSet:
+        """Craft the pre-pull DaemonSet for the pending images."""
+        pod = self._target().spec.template.spec
+        helper = self.helper_image()
+        labels = {"k8s-app": PREPULL_NAME}
+        mounts = [VolumeMount(name="prepull-bin", mountPath=PREPULL_BIN)]
+        ds = DaemonSet(
+            metadata=ObjectMeta(name=PREPULL_NAME, namespace=NAMESPACE, labels=dict(labels)),
+            spec=DaemonSetSpec(
+                selector=LabelSelector(matchLabels=labels),
+                updateStrategy=DaemonSetUpdateStrategy(type="RollingUpdate"),
+                template=PodTemplateSpec(
+                    metadata=ObjectMeta(labels=dict(labels)),
+                    spec=PodSpec(
+                        nodeSelector=pod.nodeSelector,
+                        affinity=pod.affinity,
+                        tolerations=pod.tolerations,
+                        imagePullSecrets=pod.imagePullSecrets,
+                        securityContext=pod.securityContext,
+                        terminationGracePeriodSeconds=0,
+                        volumes=[Volume(name="prepull-bin", emptyDir=EmptyDirVolumeSource())],
+                        initContainers=[
+                            Container(
+                                name="prepull-bin",
+                                image=helper,
+                                command=["cp", "/bin/busybox", f"{PREPULL_BIN}/true"],
+                                volumeMounts=mounts,
+                            )
+                        ]
+                        + [
+                            Container(
+                                name=f"prepull-{idx}",
+                                image=image,
+                                # exit right away, pulling the image is all that's needed
+                                command=[f"{PREPULL_BIN}/true"],
+                                imagePullPolicy="IfNotPresent",
+                                volumeMounts=mounts,
+                            )
+                            for idx, image in enumerate(images)
+                        ],
+                        containers=[
+                            Container(
+                                name="pause",
+                                image=helper,
+                                command=["sleep", "2147483647"],
+                                resources=ResourceRequirements(
+                                    requests={"cpu": "1m", "memory": "8Mi"}
+                                ),
+                            )
+                        ],
+                    ),
+                ),
+            ),
+        )
+        ManifestLabel(self.manifests)(ds)
+        return ds
+
+    def run(
+        self, images: List[str], budget: float, on_progress: Optional[ProgressCallback] = None
+    ) -> DaemonSetProgress:
+        """Apply the pre-pull DaemonSet and wait up to budget seconds for it to be ready."""
+        log.info("Pre-pulling %s", ", ".join(images))
+        self.manifests.apply_resource(HashableResource(self.daemonset(images)))
+        return wait_for_daemonset(self.manifests, PREPULL_NAME, budget, on_progress)
+
+    def cleanup(self):
+        """Remove the pre-pull DaemonSet."""
+        ds = DaemonSet(metadata=ObjectMeta(name=PREPULL_NAME, namespace=NAMESPACE))
+        self.manifests.delete_resource(HashableResource(ds), ignore_not_found=True)
+
+
+class BlueGreenUpgrade:
+    """Keep a CCM contending for the leader lease while its DaemonSet changes release.
+
+    A copy of the rendered DaemonSet runs the new release as a separate green
+    workload, with its own selector and serving port, next to the installed
+    one. Once its pods are ready they stand by on the shared leader lease, so
+    when the installed pods restart into the new release the lease passes to a
+    running controller instead of waiting for the new pods to start. The green
+    workload is removed after the installed DaemonSet rolled out.
+    """
+
+    def __init__(self, manifests: ProviderManifests):
+        self.manifests = manifests
+
+    def daemonset(self) -> DaemonSet:
+        """Craft the green DaemonSet from the rendered CCM DaemonSet."""
+        ds = copy.deepcopy(rendered_daemonset(self.manifests))
+        labels = {"k8s-app": GREEN_NAME}
+        ds.metadata = ObjectMeta(
+            name=GREEN_NAME,
+            namespace=NAMESPACE,
+            labels={**(ds.metadata.labels or {}), **labels},
+        )
+        ds.spec.selector = LabelSelector(matchLabels=labels)
+        ds.spec.template.metadata.labels = {**(ds.spec.template.metadata.labels or {}), **labels}
+        for container in ds.spec.template.spec.containers:
+            if container.name != RESOURCE_NAME:
+                continue
+            args = [a for a in container.args or [] if not a.startswith("--secure-port=")]
+            container.args = args + [f"--secure-port={GREEN_SECURE_PORT}"]
+            for probe in (container.readinessProbe, container.livenessProbe):
+                if probe and probe.httpGet:
+                    probe.httpGet = healthz_endpoint(container.args)
+        return ds
+
+    def run(
+        self, budget: float, on_progress: Optional[ProgressCallback] = None
+    ) -> DaemonSetProgress:
+        """Apply the green DaemonSet and wait up to budget seconds for it to be ready."""
+        log.info("Starting %s next to %s", GREEN_NAME, RESOURCE_NAME)
+        self.manifests.apply_resource(HashableResource(self.daemonset()))
+        return wait_for_daemonset(self.manifests, GREEN_NAME, budget, on_progress)
+
+    def leader(self) -> Optional[str]:
+        """Identity of the current holder of the CCM leader lease, if held.
+
+        Raises:
+            ManifestClientError: if the lease couldn't be read from the cluster.
+        """
+        try:
+            lease = self.manifests.client.get(Lease, LEASE_NAME, namespace=NAMESPACE)
+        except ApiError as ex:
+            if ex.status.code == 404:
+                return None
+            raise ManifestClientError(f"Failed reading Lease/{LEASE_NAME}", ex) from ex
+        except HTTPError as ex:
+            raise ManifestClientError(f"Failed reading Lease/{LEASE_NAME}", ex) from ex
+        return lease.spec and lease.spec.holderIdentity
+
+    def cleanup(self):
+        """Remove the green DaemonSet."""
+        ds = DaemonSet(metadata=ObjectMeta(name=GREEN_NAME, namespace=NAMESPACE))
+        self.manifests.delete_resource(HashableResource(ds), ignore_not_found=True)
@@ -7,7 +7,7 @@ import pytest
 
 @pytest.fixture(autouse=True)
 def lk_client():
-    with mock.patch("ops.manifests.manifest.Client", autospec=True) as mock_lightkube:
+    with mock.patch("provider_manifests.Client", autospec=True) as mock_lightkube:
         yield mock_lightkube.return_value
 
 
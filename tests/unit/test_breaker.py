@@ -0,0 +1,165 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Learn more about testing at: https://juju.is/docs/sdk/testing
+
+import time
+import unittest.mock as mock
+
+import httpx
+import pytest
+from lightkube import Client, KubeConfig
+from lightkube.resources.core_v1 import Namespace, Node
+
+import breaker
+from breaker import FAILURE_THRESHOLD, ApiUnavailable, CircuitBreaker
+
+KUBECONFIG = {
+    "clusters": [{"name": "k8s", "cluster": {"server": "http://apiserver"}}],
+    "users": [{"name": "admin", "user": {}}],
+    "contexts": [{"name": "k8s", "context": {"cluster": "k8s", "user": "admin"}}],
+    "current-context": "k8s",
+}
+
+
+class Apiserver:
+    """Mock apiserver, optionally refusing connections."""
+
+    def __init__(self):
+        self.down = False
+        self.slow = False
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if self.down:
+            raise httpx.ConnectError("Connection refused", request=request)
+        if self.slow:
+            raise httpx.ReadTimeout("Timed out", request=request)
+        if request.url.path.endswith("/nodes"):
+            return httpx.Response(200, json={"apiVersion": "v1", "kind": "NodeList", "items": []})
+        return httpx.Response(200, json={"apiVersion": "v1", "kind": "Namespace"})
+
+
+@pytest.fixture
+def apiserver():
+    return Apiserver()
+
+
+def _client(apiserver, circuit):
+    """Client whose requests go through the circuit to the mock apiserver."""
+    config = KubeConfig.from_dict(KUBECONFIG)
+    return Client(config=config, transport=circuit.wrap(httpx.MockTransport(apiserver)))
+
+
+def test_circuit_opens_after_repeated_failures(apiserver):
+    circuit = CircuitBreaker()
+    client = _client(apiserver, circuit)
+    apiserver.down = True
+    for _ in range(FAILURE_THRESHOLD):
+        with pytest.raises(httpx.ConnectError):
+            list(client.list(Node))
+    assert circuit.is_open
+
+    with pytest.raises(ApiUnavailable):
+        list(client.list(Node))
+    assert len(apiserver.requests) == FAILURE_THRESHOLD
+    assert circuit.backoff == breaker.MIN_BACKOFF
+    assert circuit.retry_at > time.time()
+
+
+def test_circuit_state_survives_dispatches(apiserver):
+    state = {"failures": FAILURE_THRESHOLD, "backoff": 10.0, "retry_at": 1e12}
+    circuit = CircuitBreaker(state)
+    assert not circuit.probe(_client(apiserver, circuit))
+    assert apiserver.requests == []
+    assert circuit.state() == state
+
+
+@mock.patch("breaker.time.time", return_value=1000.0)
+def test_probe_closes_the_circuit(_time, apiserver):
+    circuit = CircuitBreaker({"failures": FAILURE_THRESHOLD, "backoff": 10.0, "retry_at": 990.0})
+    assert circuit.probe(_client(apiserver, circuit))
+    (request,) = apiserver.requests
+    assert request.url.path == "/api/v1/namespaces/kube-system"
+    assert circuit.state() == {"failures": 0, "backoff": 0.0, "retry_at": 0.0}
+
+
+@mock.patch("breaker.random.uniform", return_value=1.0)
+@mock.patch("breaker.time.time", return_value=1000.0)
+def test_failed_probe_doubles_the_backoff(_time, _uniform, apiserver):
+    apiserver.down = True
+    circuit = CircuitBreaker({"failures": FAILURE_THRESHOLD, "backoff": 10.0, "retry_at": 990.0})
+    assert not circuit.probe(_client(apiserver, circuit))
+    assert circuit.backoff == 20.0
+    assert circuit.retry_at == 1020.0
+    assert len(apiserver.requests) == 1
+
+
+def test_deadline_caps_request_timeouts(apiserver):
+    circuit = CircuitBreaker(deadline=2.0)
+    client = _client(apiserver, circuit)
+    list(client.list(Node))
+    (request,) = apiserver.requests
+    assert all(0 < value <= 2.0 for value in request.extensions["timeout"].values())
+
+    circuit.deadline = 0.0
+    with pytest.raises(ApiUnavailable, match="Deadline"):
+        client.get(Namespace, "kube-system")
+    assert len(apiserver.requests) == 1
+
+
+def test_wrapped_transport_goes_through_the_circuit(apiserver):
+    circuit = CircuitBreaker({"failures": FAILURE_THRESHOLD, "backoff": 10.0, "retry_at": 1e12})
+    with pytest.raises(ApiUnavailable, match="retry in"):
+        _client(apiserver, circuit).get(Namespace, "kube-system")
+    assert apiserver.requests == []
+
+
+@mock.patch("breaker.time.monotonic")
+def test_deadline_starts_with_the_first_request(monotonic, apiserver):
+    monotonic.return_value = 100.0
+    circuit = CircuitBreaker(deadline=2.0)
+    monotonic.return_value = 500.0
+    assert circuit.remaining() == 2.0
+
+    list(_client(apiserver, circuit).list(Node))
+    assert circuit.deadline == 502.0
+    monotonic.return_value = 501.5
+    assert circuit.remaining() == 0.5
+
+
+@mock.patch("breaker.time.monotonic")
+def test_deadline_leaves_out_paused_waits(monotonic, apiserver):
+    monotonic.return_value = 100.0
+    circuit = CircuitBreaker(deadline=10.0)
+    client = _client(apiserver, circuit)
+    list(client.list(Node))
+
+    monotonic.return_value = 104.0
+    with circuit.paused():
+        monotonic.return_value = 200.0
+        list(client.list(Node))
+        assert circuit.remaining() == 6.0
+    assert circuit.deadline == 206.0
+    monotonic.return_value = 201.0
+    assert circuit.remaining() == 5.0
+
+
+def test_capped_timeouts_are_not_connection_failures(apiserver):
+    apiserver.slow = True
+    circuit = CircuitBreaker(deadline=2.0)
+    client = _client(apiserver, circuit)
+    for _ in range(FAILURE_THRESHOLD):
+        with pytest.raises(httpx.ReadTimeout):
+            client.get(Namespace, "kube-system")
+    assert circuit.failures == 0
+
+    # a request timing out within its own timeout is a connection failure
+    circuit = CircuitBreaker(deadline=1000.0)
+    config = KubeConfig.from_dict(KUBECONFIG)
+    transport = circuit.wrap(httpx.MockTransport(apiserver))
+    client = Client(config=config, timeout=httpx.Timeout(10), transport=transport)
+    with pytest.raises(httpx.ReadTimeout):
+        client.get(Namespace, "kube-system")
+    assert circuit.failures == 1
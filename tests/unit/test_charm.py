@@ -3,16 +3,24 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import time
 import unittest.mock as mock
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 import httpx
+import ops
 import pytest
 import yaml
+from ops.manifests import ManifestClientError
 from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
 from ops.testing import Harness
 
 from charm import ProviderCharm
+from metrics import MemoryProfile
+from rollout import DaemonSetProgress
+
+INITIALIZED_AT = datetime(2025, 1, 1, tzinfo=timezone.utc)
 
 
 @pytest.fixture
@@ -78,6 +86,7 @@ def kube_control():
 def test_waits_for_integrator(harness):
     harness.begin_with_initial_hooks()
     charm = harness.charm
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, BlockedStatus)
     assert charm.unit.status.message == "Missing required openstack"
 
@@ -87,9 +96,11 @@ def test_waits_for_integrator(harness):
     rel_cls._data = property(rel_cls._data.func)
     rel_cls._raw_data = property(rel_cls._raw_data.func)
     rel_id = harness.add_relation("openstack", "openstack-integrator")
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, WaitingStatus)
     assert charm.unit.status.message == "Waiting for openstack"
     harness.add_relation_unit(rel_id, "openstack-integrator/0")
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, WaitingStatus)
     assert charm.unit.status.message == "Waiting for openstack"
     harness.update_relation_data(
@@ -97,6 +108,7 @@ def test_waits_for_integrator(harness):
         "openstack-integrator/0",
         yaml.safe_load(Path("tests/data/openstack_data.yaml").read_text()),
     )
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, BlockedStatus)
     assert charm.unit.status.message == "Missing required certificates"
 
@@ -105,6 +117,7 @@ def test_waits_for_integrator(harness):
 def test_waits_for_certificates(harness):
     harness.begin_with_initial_hooks()
     charm = harness.charm
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, BlockedStatus)
     assert charm.unit.status.message == "Missing required certificates"
 
@@ -114,9 +127,11 @@ def test_waits_for_certificates(harness):
     rel_cls._data = property(rel_cls._data.func)
     rel_cls._raw_data = property(rel_cls._raw_data.func)
     rel_id = harness.add_relation("certificates", "easyrsa")
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, WaitingStatus)
     assert charm.unit.status.message == "Waiting for certificates"
     harness.add_relation_unit(rel_id, "easyrsa/0")
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, WaitingStatus)
     assert charm.unit.status.message == "Waiting for certificates"
     harness.update_relation_data(
@@ -124,15 +139,19 @@ def test_waits_for_certificates(harness):
         "easyrsa/0",
         yaml.safe_load(Path("tests/data/certificates_data.yaml").read_text()),
     )
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, BlockedStatus)
     assert charm.unit.status.message == "Missing required kube-control relation"
 
 
+@mock.patch("charm.wait_for_daemonset")
 @mock.patch("ops.interface_kube_control.KubeControlRequirer.create_kubeconfig")
 @pytest.mark.usefixtures("integrator", "certificates")
-def test_waits_for_kube_control(mock_create_kubeconfig, harness, caplog):
+def test_waits_for_kube_control(mock_create_kubeconfig, mock_wait, harness, caplog):
+    mock_wait.return_value = DaemonSetProgress(1, 1, 1, 1, 1)
     harness.begin_with_initial_hooks()
     charm = harness.charm
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, BlockedStatus)
     assert charm.unit.status.message == "Missing required kube-control relation"
 
@@ -141,10 +160,12 @@ def test_waits_for_kube_control(mock_create_kubeconfig, harness, caplog):
     rel_cls.relation = property(rel_cls.relation.func)
     rel_cls._data = property(rel_cls._data.func)
     rel_id = harness.add_relation("kube-control", "kubernetes-control-plane")
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, WaitingStatus)
     assert charm.unit.status.message == "Waiting for kube-control relation"
 
     harness.add_relation_unit(rel_id, "kubernetes-control-plane/0")
+    harness.evaluate_status()
     assert isinstance(charm.unit.status, WaitingStatus)
     assert charm.unit.status.message == "Waiting for kube-control relation"
     mock_create_kubeconfig.assert_not_called()
@@ -158,11 +179,14 @@ def test_waits_for_kube_control(mock_create_kubeconfig, harness, caplog):
     mock_create_kubeconfig.assert_called_once_with(
         charm._ca_cert_path, charm._kubeconfig_path, "root", charm.unit.name
     )
-    assert charm.unit.status == MaintenanceStatus("Deploying Cloud Controller Manager")
+    mock_wait.assert_called_once()
+    harness.evaluate_status()
+    assert charm.unit.status == ActiveStatus("Ready")
     storage_messages = {r.message for r in caplog.records if "provider" in r.filename}
 
     assert storage_messages == {
         "Encode secret data for cloud-controller.",
+        "Adding HTTPS health probes for DaemonSet/openstack-cloud-controller-manager",
         "Patching node-selector for DaemonSet/openstack-cloud-controller-manager "
         "node-role.kubernetes.io/control-plane='' not 'true'",
         "Patching cluster-name for DaemonSet/openstack-cloud-controller-manager by env",
@@ -199,18 +223,21 @@ def deployed_charm(harness):
         httpx.TimeoutException("timed out"),
     ],
 )
-def test_update_status_waits_when_api_unreachable(deployed_charm, lk_client_charm, error, caplog):
+def test_update_status_waits_when_api_unreachable(
+    deployed_charm, harness, lk_client_charm, error, caplog
+):
     """Transient K8s API unavailability must not crash the update-status hook (issue #955)."""
     lk_client_charm.list.side_effect = error
 
     deployed_charm._update_status(None)
 
+    harness.evaluate_status()
     assert isinstance(deployed_charm.unit.status, WaitingStatus)
     assert deployed_charm.unit.status.message == "Waiting for kube-apiserver"
     assert any("Kubernetes API unreachable" in r.message for r in caplog.records)
 
 
-def test_update_status_reports_nodes_missing_provider_id(deployed_charm, lk_client_charm):
+def test_update_status_reports_nodes_missing_provider_id(deployed_charm, harness, lk_client_charm):
     lk_client_charm.list.return_value = [
         _node("node-1", ""),
         _node("node-2", "openstack:///abc"),
@@ -218,16 +245,525 @@ def test_update_status_reports_nodes_missing_provider_id(deployed_charm, lk_clie
 
     deployed_charm._update_status(None)
 
+    harness.evaluate_status()
     assert isinstance(deployed_charm.unit.status, WaitingStatus)
     assert deployed_charm.unit.status.message == "Cloud provider not initialized on nodes: node-1"
 
 
-def test_update_status_active_when_provider_ids_present(deployed_charm, lk_client_charm):
+def test_update_status_active_when_provider_ids_present(deployed_charm, harness, lk_client_charm):
     lk_client_charm.list.return_value = [_node("node-1", "openstack:///abc")]
     deployed_charm.collector.short_version = "1.0"
     deployed_charm.collector.long_version = "cloud-controller 1.0"
 
     deployed_charm._update_status(None)
 
+    harness.evaluate_status()
     assert isinstance(deployed_charm.unit.status, ActiveStatus)
     assert deployed_charm.unit.status.message == "Ready"
+
+
+def test_invalid_config_blocks_before_relations(harness):
+    harness.update_config({"manager-release": "v0.0.0"})
+    harness.begin_with_initial_hooks()
+    charm = harness.charm
+    harness.evaluate_status()
+    assert isinstance(charm.unit.status, BlockedStatus)
+    assert charm.unit.status.message == (
+        "Invalid manager-release: 'v0.0.0' is not a supported release"
+    )
+
+
+@mock.patch("charm.wait_for_daemonset")
+def test_track_rollout_incomplete(mock_wait, deployed_charm, harness):
+    mock_wait.return_value = DaemonSetProgress(2, 2, 3, 1, 0)
+
+    assert deployed_charm._track_rollout() is False
+    harness.evaluate_status()
+    assert isinstance(deployed_charm.unit.status, WaitingStatus)
+    assert deployed_charm.unit.status.message == (
+        "Rollout incomplete after 60s: 1/3 updated, 0/3 ready"
+    )
+
+
+@mock.patch("charm.wait_for_daemonset")
+def test_track_rollout_records_time_to_ready(mock_wait, deployed_charm):
+    mock_wait.return_value = DaemonSetProgress(2, 2, 3, 3, 3)
+
+    assert deployed_charm._track_rollout() is True
+    assert "rollout-time-to-ready" in deployed_charm.profile.values
+    assert "rollout" in deployed_charm.profile.timings
+
+
+@mock.patch("charm.wait_for_daemonset")
+def test_track_rollout_leaves_its_wait_out_of_the_deadline(mock_wait, deployed_charm):
+    def _wait(*_):
+        assert deployed_charm.breaker._paused_since is not None
+        return DaemonSetProgress(2, 2, 3, 3, 3)
+
+    mock_wait.side_effect = _wait
+    assert deployed_charm._track_rollout() is True
+    assert deployed_charm.breaker._paused_since is None
+
+
+@mock.patch("charm.BlueGreenUpgrade")
+@mock.patch("charm.wait_for_daemonset")
+def test_update_status_keeps_green_until_rollout_complete(
+    mock_wait, upgrade, deployed_charm, lk_client_charm
+):
+    deployed_charm.collector.short_version = "1.0"
+    deployed_charm.collector.long_version = "1.0"
+    deployed_charm.stored.green = True
+    mock_wait.return_value = DaemonSetProgress(2, 2, 3, 1, 3)
+    deployed_charm._update_status(None)
+    upgrade.return_value.cleanup.assert_not_called()
+    assert deployed_charm.stored.green
+
+    mock_wait.return_value = DaemonSetProgress(2, 2, 3, 3, 3)
+    deployed_charm._update_status(None)
+    upgrade.return_value.cleanup.assert_called_once()
+    assert not deployed_charm.stored.green
+
+
+def test_track_rollout_disabled(deployed_charm, harness):
+    harness.update_config({"rollout-timeout": 0})
+    assert deployed_charm._track_rollout() is False
+
+
+def test_update_status_reports_slow_node_initialization(deployed_charm, harness, lk_client_charm):
+    node = _node("node-1", "openstack:///abc")
+    node.metadata.uid = "uid-1"
+    lk_client_charm.list.return_value = [node]
+    deployed_charm.collector.short_version = "1.0"
+    deployed_charm.collector.long_version = "cloud-controller 1.0"
+
+    with (
+        mock.patch("charm.node_init_latency", return_value=250.0),
+        mock.patch("charm.node_init_time", return_value=INITIALIZED_AT),
+    ):
+        deployed_charm._update_status(None)
+        deployed_charm._update_status(None)
+
+    assert deployed_charm.stored.node_init_watermark == INITIALIZED_AT.timestamp()
+    assert deployed_charm.stored.node_init_seen == ["uid-1"]
+    harness.evaluate_status()
+    assert isinstance(deployed_charm.unit.status, ActiveStatus)
+    assert deployed_charm.unit.status.message == "Ready, slow node initialization (p95 250s)"
+
+
+def test_record_node_init_once_per_node(deployed_charm):
+    nodes = [_node(f"node-{i}", "openstack:///abc") for i in range(4)]
+    for i, node in enumerate(nodes):
+        node.metadata.uid = f"uid-{i}"
+    # node-2 and node-3 initialized at the same second, node-3 listed later
+    initialized = dict(zip(nodes, [40, 10, 50, 50]))
+
+    def _init_time(node):
+        return INITIALIZED_AT + timedelta(seconds=initialized[node])
+
+    with (
+        mock.patch("charm.node_init_latency", return_value=1.0),
+        mock.patch("charm.node_init_time", side_effect=_init_time),
+    ):
+        assert deployed_charm._record_node_init(nodes[:3]).count == 3
+        assert deployed_charm._record_node_init(nodes).count == 4
+        assert deployed_charm._record_node_init(nodes).count == 4
+
+    assert deployed_charm.stored.node_init_seen == ["uid-2", "uid-3"]
+
+
+def test_node_init_latency_action(deployed_charm, lk_client_charm):
+    event = mock.MagicMock()
+    node = _node("node-1", "openstack:///abc")
+    node.metadata.uid = "uid-1"
+    lk_client_charm.list.return_value = [node]
+    with (
+        mock.patch("charm.node_init_latency", return_value=7.0),
+        mock.patch("charm.node_init_time", return_value=INITIALIZED_AT),
+    ):
+        deployed_charm._node_init_latency(event)
+
+    results = event.set_results.call_args.args[0]
+    assert results["count"] == 1
+    assert results["p95"] == "7.0"
+    assert results["buckets"]["le-10"] == 1
+
+
+def test_merge_config_skips_unchanged_inputs(deployed_charm):
+    deployed_charm.stored.inputs_digest = deployed_charm._inputs_digest()
+    with mock.patch.object(deployed_charm, "_check_config") as check_config:
+        deployed_charm._merge_config(mock.MagicMock())
+    check_config.assert_not_called()
+    assert deployed_charm.stored.reconciles_skipped == 1
+    assert deployed_charm.stored.reconciles_executed == 0
+
+
+def test_merge_config_runs_on_changed_inputs(deployed_charm, harness):
+    deployed_charm.stored.inputs_digest = deployed_charm._inputs_digest()
+    harness.update_config({"web-proxy-enable": True})
+    with mock.patch.object(deployed_charm, "_check_config", return_value=False) as check_config:
+        deployed_charm._merge_config(mock.MagicMock())
+    check_config.assert_called_once()
+    assert deployed_charm.stored.reconciles_skipped == 0
+    assert deployed_charm.stored.reconciles_executed == 2
+
+
+def test_upgrade_charm_reconciles_again(deployed_charm):
+    deployed_charm.stored.inputs_digest = deployed_charm._inputs_digest()
+    deployed_charm.stored.config_hash = 1234
+    with mock.patch.object(deployed_charm, "_check_config", return_value=False) as check_config:
+        deployed_charm.on.upgrade_charm.emit()
+    check_config.assert_called_once()
+    assert deployed_charm.stored.inputs_digest is None
+    assert deployed_charm.stored.config_hash is None
+
+
+def test_install_or_upgrade_waits_for_config_hash(deployed_charm, harness):
+    harness.update_config({"background-reconcile": True})
+    deployed_charm.stored.config_hash = 1234
+    deployed_charm.reconciler = mock.MagicMock()
+    deployed_charm.reconciler.desired_hash.return_value = 1234
+    with mock.patch.object(deployed_charm, "_submit_background") as submit:
+        assert deployed_charm._install_or_upgrade(mock.MagicMock())
+    submit.assert_not_called()
+
+
+def test_inputs_digest_ignores_unused_relation_fields(deployed_charm, harness):
+    rel_id = harness.add_relation("kube-control", "kubernetes-control-plane")
+    harness.add_relation_unit(rel_id, "kubernetes-control-plane/0")
+    before = deployed_charm._inputs_digest()
+    harness.update_relation_data(rel_id, "kubernetes-control-plane/0", {"domain": "other"})
+    assert deployed_charm._inputs_digest() == before
+    harness.update_relation_data(rel_id, "kubernetes-control-plane/0", {"cluster-tag": "abc"})
+    assert deployed_charm._inputs_digest() != before
+
+
+@pytest.mark.parametrize(
+    "status, expected",
+    [
+        ({}, MaintenanceStatus("Background reconcile pending")),
+        (
+            {"hash": 1, "state": "applying", "applied": 2, "total": 5},
+            MaintenanceStatus("Reconciling in background: 2/5 applied"),
+        ),
+        (
+            {"hash": 1, "state": "failed", "error": "connection refused"},
+            WaitingStatus("Background reconcile failed: connection refused"),
+        ),
+        (
+            {"hash": 1, "state": "applied", "rollout": "1/3 updated, 0/3 ready"},
+            WaitingStatus("Rolling out Cloud Controller Manager: 1/3 updated, 0/3 ready"),
+        ),
+        (
+            {"hash": 1, "state": "applied", "rollout_complete": True, "uninitialized": ["n1"]},
+            WaitingStatus("Cloud provider not initialized on nodes: n1"),
+        ),
+        (
+            {"hash": 1, "state": "applied", "rollout_complete": True, "uninitialized": []},
+            ActiveStatus("Ready"),
+        ),
+    ],
+)
+def test_update_status_background(deployed_charm, harness, lk_client_charm, status, expected):
+    harness.update_config({"background-reconcile": True})
+    deployed_charm.stored.config_hash = 1
+    deployed_charm.collector.short_version = "1.0"
+    deployed_charm.collector.long_version = "cloud-controller 1.0"
+    deployed_charm.reconciler = mock.MagicMock()
+    deployed_charm.reconciler.status.return_value = status
+
+    deployed_charm._update_status(None)
+
+    deployed_charm.reconciler.ensure_worker.assert_called_once()
+    lk_client_charm.list.assert_not_called()
+    harness.evaluate_status()
+    assert deployed_charm.unit.status == expected
+
+
+def test_status_written_once_per_dispatch(harness):
+    harness.begin()
+    charm = harness.charm
+    with mock.patch.object(
+        harness._backend, "status_set", wraps=harness._backend.status_set
+    ) as status_set:
+        charm.on.config_changed.emit()
+        status_set.assert_not_called()
+        harness.evaluate_status()
+    status_set.assert_called_once()
+    assert isinstance(charm.unit.status, BlockedStatus)
+
+
+def test_status_written_ahead_of_long_steps(deployed_charm, harness):
+    deployed_charm._set_status(MaintenanceStatus("Evaluating Manifests"))
+    deployed_charm._set_status(MaintenanceStatus("Deploying Cloud Controller Manager"), now=True)
+    assert deployed_charm.unit.status == MaintenanceStatus("Deploying Cloud Controller Manager")
+
+    harness.evaluate_status()
+    assert deployed_charm.unit.status == MaintenanceStatus("Deploying Cloud Controller Manager")
+
+
+def test_api_latency_recorded_by_hook(deployed_charm):
+    deployed_charm.profile.hook = "update-status"
+    deployed_charm.api_latency.observe("GET", "nodes", 200, 0.05)
+    deployed_charm.framework.on.pre_commit.emit()
+    # the next dispatch starts with no requests
+    deployed_charm.api_latency.series.clear()
+    deployed_charm.api_latency.observe("GET", "nodes", 200, 0.2)
+    deployed_charm.framework.on.pre_commit.emit()
+
+    event = mock.MagicMock()
+    event.params = {"hook": "update-status"}
+    deployed_charm._api_latency(event)
+    results = event.set_results.call_args.args[0]
+    assert results["hooks"]["update-status"]["get-nodes-200"] == (
+        "count=2 mean=0.125s p50=0.050s p95=0.200s max=0.200s"
+    )
+
+    event.params = {"hook": "config-changed"}
+    deployed_charm._api_latency(event)
+    assert event.set_results.call_args.args[0] == {"hooks": "none recorded"}
+
+
+def test_stop_with_memory_profile(harness, monkeypatch):
+    monkeypatch.setenv("CHARM_MEMORY_PROFILE", "3")
+    harness.begin()
+    assert harness.charm.memory
+
+    harness.charm.on.stop.emit()
+    harness.framework.commit()
+
+    assert not harness.charm._memory_profile_path.parent.exists()
+
+
+def test_memory_profile_action(deployed_charm, tmp_path):
+    path = tmp_path / "memory-profile.json"
+    for hook in ("config-changed", "update-status"):
+        memory = MemoryProfile(path, keep=5)
+        memory.start()
+        with memory.stage("merge-config"):
+            pass
+        memory.record(hook)
+
+    event = mock.MagicMock()
+    event.params = {"hook": "update-status"}
+    with mock.patch.object(ProviderCharm, "_memory_profile_path", path):
+        deployed_charm._memory_profile(event)
+    (result,) = event.set_results.call_args.args[0]["dispatches"].values()
+    assert result["peak-rss"].endswith("MiB")
+    assert result["stages"].startswith("merge-config=")
+
+    event.params = {"hook": "install"}
+    with mock.patch.object(ProviderCharm, "_memory_profile_path", path):
+        deployed_charm._memory_profile(event)
+    assert event.set_results.call_args.args[0] == {"dispatches": "none recorded"}
+
+
+def test_update_status_fails_fast_while_apiserver_unreachable(
+    deployed_charm, harness, lk_client_charm
+):
+    deployed_charm.breaker.failures = 3
+    deployed_charm.breaker.retry_at = time.time() + 60
+
+    deployed_charm._update_status(None)
+
+    lk_client_charm.get.assert_not_called()
+    lk_client_charm.list.assert_not_called()
+    harness.evaluate_status()
+    assert deployed_charm.unit.status == WaitingStatus("Waiting for kube-apiserver")
+    deployed_charm.framework.on.pre_commit.emit()
+    assert deployed_charm.stored.api_breaker["failures"] == 3
+
+
+def test_install_defers_while_apiserver_unreachable(deployed_charm):
+    deployed_charm.breaker.failures = 3
+    deployed_charm.breaker.retry_at = time.time() + 60
+    event = mock.MagicMock()
+
+    assert deployed_charm._install_or_upgrade(event, config_hash=1) is False
+
+    event.defer.assert_called_once()
+    deployed_charm.collector.manifests.values.assert_not_called()
+
+
+@mock.patch("charm.BlueGreenUpgrade")
+def test_stage_upgrade_starts_green_daemonset(upgrade, deployed_charm, harness):
+    harness.update_config({"upgrade-strategy": "blue-green"})
+    deployed_charm.stored.release = "v1.33.0"
+    controller = deployed_charm.collector.manifests.__getitem__.return_value
+    controller.current_release = "v1.34.1"
+    daemonset = mock.MagicMock(kind="DaemonSet")
+    daemonset.name = "openstack-cloud-controller-manager"
+    secret = mock.MagicMock(kind="Secret")
+    controller.resources = [secret, daemonset]
+    calls = []
+    controller.apply_resources.side_effect = lambda *objs: calls.append(objs)
+
+    def _run(*_):
+        calls.append("green")
+        return DaemonSetProgress(1, 1, 3, 3, 3)
+
+    upgrade.return_value.run.side_effect = _run
+    event = mock.MagicMock()
+
+    assert deployed_charm._stage_upgrade(event)
+
+    assert calls == [(secret,), "green"]
+    upgrade.assert_called_once_with(controller)
+    upgrade.return_value.run.assert_called_once()
+    upgrade.return_value.leader.assert_called_once()
+    event.defer.assert_not_called()
+    assert deployed_charm.stored.green
+
+    deployed_charm._finish_upgrade()
+    upgrade.return_value.cleanup.assert_called_once()
+    assert not deployed_charm.stored.green
+
+
+def test_flow_control_discovered_once_per_cluster(deployed_charm):
+    controller = deployed_charm.collector.manifests.__getitem__.return_value
+    controller.flow_control = True
+    controller.discover_flow_control_api.return_value = "v1beta3"
+    deployed_charm._discover_flow_control(mock.MagicMock(spec=ops.ConfigChangedEvent))
+    assert deployed_charm.stored.flow_control_api == "v1beta3"
+
+    controller.discover_flow_control_api.return_value = "v1"
+    deployed_charm._discover_flow_control(mock.MagicMock(spec=ops.ConfigChangedEvent))
+    assert deployed_charm.stored.flow_control_api == "v1beta3"
+
+    changed = mock.MagicMock(spec=ops.RelationChangedEvent)
+    changed.relation = mock.MagicMock()
+    changed.relation.name = "kube-control"
+    deployed_charm._discover_flow_control(changed)
+    assert deployed_charm.stored.flow_control_api == "v1"
+
+    # an unreachable apiserver keeps the version discovered before
+    controller.discover_flow_control_api.return_value = None
+    deployed_charm._discover_flow_control(mock.MagicMock(spec=ops.UpgradeCharmEvent))
+    assert deployed_charm.stored.flow_control_api == "v1"
+    assert controller.discover_flow_control_api.call_count == 3
+
+
+def test_collect_secrets_after_secret_changed(deployed_charm):
+    controller = deployed_charm.collector.manifests.__getitem__.return_value
+    controller.current_release = "v1.34.1"
+    controller.flow_control = False
+    controller.secret_name = "cloud-controller-config-0123456789"
+    controller.prune_secrets.return_value = ["cloud-controller-config"]
+    assert deployed_charm._prune(mock.MagicMock(), controller)
+    assert deployed_charm.stored.stale_secrets
+
+    deployed_charm._rollout_complete()
+    controller.prune_secrets.assert_called_once_with()
+    assert not deployed_charm.stored.stale_secrets
+    deployed_charm._rollout_complete()
+    controller.prune_secrets.assert_called_once_with()
+
+
+@mock.patch("charm.wait_for_daemonset")
+def test_update_status_collects_secrets_after_rollout_complete(mock_wait, deployed_charm):
+    controller = deployed_charm.collector.manifests.__getitem__.return_value
+    controller.prune_secrets.return_value = ["cloud-controller-config"]
+    deployed_charm.collector.short_version = "1.0"
+    deployed_charm.collector.long_version = "1.0"
+    deployed_charm.stored.stale_secrets = True
+    mock_wait.return_value = DaemonSetProgress(2, 2, 3, 1, 3)
+    deployed_charm._update_status(None)
+    controller.prune_secrets.assert_not_called()
+    assert deployed_charm.stored.stale_secrets
+
+    mock_wait.return_value = DaemonSetProgress(2, 2, 3, 3, 3)
+    deployed_charm._update_status(None)
+    controller.prune_secrets.assert_called_once_with()
+    assert not deployed_charm.stored.stale_secrets
+
+
+def test_collect_secrets_retried_when_apiserver_unreachable(deployed_charm):
+    controller = deployed_charm.collector.manifests.__getitem__.return_value
+    controller.prune_secrets.side_effect = ManifestClientError("Failed to list")
+    deployed_charm.stored.stale_secrets = True
+
+    deployed_charm._collect_secrets()
+    assert deployed_charm.stored.stale_secrets
+
+
+@mock.patch("charm.BlueGreenUpgrade")
+def test_stage_upgrade_defers_until_green_ready(upgrade, deployed_charm, harness):
+    harness.update_config({"upgrade-strategy": "blue-green"})
+    deployed_charm.stored.release = "v1.33.0"
+    controller = deployed_charm.collector.manifests.__getitem__.return_value
+    controller.current_release = "v1.34.1"
+    upgrade.return_value.run.return_value = DaemonSetProgress(1, 1, 3, 3, 1)
+    event = mock.MagicMock()
+
+    assert not deployed_charm._stage_upgrade(event)
+
+    event.defer.assert_called_once()
+    harness.evaluate_status()
+    assert deployed_charm.unit.status == WaitingStatus("Waiting for v1.34.1 to start: 1/3 ready")
+
+
+@mock.patch("charm.BlueGreenUpgrade")
+def test_stage_upgrade_skipped_in_place(upgrade, deployed_charm, harness):
+    deployed_charm.stored.release = "v1.33.0"
+    assert deployed_charm._stage_upgrade(mock.MagicMock())
+    harness.update_config({"upgrade-strategy": "blue-green"})
+    deployed_charm.stored.release = None
+    assert deployed_charm._stage_upgrade(mock.MagicMock())
+    upgrade.assert_not_called()
+
+
+def test_prune_on_release_change(deployed_charm):
+    deployed_charm.stored.release = "v1.33.0"
+    controller = mock.MagicMock()
+    controller.current_release = "v1.34.1"
+    controller.flow_control = False
+    controller.secret_name = "cloud-controller-config"
+    controller.prune.return_value = ["ClusterRole/retired-role"]
+
+    assert deployed_charm._prune(mock.MagicMock(), controller)
+
+    controller.prune.assert_called_once_with("v1.33.0", False)
+    assert deployed_charm.stored.release == "v1.34.1"
+    assert deployed_charm.stored.pruned == {
+        "from": "v1.33.0",
+        "to": "v1.34.1",
+        "resources": ["ClusterRole/retired-role"],
+    }
+    assert deployed_charm.profile.values["pruned"] == 1
+
+    assert deployed_charm._prune(mock.MagicMock(), controller)
+    controller.prune.assert_called_once()
+
+
+def test_prune_when_flow_control_dropped(deployed_charm):
+    deployed_charm.stored.release = "v1.34.1"
+    deployed_charm.stored.flow_control = True
+    controller = mock.MagicMock()
+    controller.current_release = "v1.34.1"
+    controller.flow_control = False
+    controller.secret_name = "cloud-controller-config"
+    controller.prune.return_value = ["FlowSchema/openstack-cloud-controller-manager"]
+
+    assert deployed_charm._prune(mock.MagicMock(), controller)
+
+    controller.prune.assert_called_once_with(None, True)
+    assert deployed_charm.stored.flow_control is False
+    assert deployed_charm.stored.pruned["resources"] == [
+        "FlowSchema/openstack-cloud-controller-manager"
+    ]
+
+
+def test_prune_defers_when_apiserver_unreachable(deployed_charm, harness):
+    deployed_charm.stored.release = "v1.33.0"
+    controller = mock.MagicMock()
+    controller.current_release = "v1.34.1"
+    controller.flow_control = False
+    controller.secret_name = "cloud-controller-config"
+    controller.prune.side_effect = ManifestClientError("Failed to delete resource")
+    event = mock.MagicMock()
+
+    assert not deployed_charm._prune(event, controller)
+
+    event.defer.assert_called_once()
+    assert deployed_charm.stored.release == "v1.33.0"
+    harness.evaluate_status()
+    assert deployed_charm.unit.status == WaitingStatus("Waiting for kube-apiserver")
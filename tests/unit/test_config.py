@@ -0,0 +1,143 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Learn more about testing at: https://juju.is/docs/sdk/testing
+
+import unittest.mock as mock
+
+import pytest
+
+from config import CharmConfig, shipped_releases
+
+
+@pytest.fixture
+def charm():
+    charm = mock.MagicMock()
+    charm.config = {"image-registry": "", "web-proxy-enable": False, "manager-release": ""}
+    return charm
+
+
+def test_shipped_releases_index():
+    releases = shipped_releases()
+    assert "v1.25.6" in releases
+    assert "v0.0.0" not in releases
+
+
+def test_valid_config(charm):
+    charm.config["image-registry"] = "rocks.canonical.com:443/cdk"
+    charm.config["manager-release"] = "v1.25.6"
+    config = CharmConfig(charm)
+    assert config.evaluate() is None
+    assert config.model.manager_release == "v1.25.6"
+    assert config.available_data == {
+        "image-registry": "rocks.canonical.com:443/cdk",
+        "web-proxy-enable": False,
+        "manager-release": "v1.25.6",
+        "health-probe-period": 10,
+        "health-probe-failure-threshold": 3,
+        "api-priority-shares": 0,
+        "immutable-secret": False,
+    }
+
+
+def test_unset_values_are_dropped(charm):
+    config = CharmConfig(charm)
+    assert config.evaluate() is None
+    assert config.available_data == {
+        "web-proxy-enable": False,
+        "health-probe-period": 10,
+        "health-probe-failure-threshold": 3,
+        "api-priority-shares": 0,
+        "immutable-secret": False,
+    }
+
+
+@pytest.mark.parametrize(
+    "key, value, message",
+    [
+        (
+            "manager-release",
+            "v0.0.0",
+            "Invalid manager-release: 'v0.0.0' is not a supported release",
+        ),
+        (
+            "image-registry",
+            "bad registry/",
+            "Invalid image-registry: 'bad registry/' is not a valid registry",
+        ),
+    ],
+)
+def test_invalid_config(charm, key, value, message):
+    charm.config[key] = value
+    config = CharmConfig(charm)
+    assert config.evaluate() == message
+    assert config.model is None
+
+
+def test_config_parsed_once(charm):
+    config = CharmConfig(charm)
+    with mock.patch("config.CharmConfigModel", wraps=config.model.__class__) as model_cls:
+        config._snapshot = None
+        config.evaluate()
+        config.available_data
+        config.model
+        assert model_cls.call_count == 1
+
+        charm.config["manager-release"] = "v1.25.6"
+        assert config.model.manager_release == "v1.25.6"
+        assert model_cls.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "release, controllers, error",
+    [
+        ("", "*,-route", None),
+        ("v1.25.6", "cloud-node, cloud-node-lifecycle", None),
+        ("v1.34.1", "cloud-node-controller,-service-lb-controller", None),
+        (
+            "v1.25.6",
+            "service-lb-controller",
+            "'service-lb-controller' is not a controller of v1.25.6",
+        ),
+        ("", "nodeipam", "'nodeipam' is not a controller of v1.34.1"),
+    ],
+)
+def test_controllers_validated_by_release(charm, release, controllers, error):
+    charm.config["manager-release"] = release
+    charm.config["controllers"] = controllers
+    config = CharmConfig(charm)
+    if error:
+        assert config.evaluate() == f"Invalid controllers: {error}"
+    else:
+        assert config.evaluate() is None
+        assert config.available_data["controllers"] == controllers.replace(" ", "")
+
+
+def test_cloud_conf_overlay_must_be_ini(charm):
+    charm.config["cloud-conf-overlay"] = "search-order = configDrive"
+    config = CharmConfig(charm)
+    assert config.evaluate().startswith("Invalid cloud-conf-overlay: File contains no section")
+
+
+def test_background_reconcile_excludes_prepull(charm):
+    charm.config["background-reconcile"] = True
+    charm.config["image-prepull"] = True
+    config = CharmConfig(charm)
+    assert config.evaluate() == (
+        "Invalid config: image-prepull isn't supported with background-reconcile"
+    )
+
+
+def test_background_reconcile_excludes_blue_green(charm):
+    charm.config["background-reconcile"] = True
+    charm.config["upgrade-strategy"] = "blue-green"
+    config = CharmConfig(charm)
+    assert config.evaluate() == (
+        "Invalid config: blue-green upgrades aren't supported with background-reconcile"
+    )
+
+
+def test_unknown_upgrade_strategy(charm):
+    charm.config["upgrade-strategy"] = "canary"
+    config = CharmConfig(charm)
+    assert config.evaluate().startswith("Invalid upgrade-strategy: unexpected value")
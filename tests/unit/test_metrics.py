@@ -0,0 +1,246 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Learn more about testing at: https://juju.is/docs/sdk/testing
+
+import tracemalloc
+import unittest.mock as mock
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from lightkube import Client, KubeConfig
+from lightkube.resources.apps_v1 import DaemonSet
+from lightkube.resources.core_v1 import Node
+
+from metrics import (
+    MAX_API_SERIES,
+    NODE_INIT_BUCKETS,
+    ApiLatency,
+    Histogram,
+    HookProfile,
+    MemoryProfile,
+    _api_kind,
+    node_init_latency,
+)
+
+
+def _node(provider_id="openstack:///abc", taints=(), initialized_at="2025-01-01T00:00:42Z"):
+    managed = [
+        {
+            "manager": "openstack-cloud-controller-manager",
+            "operation": "Update",
+            "time": initialized_at,
+            "fieldsV1": {"f:spec": {"f:providerID": {}}},
+        }
+    ]
+    return Node.from_dict(
+        {
+            "metadata": {
+                "name": "node-1",
+                "uid": "1234",
+                "creationTimestamp": "2025-01-01T00:00:00Z",
+                "managedFields": managed,
+            },
+            "spec": {"providerID": provider_id, "taints": [dict(t) for t in taints]},
+        }
+    )
+
+
+def test_histogram_observe_and_quantile():
+    histogram = Histogram(NODE_INIT_BUCKETS)
+    for value in (1, 2, 3, 20, 400):
+        histogram.observe(value)
+    assert histogram.count == 5
+    assert histogram.quantile(0.5) == 5.0
+    assert histogram.quantile(0.95) == 400.0
+    assert histogram.buckets()["le-5"] == 3
+    assert histogram.buckets()["le-600"] == 1
+
+
+def test_histogram_round_trips_state():
+    histogram = Histogram(NODE_INIT_BUCKETS)
+    histogram.observe(2000)
+    restored = Histogram(NODE_INIT_BUCKETS, histogram.state())
+    assert restored.buckets()["inf"] == 1
+    assert restored.maximum == 2000
+    assert Histogram(NODE_INIT_BUCKETS).quantile(0.95) == 0.0
+
+
+@pytest.mark.parametrize(
+    "node, latency",
+    [
+        (_node(), 42.0),
+        (_node(provider_id=""), None),
+        (
+            _node(
+                taints=[
+                    {
+                        "key": "node.cloudprovider.kubernetes.io/uninitialized",
+                        "effect": "NoSchedule",
+                    }
+                ]
+            ),
+            None,
+        ),
+    ],
+)
+def test_node_init_latency(node, latency):
+    assert node_init_latency(node) == latency
+
+
+def test_hook_profile_summary():
+    profile = HookProfile("config-changed")
+    with profile.stage("apply"):
+        pass
+    profile.record("rollout-time-to-ready", 1.5)
+    summary = profile.summary()
+    assert summary.startswith("hook=config-changed total=")
+    assert "apply=" in summary
+    assert "rollout-time-to-ready=1.50" in summary
+
+
+def test_memory_profile_by_stage(tmp_path):
+    profile = HookProfile("update-status")
+    profile.memory = MemoryProfile(tmp_path / "memory-profile.json", keep=2)
+    profile.memory.start()
+    try:
+        with profile.stage("merge-config"):
+            with profile.stage("apply"):
+                held = bytearray(4 << 20)
+            del held
+            with profile.stage("node-scan"):
+                pass
+    finally:
+        dispatch = profile.memory.record(profile.hook)
+    assert not tracemalloc.is_tracing()
+
+    stages = dispatch["stages"]
+    assert stages["apply"] >= 4 << 20
+    assert stages["merge-config"] >= stages["apply"]
+    assert stages["node-scan"] < 1 << 20
+    assert dispatch["traced-peak"] >= stages["merge-config"]
+    assert dispatch["peak-rss"] > 0
+    assert "apply=" in profile.summary()
+
+
+def test_memory_profile_keeps_last_dispatches(tmp_path):
+    for hook in ("install", "config-changed", "update-status"):
+        memory = MemoryProfile(tmp_path / "memory-profile.json", keep=2)
+        memory.start()
+        memory.record(hook)
+    assert [d["hook"] for d in memory.load()] == ["config-changed", "update-status"]
+
+
+def test_memory_profile_from_env(tmp_path, monkeypatch):
+    path = tmp_path / "memory-profile.json"
+    assert MemoryProfile.from_env(path, 0) is None
+    assert MemoryProfile.from_env(path, 5).keep == 5
+    monkeypatch.setenv("CHARM_MEMORY_PROFILE", "3")
+    assert MemoryProfile.from_env(path, 0).keep == 3
+    monkeypatch.setenv("CHARM_MEMORY_PROFILE", "0")
+    assert MemoryProfile.from_env(path, 5) is None
+
+
+@pytest.mark.parametrize(
+    "path, kind",
+    [
+        ("/api/v1/nodes", "nodes"),
+        ("/api/v1/namespaces/kube-system", "namespaces"),
+        ("/api/v1/namespaces/kube-system/secrets/cloud-config", "secrets"),
+        ("/apis/apps/v1/namespaces/kube-system/daemonsets/occm", "daemonsets"),
+        ("/apis/rbac.authorization.k8s.io/v1/clusterroles", "clusterroles"),
+        ("/apis", "discovery"),
+    ],
+)
+def test_api_kind(path, kind):
+    assert _api_kind(path) == kind
+
+
+def _config():
+    return KubeConfig.from_dict(
+        {
+            "clusters": [{"name": "k8s", "cluster": {"server": "http://apiserver"}}],
+            "users": [{"name": "admin", "user": {}}],
+            "contexts": [{"name": "k8s", "context": {"cluster": "k8s", "user": "admin"}}],
+            "current-context": "k8s",
+        }
+    )
+
+
+def test_api_latency_instruments_client():
+    def handler(request):
+        if request.url.path.endswith("/nodes"):
+            return httpx.Response(200, json={"apiVersion": "v1", "kind": "NodeList", "items": []})
+        return httpx.Response(404, json={"kind": "Status", "code": 404, "message": "missing"})
+
+    latency = ApiLatency()
+    client = Client(config=_config(), transport=latency.wrap(httpx.MockTransport(handler)))
+
+    assert list(client.list(Node)) == []
+    with pytest.raises(Exception):
+        client.get(DaemonSet, "occm", namespace="kube-system")
+
+    assert sorted(latency.series) == ["get-daemonsets-404", "get-nodes-200"]
+    assert latency.series["get-nodes-200"].count == 1
+    assert "get-nodes-200=n1/p95:" in latency.summary()
+
+
+def test_api_latency_records_failed_requests():
+    def handler(request):
+        if request.url.path.endswith("/nodes"):
+            raise httpx.ReadTimeout("timed out", request=request)
+        raise httpx.ConnectError("refused", request=request)
+
+    latency = ApiLatency()
+    client = Client(config=_config(), transport=latency.wrap(httpx.MockTransport(handler)))
+
+    with pytest.raises(httpx.ReadTimeout):
+        list(client.list(Node))
+    with pytest.raises(httpx.ConnectError):
+        client.get(DaemonSet, "occm", namespace="kube-system")
+
+    assert sorted(latency.series) == ["get-daemonsets-error", "get-nodes-timeout"]
+
+
+@mock.patch("metrics.time.monotonic")
+def test_api_latency_times_the_response_body(monotonic):
+    class SlowBody(httpx.SyncByteStream):
+        def __iter__(self):
+            monotonic.return_value = 3.0
+            yield b'{"apiVersion": "v1", "kind": "NodeList", "items": []}'
+
+    monotonic.return_value = 1.0
+    latency = ApiLatency()
+    transport = latency.wrap(httpx.MockTransport(lambda _: httpx.Response(200, stream=SlowBody())))
+    client = Client(config=_config(), transport=transport)
+
+    assert list(client.list(Node)) == []
+    assert latency.series["get-nodes-200"].total == 2.0
+
+
+def test_api_latency_observed_from_threads():
+    latency = ApiLatency()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for _ in range(4):
+            pool.submit(lambda: [latency.observe("GET", "nodes", 200, 0.01) for _ in range(500)])
+    assert latency.series["get-nodes-200"].count == 2000
+
+
+def test_api_latency_series_are_bounded():
+    latency = ApiLatency()
+    for idx in range(MAX_API_SERIES + 5):
+        latency.observe("GET", f"kind{idx}", 200, 0.01)
+    assert len(latency.series) == MAX_API_SERIES + 1
+    assert latency.series["other"].count == 5
+
+
+def test_api_latency_merge():
+    latency = ApiLatency()
+    latency.observe("GET", "nodes", 200, 0.02)
+    stored = latency.merge({})
+    latency.observe("PATCH", "secrets", 200, 0.3)
+    merged = latency.merge(stored)
+
+    assert Histogram((), merged["get-nodes-200"]).count == 2
+    assert Histogram((), merged["patch-secrets-200"]).maximum == 0.3
@@ -3,16 +3,28 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import base64
 import os
+import shutil
+import ssl
 import unittest.mock as mock
+from datetime import datetime, timezone
 
+import httpx
 import pytest
+import yaml
+from lightkube import codecs
+from lightkube.core.exceptions import ApiError
 from lightkube.models.core_v1 import Container, EnvVar, Volume
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.apiregistration_v1 import APIService
 from lightkube.resources.apps_v1 import DaemonSet
+from lightkube.resources.core_v1 import Secret
+from lightkube.resources.rbac_authorization_v1 import ClusterRole
 
 import provider_manifests
 from charm import KubeControlRequirer, OpenstackIntegrationRequirer, ProviderCharm
-from config import CharmConfig
+from config import MANIFESTS_PATH, TEMPLATES_PATH, CharmConfig
 from provider_manifests import K8S_DEFAULT_NO_PROXY
 
 CLUSTER_NAME = "k8s-cluster-name"
@@ -122,3 +134,357 @@ def test_patch_daemon_set(provider, respect_proxy, no_proxy):
         assert "http_proxy" not in keys
         assert "https_proxy" not in keys
         assert "no_proxy" not in keys
+
+
+def test_installed_resources_lists_once_per_kind(provider, lk_client):
+    """Installed resources are found with one list call per kind and namespace."""
+    expected = {(type(obj.resource), obj.namespace): obj for obj in provider.resources}
+    listed = {
+        kind: [obj.resource for obj in provider.resources if type(obj.resource) is kind]
+        for kind, _ in expected
+    }
+
+    def _list(kind, namespace=None, **_):
+        return listed.get(kind, [])
+
+    lk_client.list.side_effect = _list
+    installed = provider.installed_resources()
+
+    assert installed == frozenset(provider.resources)
+    lk_client.get.assert_not_called()
+    kind_calls = [c for c in lk_client.list.call_args_list if c.args[0] in listed]
+    assert len(kind_calls) == len(expected)
+    labels = {"juju.io/application": provider.model.app.name, "juju.io/manifest": provider.name}
+    assert all(c.kwargs["labels"] == labels for c in kind_calls)
+
+
+def test_client_requests_go_through_instruments(kube_control, charm_config, integrator, lk_client):
+    instrument = mock.MagicMock()
+    provider = provider_manifests.ProviderManifests(
+        mock.MagicMock(spec=ProviderCharm),
+        charm_config,
+        kube_control,
+        integrator,
+        instruments=(instrument,),
+    )
+
+    assert provider.client is lk_client
+    (base,) = instrument.wrap.call_args.args
+    assert isinstance(base, provider_manifests.KubeTransport)
+    provider_manifests.Client.assert_called_once_with(
+        field_manager=mock.ANY, transport=instrument.wrap.return_value
+    )
+
+
+def test_kube_transport_opens_on_first_request(tmp_path, monkeypatch):
+    kubeconfig = tmp_path / "kubeconfig"
+    kubeconfig.write_text(
+        yaml.safe_dump(
+            {
+                "clusters": [{"name": "k8s", "cluster": {"server": "https://apiserver:6443"}}],
+                "users": [{"name": "admin", "user": {"token": "abc"}}],
+                "contexts": [{"name": "k8s", "context": {"cluster": "k8s", "user": "admin"}}],
+                "current-context": "k8s",
+            }
+        )
+    )
+    monkeypatch.setenv("KUBECONFIG", str(kubeconfig))
+    transport = provider_manifests.KubeTransport()
+    request = httpx.Request("GET", "https://apiserver:6443/api/v1/nodes")
+
+    with mock.patch("provider_manifests.httpx.HTTPTransport") as http:
+        transport.handle_request(request)
+        transport.handle_request(request)
+
+    http.assert_called_once()
+    assert isinstance(http.call_args.kwargs["verify"], ssl.SSLContext)
+    assert http.return_value.handle_request.call_count == 2
+
+
+def test_patch_daemon_set_controllers(provider, charm_config):
+    charm_config.available_data["controllers"] = "*,-route"
+    (ds,) = [obj.resource for obj in provider.resources if obj.kind == "DaemonSet"]
+    (container,) = ds.spec.template.spec.containers
+    assert container.args[-1] == "--controllers=*,-route"
+    assert sum(arg.startswith("--controllers=") for arg in container.args) == 1
+
+
+def test_patch_daemon_set_health_probes(provider, charm_config):
+    charm_config.available_data["health-probe-period"] = 10
+    charm_config.available_data["health-probe-failure-threshold"] = 3
+    (ds,) = [obj.resource for obj in provider.resources if obj.kind == "DaemonSet"]
+    (container,) = ds.spec.template.spec.containers
+    readiness, liveness = container.readinessProbe, container.livenessProbe
+    assert readiness.httpGet == liveness.httpGet
+    assert readiness.httpGet.path == "/healthz"
+    assert readiness.httpGet.scheme == "HTTPS"
+    assert (readiness.periodSeconds, readiness.failureThreshold) == (10, 3)
+    assert liveness.initialDelaySeconds == 30
+
+
+def test_patch_daemon_set_without_health_probes(provider, charm_config):
+    charm_config.available_data["health-probe-period"] = 0
+    (ds,) = [obj.resource for obj in provider.resources if obj.kind == "DaemonSet"]
+    (container,) = ds.spec.template.spec.containers
+    assert container.readinessProbe is None
+    assert container.livenessProbe is None
+
+
+def _api_error(code):
+    response = mock.MagicMock()
+    response.json.return_value = {"code": code, "message": "error"}
+    return ApiError(response=response)
+
+
+def _serve_flow_control(lk_client, *versions):
+    def _get(kind, name, **_):
+        if kind is APIService and name.split(".", 1)[0] not in versions:
+            raise _api_error(404)
+        return mock.MagicMock()
+
+    lk_client.get.side_effect = _get
+
+
+@pytest.mark.parametrize(
+    "served, version, shares_field",
+    [
+        (("v1beta2",), "v1beta2", "assuredConcurrencyShares"),
+        (("v1beta2", "v1beta3"), "v1beta3", "nominalConcurrencyShares"),
+        (("v1beta3", "v1"), "v1", "nominalConcurrencyShares"),
+    ],
+)
+def test_create_flow_control(provider, charm_config, lk_client, served, version, shares_field):
+    # the served versions win over the one the release implies
+    charm_config.available_data["manager-release"] = "v1.30.0"
+    charm_config.available_data["api-priority-shares"] = 30
+    _serve_flow_control(lk_client, *served)
+    assert provider.discover_flow_control_api() == version
+    resources = {obj.kind: obj.resource for obj in provider.resources}
+
+    level, schema = resources["PriorityLevelConfiguration"], resources["FlowSchema"]
+    assert level.apiVersion == schema.apiVersion == f"flowcontrol.apiserver.k8s.io/{version}"
+    limited = level.to_dict()["spec"]["limited"]
+    assert limited[shares_field] == 30
+    (rule,) = schema.to_dict()["spec"]["rules"]
+    assert rule["subjects"][0]["serviceAccount"] == {
+        "name": "cloud-controller-manager",
+        "namespace": "kube-system",
+    }
+    assert level.metadata.labels["juju.io/manifest"] == provider.name
+
+
+@pytest.mark.parametrize(
+    "release, version",
+    [("v1.25.6", "v1beta2"), ("v1.28.3", "v1beta3"), ("v1.34.1", "v1")],
+)
+def test_flow_control_version_without_discovery(
+    provider, charm_config, lk_client, release, version
+):
+    charm_config.available_data["manager-release"] = release
+    lk_client.get.side_effect = _api_error(403)
+    assert provider.discover_flow_control_api() is None
+    assert provider.flow_control_api == version
+
+
+def test_flow_control_rendered_without_the_apiserver(provider, charm_config, lk_client):
+    charm_config.available_data["manager-release"] = "v1.28.3"
+    charm_config.available_data["api-priority-shares"] = 30
+    provider.served_flow_control_api = "v1"
+    kinds = {obj.kind: obj.resource.apiVersion for obj in provider.resources}
+    assert kinds["FlowSchema"] == "flowcontrol.apiserver.k8s.io/v1"
+    lk_client.get.assert_not_called()
+
+
+def test_flow_control_disabled_by_default(provider):
+    assert not provider.flow_control
+    assert not {"FlowSchema", "PriorityLevelConfiguration"} & {o.kind for o in provider.resources}
+
+
+def test_orphaned_flow_control(provider, charm_config):
+    charm_config.available_data["manager-release"] = "v1.34.1"
+    orphans = provider.orphaned_resources(None, flow_control=True)
+    assert sorted(map(str, orphans)) == [
+        "FlowSchema/openstack-cloud-controller-manager",
+        "PriorityLevelConfiguration/openstack-cloud-controller-manager",
+    ]
+    charm_config.available_data["api-priority-shares"] = 10
+    assert provider.orphaned_resources(None, flow_control=True) == []
+
+
+@pytest.mark.parametrize(
+    "args, port, host, scheme",
+    [
+        ([], 10258, None, "HTTPS"),
+        (["--bind-address=127.0.0.1"], 10258, "127.0.0.1", "HTTPS"),
+        (["--bind-address=0.0.0.0", "--secure-port=10300"], 10300, None, "HTTPS"),
+        (["--secure-port=0"], 10253, None, "HTTP"),
+        (["--secure-port=0", "--port=10400", "--v=1"], 10400, None, "HTTP"),
+    ],
+)
+def test_healthz_endpoint(args, port, host, scheme):
+    endpoint = provider_manifests.healthz_endpoint(args)
+    assert (endpoint.port, endpoint.host, endpoint.scheme) == (port, host, scheme)
+    assert endpoint.path == "/healthz"
+
+
+@pytest.mark.parametrize("release", ["v1.26.1", "v1.31.0", "v1.34.1"])
+def test_release_rendered_from_template(provider, charm_config, release):
+    charm_config.available_data["manager-release"] = release
+    (ds,) = [obj.resource for obj in provider.resources if obj.kind == "DaemonSet"]
+    (container,) = ds.spec.template.spec.containers
+    params = provider_manifests.release_params(MANIFESTS_PATH / release / "release.yaml")
+    assert container.image.endswith(params["images"][container.name].split("/", 1)[1])
+    assert {obj.kind for obj in provider.resources} >= {"ClusterRole", "ServiceAccount"}
+
+
+def test_merge_cloud_conf():
+    base = "[Global]\nauth-url = https://keystone:5000/v3\nregion = RegionOne\n"
+    overlay = (
+        "[Global]\nregion = RegionTwo\n\n"
+        "[Metadata]\nsearch-order = configDrive,metadataService\n"
+    )
+    encoded = base64.b64encode(base.encode()).decode()
+    merged = base64.b64decode(provider_manifests.merge_cloud_conf(encoded, overlay)).decode()
+    assert merged == (
+        "[Global]\nauth-url = https://keystone:5000/v3\nregion = RegionTwo\n\n"
+        "[Metadata]\nsearch-order = configDrive,metadataService\n"
+    )
+
+
+def test_merge_cloud_conf_keeps_repeated_options():
+    base = (
+        "[Global]\nregion = RegionOne\n\n"
+        "[Networking]\n# tenant networks\ninternal-network-name = net-a\n"
+        "internal-network-name = net-b\npublic-network-name = ext\n\n"
+        "[LoadBalancer]\nlb-provider = amphora\n"
+    )
+    overlay = (
+        "[Networking]\ninternal-network-name = net-c\ninternal-network-name = net-d\n"
+        "ipv6-support-disabled = true\n\n[LoadBalancer]\ncreate-monitor = true\n"
+    )
+    encoded = base64.b64encode(base.encode()).decode()
+    merged = base64.b64decode(provider_manifests.merge_cloud_conf(encoded, overlay)).decode()
+    assert merged == (
+        "[Global]\nregion = RegionOne\n\n"
+        "[Networking]\n# tenant networks\ninternal-network-name = net-c\n"
+        "internal-network-name = net-d\nipv6-support-disabled = true\n"
+        "public-network-name = ext\n\n"
+        "[LoadBalancer]\nlb-provider = amphora\ncreate-monitor = true\n"
+    )
+
+    overlay = "[Global]\nregion = RegionTwo\n"
+    merged = base64.b64decode(provider_manifests.merge_cloud_conf(encoded, overlay)).decode()
+    assert merged.count("internal-network-name") == 2
+
+
+def test_merge_cloud_conf_ignores_the_case_of_names():
+    base = (
+        "[Global]\nauth-url = https://keystone:5000/v3\nRegion = RegionOne\n\n"
+        '[LoadBalancerClass "internal"]\nfloating-network-id = a\n'
+    )
+    overlay = (
+        "[global]\nregion = RegionTwo\n\n"
+        '[loadbalancerclass "internal"]\nFloating-Network-ID = b\n\n'
+        '[LoadBalancerClass "Internal"]\nfloating-network-id = c\n'
+    )
+    encoded = base64.b64encode(base.encode()).decode()
+    merged = base64.b64decode(provider_manifests.merge_cloud_conf(encoded, overlay)).decode()
+    assert merged == (
+        "[Global]\nauth-url = https://keystone:5000/v3\nregion = RegionTwo\n\n"
+        '[LoadBalancerClass "internal"]\nFloating-Network-ID = b\n\n'
+        '[LoadBalancerClass "Internal"]\nfloating-network-id = c\n'
+    )
+
+
+def test_create_secret_with_overlay(provider, charm_config, integrator):
+    base = base64.b64encode(b"[Global]\nregion = RegionOne\n")
+    integrator.cloud_conf_b64 = base
+    charm_config.available_data["cloud-conf"] = base.decode()
+    charm_config.available_data["cloud-conf-overlay"] = "[LoadBalancer]\nlb-method = ROUND_ROBIN"
+    assert provider.evaluate() is None
+
+    create_secret = provider.manipulations[0]
+    secret = create_secret()
+    cloud_conf = base64.b64decode(secret.data["cloud.conf"]).decode()
+    assert "[LoadBalancer]\nlb-method = ROUND_ROBIN" in cloud_conf
+    assert "[Global]\nregion = RegionOne" in cloud_conf
+
+
+def test_create_immutable_secret(provider, charm_config):
+    assert provider.secret_name == "cloud-controller-config"
+    charm_config.available_data["immutable-secret"] = True
+    name = provider.secret_name
+    assert name.startswith("cloud-controller-config-")
+
+    secret = provider.manipulations[0]()
+    assert secret.metadata.name == name
+    assert secret.immutable is True
+    (ds,) = [obj.resource for obj in provider.resources if obj.kind == "DaemonSet"]
+    volumes = [v.secret.secretName for v in ds.spec.template.spec.volumes if v.secret]
+    assert volumes == [name]
+
+    charm_config.available_data["endpoint-ca-cert"] = "ghi"
+    assert provider.secret_name not in (name, "cloud-controller-config")
+
+
+def test_prune_secrets_keeps_current(provider, charm_config, lk_client):
+    charm_config.available_data["immutable-secret"] = True
+    current = provider.secret_name
+    names = [
+        "cloud-controller-config",
+        "cloud-controller-config-0123456789",
+        "cloud-controller-config-abcdefabcd",
+        current,
+        "other",
+    ]
+    secrets = [
+        Secret(
+            metadata=ObjectMeta(
+                name=name, creationTimestamp=datetime(2024, 1, day + 1, tzinfo=timezone.utc)
+            )
+        )
+        for day, name in enumerate(names)
+    ]
+    lk_client.list.side_effect = lambda kind, **_: secrets if kind is Secret else []
+
+    with mock.patch.object(provider, "delete_resources") as delete_resources:
+        deleted = provider.prune_secrets()
+
+    # the newest superseded secret is kept for the previous rollout
+    assert deleted == ["cloud-controller-config-0123456789", "cloud-controller-config"]
+    assert [obj.name for obj in delete_resources.call_args.args] == deleted
+    lk_client.list.assert_any_call(Secret, namespace="kube-system", labels=mock.ANY)
+
+
+def test_evaluate_rejects_unmergeable_cloud_conf(provider, charm_config):
+    charm_config.available_data["cloud-conf"] = base64.b64encode(b"no sections").decode()
+    charm_config.available_data["cloud-conf-overlay"] = "[Global]\nregion = RegionOne"
+    assert provider.evaluate().startswith("Cannot apply cloud-conf-overlay:")
+
+
+@pytest.fixture
+def release_upgrade(provider, tmp_path):
+    """Manifests of an older release shipping an extra ClusterRole."""
+    manifests = tmp_path / "manifests"
+    shutil.copytree(MANIFESTS_PATH / "v1.34.1", manifests / "v1.34.1")
+    shutil.copytree(MANIFESTS_PATH / "v1.34.1", manifests / "v1.33.0")
+    shutil.copytree(TEMPLATES_PATH, tmp_path / "templates")
+    extra = ClusterRole(metadata=ObjectMeta(name="retired-role"))
+    (manifests / "v1.33.0" / "003-retired.yaml").write_text(codecs.dump_all_yaml([extra]))
+    provider.base_path = tmp_path
+    return provider
+
+
+def test_orphaned_resources_from_local_manifests(release_upgrade, lk_client):
+    orphans = release_upgrade.orphaned_resources("v1.33.0")
+    assert [str(obj) for obj in orphans] == ["ClusterRole/retired-role"]
+    assert release_upgrade.orphaned_resources("v1.34.1") == []
+    lk_client.list.assert_not_called()
+
+
+def test_prune_deletes_labelled_orphans(release_upgrade):
+    with mock.patch.object(release_upgrade, "delete_resources") as delete_resources:
+        assert release_upgrade.prune("v1.33.0") == ["ClusterRole/retired-role"]
+    (orphan,) = delete_resources.call_args.args
+    assert str(orphan) == "ClusterRole/retired-role"
+    assert delete_resources.call_args.kwargs == {"ignore_not_found": True}
@@ -0,0 +1,161 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Learn more about testing at: https://juju.is/docs/sdk/testing
+
+import fcntl
+import json
+import unittest.mock as mock
+from pathlib import Path
+
+import pytest
+from lightkube import codecs
+from lightkube.models.meta_v1 import ObjectMeta
+from lightkube.resources.core_v1 import ConfigMap
+
+import provider_manifests
+import reconciler
+from provider_manifests import flow_control_resources
+
+MANIFESTS = codecs.dump_all_yaml(
+    [
+        ConfigMap(metadata=ObjectMeta(name="a", namespace="kube-system")),
+        ConfigMap(metadata=ObjectMeta(name="b", namespace="kube-system")),
+    ]
+)
+
+
+@pytest.fixture
+def state_dir(tmp_path):
+    return tmp_path / "reconciler"
+
+
+@pytest.fixture
+def background(state_dir):
+    return reconciler.BackgroundReconciler(state_dir, Path("/srv/unit/kubeconfig"))
+
+
+@mock.patch("reconciler.subprocess.Popen")
+def test_submit_records_desired_state(popen, background, state_dir):
+    background.submit(1234, "app-manager", MANIFESTS)
+
+    assert background.desired_hash() == 1234
+    assert (state_dir / "desired.yaml").read_text() == MANIFESTS
+    popen.assert_called_once()
+    assert popen.call_args.kwargs["start_new_session"] is True
+    assert popen.call_args.kwargs["env"]["KUBECONFIG"] == "/srv/unit/kubeconfig"
+
+
+@mock.patch("reconciler.subprocess.Popen")
+def test_worker_not_restarted_while_running(popen, background, state_dir):
+    background.submit(1234, "app-manager", MANIFESTS)
+    popen.reset_mock()
+    with (state_dir / "worker.lock").open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert background.running()
+        assert background.ensure_worker() is False
+    assert not background.running()
+    assert background.ensure_worker() is True
+    popen.assert_called_once()
+
+
+def test_ensure_worker_without_desired_state(background):
+    assert background.ensure_worker() is False
+
+
+@mock.patch("reconciler.Client")
+@mock.patch("reconciler.subprocess.Popen", mock.MagicMock())
+def test_worker_applies_desired_state(client, background, state_dir):
+    background.submit(1234, "app-manager", MANIFESTS)
+    worker = reconciler.Worker(state_dir)
+
+    assert worker.apply({"hash": 1234, "field_manager": "app-manager"})
+
+    client.assert_called_once_with(field_manager="app-manager")
+    assert client.return_value.apply.call_count == 2
+    status = background.status()
+    assert status["hash"] == 1234
+    assert status["state"] == "applied"
+    assert status["applied"] == status["total"] == 2
+
+
+@mock.patch("reconciler.Client")
+@mock.patch("reconciler.subprocess.Popen", mock.MagicMock())
+def test_worker_restarts_on_new_desired_state(client, background, state_dir):
+    background.submit(1234, "app-manager", MANIFESTS)
+    background.submit(5678, "app-manager", MANIFESTS)
+
+    worker = reconciler.Worker(state_dir)
+    assert not worker.apply({"hash": 1234, "field_manager": "app-manager"})
+    client.return_value.apply.assert_not_called()
+
+
+@mock.patch("reconciler.Worker.probe")
+@mock.patch("reconciler.Client")
+@mock.patch("reconciler.subprocess.Popen", mock.MagicMock())
+def test_worker_run_stops_without_desired_state(client, probe, background, state_dir):
+    background.submit(1234, "app-manager", MANIFESTS)
+    worker = reconciler.Worker(state_dir)
+    probe.side_effect = lambda _: (state_dir / "desired.json").unlink()
+
+    assert worker.run() == 0
+    assert json.loads((state_dir / "status.json").read_text())["state"] == "applied"
+
+
+@mock.patch("reconciler.Client")
+@mock.patch("reconciler.subprocess.Popen", mock.MagicMock())
+def test_worker_loads_flow_control_versions_of_the_charm(client, background, state_dir):
+    manifests = codecs.dump_all_yaml(flow_control_resources("v1beta3", 30))
+    background.submit(1234, "app-manager", manifests)
+
+    with mock.patch("reconciler.register_flow_control") as register:
+        register.side_effect = provider_manifests.register_flow_control
+        resources = reconciler.Worker(state_dir)._resources()
+
+    register.assert_called_with("v1beta3")
+    assert [r.kind for r in resources] == ["PriorityLevelConfiguration", "FlowSchema"]
+
+
+@mock.patch("reconciler.Worker._wait")
+@mock.patch("reconciler.Client")
+@mock.patch("reconciler.subprocess.Popen", mock.MagicMock())
+def test_worker_reports_unloadable_manifests(client, wait, background, state_dir):
+    manifests = "apiVersion: example.com/v1\nkind: Unknown\nmetadata:\n  name: a\n"
+    background.submit(1234, "app-manager", manifests)
+    wait.side_effect = lambda *_: (state_dir / "desired.json").unlink()
+
+    assert reconciler.Worker(state_dir).run() == 0
+    assert background.status()["state"] == "failed"
+
+
+@mock.patch("reconciler.Client")
+@mock.patch("reconciler.subprocess.Popen", mock.MagicMock())
+def test_worker_prunes_orphans(client, background, state_dir):
+    prune = [
+        {"apiVersion": "v1", "kind": "ConfigMap", "namespace": "kube-system", "name": "a"},
+        {"apiVersion": "v1", "kind": "ConfigMap", "namespace": "kube-system", "name": "old"},
+    ]
+    labels = {"juju.io/application": "openstack-cloud-controller"}
+    background.submit(1234, "app-manager", MANIFESTS, prune, labels)
+    client.return_value.list.return_value = [
+        ConfigMap(metadata=ObjectMeta(name="old", namespace="kube-system"))
+    ]
+
+    desired = json.loads((state_dir / "desired.json").read_text())
+    assert reconciler.Worker(state_dir).apply(desired)
+
+    client.return_value.list.assert_called_once_with(
+        ConfigMap, namespace="kube-system", labels=labels, fields={"metadata.name": "old"}
+    )
+    client.return_value.delete.assert_called_once_with(ConfigMap, "old", namespace="kube-system")
+    status = background.status()
+    assert status["pruned"] == 1234
+    assert status["pruned_resources"] == ["ConfigMap/kube-system/old"]
+
+
+@mock.patch("reconciler.subprocess.Popen", mock.MagicMock())
+def test_submit_carries_over_unpruned_orphans(background, state_dir):
+    orphan = {"apiVersion": "v1", "kind": "ConfigMap", "namespace": "kube-system", "name": "old"}
+    background.submit(1234, "app-manager", MANIFESTS, [orphan])
+    background.submit(5678, "app-manager", MANIFESTS)
+    assert json.loads((state_dir / "desired.json").read_text())["prune"] == [orphan]
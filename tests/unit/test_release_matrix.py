@@ -0,0 +1,78 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Learn more about testing at: https://juju.is/docs/sdk/testing
+
+import shutil
+from pathlib import Path
+
+import pytest
+
+import release_matrix
+from config import MANIFESTS_PATH, RELEASE_PARAMS, TEMPLATES_PATH, shipped_releases
+from provider_manifests import release_params
+
+RELEASE = "v1.34.1"
+
+
+@pytest.fixture
+def broken_root(tmp_path):
+    """Charm root whose only release dropped the CLUSTER_NAME env var and secret volume."""
+    shutil.copytree(MANIFESTS_PATH / RELEASE, tmp_path / MANIFESTS_PATH / RELEASE)
+    template = (
+        tmp_path
+        / TEMPLATES_PATH
+        / release_params(MANIFESTS_PATH / RELEASE / RELEASE_PARAMS)["template"]
+    )
+    shutil.copytree(TEMPLATES_PATH / template.name, template)
+    (ds,) = template.glob("*-ds.yaml")
+    content = ds.read_text()
+    content = content.replace("CLUSTER_NAME", "CLUSTER_LABEL")
+    content = content.replace("secret:\n          secretName: cloud-config", "emptyDir: {}")
+    ds.write_text(content)
+    return tmp_path
+
+
+def test_every_shipped_release_renders_cleanly():
+    results = release_matrix.render_matrix(workers=2)
+
+    assert len(results) == len(shipped_releases()) * len(release_matrix.FIXTURES)
+    assert [f"{r.release} [{r.fixture}] {r.problems}" for r in results if not r.ok] == []
+    assert all(r.resources > 0 for r in results)
+
+
+@pytest.mark.parametrize("release", ["v1.25.6", RELEASE])
+def test_flow_schema_matches_the_controllers(release):
+    config = release_matrix.FIXTURES["priority"]
+    manifests = release_matrix._manifests(Path("."), release, config)
+    (schema,) = [obj.resource for obj in manifests.resources if obj.kind == "FlowSchema"]
+    matched = {name for _, name in release_matrix.flow_schema_service_accounts(schema)}
+
+    # a request of the cloud-node controller's service account falls under the schema
+    assert {"cloud-controller-manager", "cloud-node-controller"} <= matched
+    # controllers calling the apiserver as themselves with their service account credentials
+    assert ("service-controller" in matched) == (release == "v1.25.6")
+
+
+def test_render_flags_patches_that_did_nothing(broken_root):
+    result = release_matrix.render(broken_root, RELEASE, "default", {})
+
+    assert not result.ok
+    assert result.problems == (
+        "UpdateDaemonSet: no secret volume mounting cloud-controller-config",
+        "UpdateDaemonSet: CLUSTER_NAME env var not set",
+    )
+
+
+def test_render_reports_failures():
+    result = release_matrix.render(Path("."), "v0.0.0", "default", {})
+    assert result.problems == (
+        "UpdateDaemonSet: no openstack-cloud-controller-manager DaemonSet in the release",
+    )
+
+
+def test_main_exit_code(broken_root, capsys):
+    assert release_matrix.main(["--root", str(broken_root), "--workers", "1"]) == 1
+    out = capsys.readouterr().out
+    assert f"{RELEASE} [registry] UpdateDaemonSet: CLUSTER_NAME env var not set" in out
+    assert "6 renders in" in out
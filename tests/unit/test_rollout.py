@@ -0,0 +1,163 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Learn more about testing at: https://juju.is/docs/sdk/testing
+
+import unittest.mock as mock
+from pathlib import Path
+
+import pytest
+from lightkube import codecs
+from lightkube.core.exceptions import ApiError
+from lightkube.models.apps_v1 import DaemonSetStatus
+from lightkube.models.coordination_v1 import LeaseSpec
+from lightkube.models.core_v1 import Probe
+from lightkube.resources.apps_v1 import DaemonSet
+from lightkube.resources.coordination_v1 import Lease
+from ops.manifests import HashableResource
+
+import rollout
+from provider_manifests import healthz_endpoint
+
+DS_PATH = Path(
+    "upstream/controller_manager/templates/v1.34.0/002-openstack-cloud-controller-manager-ds.yaml"
+)
+
+
+def _daemonset(image=None, generation=1, status=None):
+    (ds,) = [
+        obj for obj in codecs.load_all_yaml(DS_PATH.read_text()) if isinstance(obj, DaemonSet)
+    ]
+    if image:
+        ds.spec.template.spec.containers[0].image = image
+    ds.metadata.generation = generation
+    ds.status = status
+    return ds
+
+
+@pytest.fixture
+def manifests():
+    manifests = mock.MagicMock()
+    manifests.name = "openstack-cloud-controller-manager"
+    manifests.model.app.name = "openstack-cloud-controller"
+    manifests.current_release = "v1.34.1"
+    manifests.config = {"image-registry": "rocks.canonical.com/cdk"}
+    manifests.resources = [HashableResource(_daemonset("rocks.canonical.com/cdk/occm:v2"))]
+    return manifests
+
+
+@pytest.mark.parametrize(
+    "status, complete",
+    [
+        (None, False),
+        (DaemonSetStatus(0, 3, 0, 0, observedGeneration=1), False),
+        (DaemonSetStatus(3, 3, 0, 1, observedGeneration=2, updatedNumberScheduled=3), False),
+        (DaemonSetStatus(3, 3, 0, 3, observedGeneration=1, updatedNumberScheduled=3), False),
+        (DaemonSetStatus(3, 3, 0, 3, observedGeneration=2, updatedNumberScheduled=3), True),
+    ],
+)
+def test_daemonset_progress(status, complete):
+    progress = rollout.DaemonSetProgress.from_daemonset(_daemonset(generation=2, status=status))
+    assert progress.complete is complete
+
+
+@mock.patch("rollout.time.sleep")
+def test_wait_for_daemonset_reports_progress(sleep, manifests):
+    statuses = [
+        DaemonSetStatus(3, 3, 0, 0, observedGeneration=1, updatedNumberScheduled=0),
+        DaemonSetStatus(3, 3, 0, 1, observedGeneration=1, updatedNumberScheduled=1),
+        DaemonSetStatus(3, 3, 0, 3, observedGeneration=1, updatedNumberScheduled=3),
+    ]
+    manifests.client.get.side_effect = [_daemonset(status=s) for s in statuses]
+    seen = []
+
+    progress = rollout.wait_for_daemonset(manifests, "ds", 60, seen.append)
+
+    assert progress.complete
+    assert [str(p) for p in seen] == [
+        "0/3 updated, 0/3 ready",
+        "1/3 updated, 1/3 ready",
+        "3/3 updated, 3/3 ready",
+    ]
+    assert sleep.call_count == 2
+
+
+def test_wait_for_daemonset_respects_budget(manifests):
+    status = DaemonSetStatus(3, 3, 0, 0, observedGeneration=1)
+    manifests.client.get.return_value = _daemonset(status=status)
+    progress = rollout.wait_for_daemonset(manifests, "ds", 0)
+    assert not progress.complete
+    manifests.client.get.assert_called_once()
+
+
+def test_prepull_pending_images(manifests):
+    prepull = rollout.ImagePrePull(manifests)
+    manifests.client.get.return_value = _daemonset("rocks.canonical.com/cdk/occm:v1")
+    assert prepull.pending_images() == ["rocks.canonical.com/cdk/occm:v2"]
+
+    manifests.client.get.return_value = _daemonset("rocks.canonical.com/cdk/occm:v2")
+    assert prepull.pending_images() == []
+
+
+def test_prepull_nothing_pending_on_install(manifests):
+    not_found = mock.MagicMock()
+    not_found.json.return_value = {"code": 404, "message": "not found"}
+    manifests.client.get.side_effect = ApiError(response=not_found)
+    assert rollout.ImagePrePull(manifests).pending_images() == []
+
+
+def test_prepull_daemonset(manifests):
+    ds = rollout.ImagePrePull(manifests).daemonset(["rocks.canonical.com/cdk/occm:v2"])
+    pod = ds.spec.template.spec
+    target = manifests.resources[0].resource.spec.template.spec
+
+    assert ds.metadata.name == "openstack-cloud-controller-manager-prepull"
+    assert ds.metadata.labels["juju.io/application"] == "openstack-cloud-controller"
+    assert pod.nodeSelector == target.nodeSelector
+    assert pod.tolerations == target.tolerations
+    helper, init = pod.initContainers
+    assert helper.image == "rocks.canonical.com/cdk/library/busybox:1.36"
+    assert helper.command == ["cp", "/bin/busybox", "/prepull-bin/true"]
+    assert init.image == "rocks.canonical.com/cdk/occm:v2"
+    assert init.command == ["/prepull-bin/true"]
+    assert init.volumeMounts == helper.volumeMounts
+    (pause,) = pod.containers
+    assert pause.image == "rocks.canonical.com/cdk/library/busybox:1.36"
+
+
+def test_prepull_helper_image(manifests):
+    prepull = rollout.ImagePrePull(manifests, "mirror.example.com/tools/busybox:stable")
+    ds = prepull.daemonset(["rocks.canonical.com/cdk/occm:v2"])
+    pod = ds.spec.template.spec
+    images = {c.image for c in pod.initContainers[:1] + pod.containers}
+    assert images == {"mirror.example.com/tools/busybox:stable"}
+
+
+def test_blue_green_daemonset(manifests):
+    target = manifests.resources[0].resource
+    container = target.spec.template.spec.containers[0]
+    container.readinessProbe = Probe(httpGet=healthz_endpoint(container.args))
+
+    ds = rollout.BlueGreenUpgrade(manifests).daemonset()
+    (green,) = ds.spec.template.spec.containers
+
+    assert ds.metadata.name == "openstack-cloud-controller-manager-green"
+    assert ds.spec.selector.matchLabels == {"k8s-app": ds.metadata.name}
+    assert ds.spec.template.metadata.labels["k8s-app"] == ds.metadata.name
+    assert green.image == container.image
+    assert green.args[-1] == "--secure-port=10268"
+    assert green.readinessProbe.httpGet.port == 10268
+    # the rendered DaemonSet is left untouched
+    assert target.metadata.name == "openstack-cloud-controller-manager"
+    assert container.readinessProbe.httpGet.port == 10258
+
+
+def test_blue_green_leader(manifests):
+    upgrade = rollout.BlueGreenUpgrade(manifests)
+    manifests.client.get.return_value = Lease(spec=LeaseSpec(holderIdentity="node-1_abc"))
+    assert upgrade.leader() == "node-1_abc"
+
+    not_found = mock.MagicMock()
+    not_found.json.return_value = {"code": 404, "message": "not found"}
+    manifests.client.get.side_effect = ApiError(response=not_found)
+    assert upgrade.leader() is None
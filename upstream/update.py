@@ -2,11 +2,13 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
 """Update to a new upstream release."""
+
 import argparse
 import contextlib
 import json
 import logging
 import re
+import shutil
 import subprocess
 import sys
 import urllib.error
@@ -16,9 +18,12 @@ from dataclasses import dataclass
 from itertools import accumulate
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import Generator, List, Optional, Set, Tuple, TypedDict
+from typing import Dict, Generator, Iterator, List, Optional, Set, Tuple, TypedDict
 
 import yaml
+from config import RELEASE_PARAMS
+from release_matrix import render_matrix, report
+from rollout import PREPULL_HELPER_IMAGE
 from semver import VersionInfo
 
 log = logging.getLogger("updating controller-manager")
@@ -49,7 +54,6 @@ SOURCES = dict(
 
 FILEDIR = Path(__file__).parent
 VERSION_RE = re.compile(r"^v\d+\.\d+")
-IMG_RE = re.compile(r"^\s+image:\s+(\S+)")
 
 
 @dataclass(frozen=True)
@@ -137,13 +141,17 @@ def sync_asset(image: str, registry: Registry):
 
 def main(source: str, registry: Registry, check: bool, debug: bool):
     """Main update logic."""
-    local_releases = gather_current(source)
+    local_releases = set(templatize(source, release) for release in gather_current(source))
     gh_releases = gather_releases(source)
     new_releases = gh_releases - local_releases
-    for release in new_releases:
-        local_releases.add(download(source, release))
+    for release in sorted(new_releases):
+        local_releases.add(templatize(source, download(source, release)))
     unique_releases = list(dict.fromkeys(accumulate((sorted(local_releases)), dedupe)))
+    prune_templates(source, unique_releases)
+    validate(unique_releases)
     all_images = set(image for release in unique_releases for image in images(release))
+    # the image pre-pull runs its helper from the same registry as the release images
+    all_images.add(PREPULL_HELPER_IMAGE)
     mirror_image(all_images, registry, check, debug)
     return unique_releases[-1].name, all_images
 
@@ -185,9 +193,10 @@ def gather_releases(source: str) -> Tuple[str, Set[Release]]:
 def gather_current(source: str) -> Set[Release]:
     """Gather currently supported manifests by the charm."""
     manifests = SOURCES[source]["manifests"]
+    names = [f"{idx:03}-{man}" for idx, man in enumerate(manifests)] + [RELEASE_PARAMS]
     releases = defaultdict(list)
     for release_path in (FILEDIR / source / "manifests").glob("*/*.yaml"):
-        if release_path.name in [f"{idx:03}-{man}" for idx, man in enumerate(manifests)]:
+        if release_path.name in names:
             releases[release_path.parent.name].append(release_path)
     return set(Release(version, files) for version, files in releases.items())
 
@@ -217,6 +226,68 @@ def download(source: str, release: Release) -> Release:
     return Release(release.name, paths)
 
 
+def _containers(doc: Dict) -> Iterator[Dict]:
+    """Containers of a workload's pod template, or of the workloads in a List."""
+    for item in doc.get("items") or []:
+        yield from _containers(item)
+    pod = ((doc.get("spec") or {}).get("template") or {}).get("spec") or {}
+    yield from (pod.get("initContainers") or []) + (pod.get("containers") or [])
+
+
+def structure(paths: List[Path]) -> Tuple[Dict[str, List], Dict[str, str]]:
+    """Parsed manifests of a release without their images, and the images by container name."""
+    documents, images = {}, {}
+    for path in sorted(paths):
+        docs = [doc for doc in yaml.safe_load_all(path.read_text()) if doc]
+        for doc in docs:
+            for container in _containers(doc):
+                images[container["name"]] = container.pop("image")
+        documents[path.name] = docs
+    return documents, images
+
+
+def templatize(source: str, release: Release) -> Release:
+    """Store a release as the params of the template sharing its structure.
+
+    Releases differing only by their images share a single copy of their
+    manifests under templates, named after the first release with that
+    structure. Each release only keeps the name of its template and its
+    images in a params file, which the charm renders when it's selected.
+    """
+    release_dir = FILEDIR / source / "manifests" / release.name
+    params = release_dir / RELEASE_PARAMS
+    if [Path(path) for path in release.paths] == [params]:
+        return release
+
+    documents, images = structure(release.paths)
+    templates = FILEDIR / source / "templates"
+    templates.mkdir(exist_ok=True)
+    for template in sorted(templates.iterdir()):
+        if structure(list(template.glob("*.yaml")))[0] == documents:
+            log.info(f"Release {release.name} shares the template of {template.name}")
+            break
+    else:
+        template = templates / release.name
+        template.mkdir()
+        log.info(f"Adding template {template.name}")
+        for path in release.paths:
+            shutil.copy(path, template / Path(path).name)
+
+    for path in release.paths:
+        Path(path).unlink()
+    params.write_text(yaml.safe_dump({"template": template.name, "images": images}))
+    return Release(release.name, [params])
+
+
+def prune_templates(source: str, releases: List[Release]):
+    """Remove the templates no remaining release renders from."""
+    used = {yaml.safe_load(path.read_text())["template"] for r in releases for path in r.paths}
+    for template in (FILEDIR / source / "templates").iterdir():
+        if template.name not in used:
+            log.info(f"Deleting unused template {template.name}")
+            shutil.rmtree(template)
+
+
 def dedupe(this: Release, next: Release) -> Release:
     """Remove duplicate releases.
 
@@ -243,15 +314,18 @@ def dedupe(this: Release, next: Release) -> Release:
     return this
 
 
+def validate(releases: List[Release]):
+    """Render each release through the charm's patches, failing if any patch didn't apply."""
+    results = render_matrix(FILEDIR.parent, [release.name for release in releases])
+    log.info(report(results))
+    if not all(result.ok for result in results):
+        raise SystemExit("Some releases no longer render cleanly through the charm")
+
+
 def images(release: Release) -> Generator[str, None, None]:
     """Yield all images from each release."""
     for path in release.paths:
-        manifest = FILEDIR / source / "manifests" / release.name / Path(path).name
-        with manifest.open() as fp:
-            for line in fp:
-                m = IMG_RE.match(line)
-                if m:
-                    yield m.groups()[0]
+        yield from yaml.safe_load(Path(path).read_text())["images"].values()
 
 
 def mirror_image(images: List[str], registry: Registry, check: bool, debug: bool):
@@ -277,6 +351,7 @@ def mirror_image(images: List[str], registry: Registry, check: bool, debug: bool
                 log.warning(line.strip())
             proc.poll()
 
+
 def get_argparser():
     """Build the argparse instance."""
     parser = argparse.ArgumentParser(